@@ -0,0 +1,180 @@
+# anuncios.py
+# Anuncios por voz en la pantalla pública ("M-A05, mesón 3").
+#
+# Cada anuncio se arma con grabaciones cortas (segmentos) de VOZ_SEGMENTOS_DIR:
+#   letra_<X>.mp3    cada letra de los prefijos y de la serie (letra_M, letra_A...)
+#   numero_<NN>.mp3  los números del ticket, de numero_00 a numero_99
+#   meson_<N>.mp3    "mesón 1", "mesón 2"... según los mesones en uso
+# Todos con el mismo formato (p. ej. MP3 mono, 22050 Hz, misma tasa de bits).
+#
+# Los segmentos se concatenan cuadro a cuadro, sin decodificar ni volver a
+# codificar: solo se quitan sus etiquetas ID3. El resultado se guarda como un
+# archivo listo en VOZ_CACHE_DIR, por (numero_ticket, numero_meson) y por la
+# huella de la biblioteca de segmentos (si se cambian las grabaciones, cambian
+# las URL). Así cada llamado cuesta leer un archivo ya hecho.
+#
+# Si falta algún segmento del anuncio, el llamado no trae audio y la pantalla
+# solo hace sonar la alerta. 'flask voz-segmentos' lista los que faltan.
+
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+from flask import url_for
+
+from metricas import encabezado, linea
+
+
+def _sin_etiquetas(datos):
+    """Cuadros MP3 del archivo, sin las etiquetas ID3v2 (al inicio) e ID3v1 (al final)."""
+    inicio = 0
+    if datos[:3] == b'ID3' and len(datos) >= 10:
+        # Tamaño en 4 bytes de 7 bits ("synchsafe"), más el encabezado y el pie si lo hay
+        tamano = (datos[6] << 21) | (datos[7] << 14) | (datos[8] << 7) | datos[9]
+        inicio = 10 + tamano + (10 if datos[5] & 0x10 else 0)
+    fin = len(datos)
+    if fin - inicio >= 128 and datos[fin - 128:fin - 125] == b'TAG':
+        fin -= 128
+    return datos[inicio:fin]
+
+
+def segmentos_de(numero_ticket, numero_meson):
+    """Nombres de los segmentos de "M-A05, mesón 3", en orden; None si el número no tiene esa forma."""
+    prefijo, _, serie = numero_ticket.rpartition('-')
+    if not prefijo or len(serie) != 3 or not serie[1:].isdigit() or numero_meson is None:
+        return None
+    return [f'letra_{letra}' for letra in prefijo.upper() + serie[0].upper()] + \
+        [f'numero_{serie[1:]}', f'meson_{int(numero_meson)}']
+
+
+class AnunciosVoz:
+    """Compone y guarda los anuncios de los llamados a partir de los segmentos grabados.
+
+    Se inicializa como las demás extensiones (``init_app``). Configuración:
+
+    * ``VOZ_SEGMENTOS_DIR``: carpeta con las grabaciones (letra_X, numero_NN, meson_N).
+    * ``VOZ_CACHE_DIR``: carpeta de los anuncios ya compuestos.
+    * ``VOZ_CACHE_MAX``: anuncios que se conservan; sobre eso se borran los menos usados.
+    """
+
+    def __init__(self, app=None, **kwargs):
+        self.maximo = 5000
+        self._carpeta = None
+        self._cache_dir = None
+        self._segmentos = set()
+        self._mtime_carpeta = None
+        self.huella = None
+        self._en_cache = OrderedDict()  # nombre de archivo -> None, del menos al más usado
+        self._lock = threading.Lock()
+        self.estadisticas = {'acierto': 0, 'compuesto': 0, 'sin_segmentos': 0}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self._carpeta = app.config.get('VOZ_SEGMENTOS_DIR')
+        self._cache_dir = app.config.get('VOZ_CACHE_DIR')
+        self.maximo = app.config.get('VOZ_CACHE_MAX', 5000)
+        app.extensions['anuncios_voz'] = self
+        self._leer_biblioteca()
+
+    # --- BIBLIOTECA DE SEGMENTOS ---
+    def _leer_biblioteca(self):
+        """Relee la carpeta de segmentos solo si cambió (se revisa su fecha de modificación)."""
+        try:
+            mtime = os.stat(self._carpeta).st_mtime_ns
+        except (OSError, TypeError):
+            self._segmentos, self.huella, self._mtime_carpeta = set(), None, None
+            return
+        if mtime == self._mtime_carpeta:
+            return
+        with self._lock:
+            archivos = sorted(n for n in os.listdir(self._carpeta) if n.endswith('.mp3'))
+            firma = hashlib.sha256()
+            for nombre in archivos:
+                info = os.stat(os.path.join(self._carpeta, nombre))
+                firma.update(f'{nombre}:{info.st_size}:{info.st_mtime_ns};'.encode())
+            self._segmentos = {n[:-4] for n in archivos}
+            self.huella = firma.hexdigest()[:12] if archivos else None
+            self._mtime_carpeta = mtime
+            self._cargar_cache()
+
+    def _cargar_cache(self):
+        """Anuncios ya compuestos con la huella actual; los de bibliotecas anteriores se borran."""
+        self._en_cache.clear()
+        if not self._cache_dir or not self.huella:
+            return
+        os.makedirs(os.path.join(self._cache_dir, self.huella), exist_ok=True)
+        for carpeta in os.listdir(self._cache_dir):
+            ruta = os.path.join(self._cache_dir, carpeta)
+            if carpeta != self.huella and os.path.isdir(ruta):
+                for nombre in os.listdir(ruta):
+                    os.remove(os.path.join(ruta, nombre))
+                os.rmdir(ruta)
+        actual = os.path.join(self._cache_dir, self.huella)
+        for nombre in sorted(os.listdir(actual), key=lambda n: os.stat(os.path.join(actual, n)).st_mtime_ns):
+            self._en_cache[nombre] = None
+
+    def faltantes(self, numeros_ticket, numeros_meson):
+        """Segmentos que faltan para anunciar esos tickets en esos mesones."""
+        self._leer_biblioteca()
+        necesarios = set()
+        for numero_ticket in numeros_ticket:
+            for numero_meson in numeros_meson:
+                necesarios.update(segmentos_de(numero_ticket, numero_meson) or ())
+        return sorted(necesarios - self._segmentos)
+
+    # --- ANUNCIOS ---
+    def url(self, numero_ticket, numero_meson):
+        """URL del anuncio, o None si faltan segmentos (entonces solo suena la alerta)."""
+        self._leer_biblioteca()
+        segmentos = segmentos_de(numero_ticket, numero_meson)
+        if not self.huella or not self._cache_dir or not segmentos or not self._segmentos.issuperset(segmentos):
+            self.estadisticas['sin_segmentos'] += 1
+            return None
+        return url_for('anuncio_voz', huella=self.huella, numero_ticket=numero_ticket, numero_meson=numero_meson)
+
+    def archivo(self, huella, numero_ticket, numero_meson):
+        """Ruta del anuncio listo para servir (lo compone la primera vez); None si no se puede."""
+        self._leer_biblioteca()
+        segmentos = segmentos_de(numero_ticket, numero_meson)
+        if huella != self.huella or not segmentos or not self._segmentos.issuperset(segmentos):
+            return None
+        nombre = f'{numero_ticket}_{int(numero_meson)}.mp3'
+        ruta = os.path.join(self._cache_dir, self.huella, nombre)
+        with self._lock:
+            if nombre in self._en_cache and os.path.exists(ruta):
+                self._en_cache.move_to_end(nombre)
+                self.estadisticas['acierto'] += 1
+                return ruta
+        self._componer(segmentos, ruta)
+        with self._lock:
+            self._en_cache[nombre] = None
+            self.estadisticas['compuesto'] += 1
+            while len(self._en_cache) > self.maximo:
+                viejo, _ = self._en_cache.popitem(last=False)
+                try:
+                    os.remove(os.path.join(self._cache_dir, self.huella, viejo))
+                except OSError:
+                    pass
+        return ruta
+
+    def _componer(self, segmentos, ruta):
+        partes = []
+        for segmento in segmentos:
+            with open(os.path.join(self._carpeta, f'{segmento}.mp3'), 'rb') as archivo:
+                partes.append(_sin_etiquetas(archivo.read()))
+        # Se escribe aparte y se reemplaza: quien lo pida a la vez nunca ve un archivo a medias
+        temporal = f'{ruta}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(temporal, 'wb') as archivo:
+            archivo.write(b''.join(partes))
+        os.replace(temporal, ruta)
+
+    def lineas_prometheus(self):
+        lineas = encabezado('turnos_anuncios_voz_total', 'counter',
+                            'Anuncios por voz: servidos de la caché, compuestos o sin segmentos grabados.')
+        for resultado, cantidad in sorted(self.estadisticas.items()):
+            lineas.append(linea('turnos_anuncios_voz_total', cantidad, resultado=resultado))
+        lineas += encabezado('turnos_anuncios_voz_cache', 'gauge', 'Anuncios compuestos guardados en disco.')
+        lineas.append(linea('turnos_anuncios_voz_cache', len(self._en_cache)))
+        return lineas
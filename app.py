@@ -2,54 +2,97 @@
 
 import os
 
-from flask import Flask, config, render_template, request, redirect, url_for, flash, session, Response
+from flask import Flask, config, current_app, render_template, request, redirect, url_for, flash, session, Response, jsonify, send_file
 from flask_sqlalchemy import SQLAlchemy
 from sqlalchemy.orm import relationship, aliased
-from sqlalchemy.exc import IntegrityError
-from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError, TimeoutError as PoolTimeoutError
+from sqlalchemy import func, select, insert, update, delete, literal, union_all, text
 from flask_login import LoginManager, UserMixin, login_user, logout_user, login_required, current_user
 from werkzeug.security import generate_password_hash, check_password_hash
 from werkzeug.middleware.proxy_fix import ProxyFix
 from flask_wtf import FlaskForm
 from wtforms import StringField, PasswordField, SubmitField, SelectField, IntegerField, BooleanField
-from wtforms.validators import DataRequired, Optional
+from wtforms.validators import DataRequired, Optional, NumberRange, ValidationError
 from flask_wtf.csrf import CSRFProtect
 from functools import wraps
 from datetime import datetime, date, timedelta
 from flask_socketio import SocketIO, join_room
-from flask_migrate import Migrate
-import sentry_sdk
-from logging.handlers import RotatingFileHandler
 import logging
-import io
-import csv
+import click
 import pytz
-import qrcode
-import base64
+import hmac
 from dotenv import load_dotenv
+from difusion import ProgramadorDifusion
+from metricas import Metricas
+from perfilado import Perfilador, resumir as resumir_perfilado
+from bitacora import configurar_bitacora
+from conexiones import PoolMedido, opciones_motor
+from replicas import SesionConReplica, lectura_en_replica, en_primaria
+from versiones import CacheVistas
+from estimaciones import EstimadorEspera
+from recursos import RecursosEstaticos
+from rut import normalizar_rut, formatear_rut
+from paginacion import despues_de, orden, cortar_pagina, decodificar_cursor, paginar
+from tareas import ProgramadorTareas
+from registro_diferido import RegistroDiferido, siguiente_numero
+from reconexiones import ControlReconexiones
+from anuncios import AnunciosVoz
+from sqlite_produccion import ModoSQLite, ids_de_ticket_reutilizables
 
 # --- INICIALIZACIÓN DE EXTENSIONES (SIN APP) ---
 # Creamos las instancias de las extensiones aquí, pero sin inicializarlas.
 # Se inicializarán dentro de la función create_app.
-db = SQLAlchemy()
-migrate = Migrate()
+db = SQLAlchemy(session_options={'class_': SesionConReplica})  # Ver replicas.py
 login_manager = LoginManager()
 csrf = CSRFProtect()
 socketio = SocketIO()
+difusion = ProgramadorDifusion()
+metricas = Metricas()
+perfilador = Perfilador()
+cache_vistas = CacheVistas()
+estimador_espera = EstimadorEspera()
+recursos = RecursosEstaticos()
+programador = ProgramadorTareas()
+registro_diferido = RegistroDiferido()
+reconexiones = ControlReconexiones()
+modo_sqlite = ModoSQLite()
+anuncios = AnunciosVoz()
 
 # Definimos la zona horaria globalmente para usarla en los modelos
 zona_horaria_chile = pytz.timezone('America/Santiago')
 
 # --- MODELOS DE LA BASE DE DATOS ---
 # Los modelos pueden definirse aquí sin problemas.
+
+# Cada sede (campus) tiene sus propios servicios, colas, pantalla y configuración.
+# Las tablas con mucho movimiento guardan 'sede_id' y sus índices parten por él,
+# así la carga de una sede no encarece las consultas de las demás.
+class Sede(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    nombre = db.Column(db.String(100), nullable=False, unique=True)
+    codigo = db.Column(db.String(20), nullable=False, unique=True)  # En la URL de su pantalla: /sede/<codigo>
+
 class Usuario(db.Model, UserMixin):
+    __table_args__ = (
+        # Listado de funcionarios de una sede, por nombre
+        db.Index('ix_usuario_sede_nombre', 'sede_id', 'nombre_funcionario'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     nombre_funcionario = db.Column(db.String(100), nullable=False, unique=True)
     password_hash = db.Column(db.String(256))
     rol = db.Column(db.String(50), nullable=False)
-    modulo_asignado = db.Column(db.String(100), nullable=True)
+    # Sin sede solo los administradores de todas las sedes
+    sede_id = db.Column(db.Integer, db.ForeignKey('sede.id'), nullable=True)
+    sede = relationship('Sede')
+    servicio_id = db.Column(db.Integer, db.ForeignKey('servicio.id'), nullable=True)
+    servicio = relationship('Servicio')
     numero_meson = db.Column(db.Integer, nullable=True)
     @property
+    def modulo_asignado(self):
+        """Nombre del servicio asignado (solo para mostrar; las consultas usan servicio_id)."""
+        return self.servicio.nombre_modulo if self.servicio else None
+    @property
     def password(self):
         raise AttributeError('password is not a readable attribute')
     @password.setter
@@ -59,18 +102,41 @@ class Usuario(db.Model, UserMixin):
         return check_password_hash(self.password_hash, password)
 
 class Servicio(db.Model):
+    __table_args__ = (
+        # Nombre y prefijo se repiten entre sedes (cada una tiene su "Matrícula")
+        db.UniqueConstraint('sede_id', 'nombre_modulo', name='uq_servicio_sede_nombre'),
+        db.UniqueConstraint('sede_id', 'prefijo_ticket', name='uq_servicio_sede_prefijo'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
-    nombre_modulo = db.Column(db.String(100), nullable=False, unique=True)
-    prefijo_ticket = db.Column(db.String(3), nullable=False, unique=True)
+    sede_id = db.Column(db.Integer, db.ForeignKey('sede.id'), nullable=False)
+    nombre_modulo = db.Column(db.String(100), nullable=False)
+    prefijo_ticket = db.Column(db.String(3), nullable=False)
     letra_actual = db.Column(db.String(1), default='A', nullable=False)
     numero_actual = db.Column(db.Integer, default=0)
     color_hex = db.Column(db.String(7), nullable=False, default='#000000')
     visible_en_pantalla = db.Column(db.Boolean, default=True, nullable=False)
 
 class Ticket(db.Model):
+    __table_args__ = (
+        # Permite encontrar rápido los tickets finalizados antiguos que se deben archivar
+        db.Index('ix_ticket_estado_hora_registro', 'estado', 'hora_registro'),
+        # Cola de cada servicio, en el mismo orden en que se llama ('llamar_siguiente')
+        db.Index('ix_ticket_cola', 'sede_id', 'servicio_id', 'estado', 'es_preferencial', 'hora_registro'),
+        # Llamados de la pantalla pública de cada sede
+        db.Index('ix_ticket_sede_llamado', 'sede_id', 'estado', 'hora_llamado'),
+        # Estadísticas del día de cada sede (dashboard)
+        db.Index('ix_ticket_sede_registro', 'sede_id', 'hora_registro'),
+        # Historial de visitas de una persona, de la más reciente a la más antigua
+        db.Index('ix_ticket_rut', 'rut_cliente', 'hora_registro', 'id'),
+        # Los tickets archivados conservan su id (seguimiento, QR, eventos): en SQLite,
+        # sin AUTOINCREMENT, al vaciarse 'ticket' se volverían a entregar los mismos ids
+        {'sqlite_autoincrement': True},
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     numero_ticket = db.Column(db.String(10), nullable=False, unique=False)
-    rut_cliente = db.Column(db.String(15), nullable=False)
+    rut_cliente = db.Column(db.String(15), nullable=False)  # Normalizado: 'NNNNNNNN-D' (ver rut.py)
     modulo_solicitado = db.Column(db.String(100), nullable=False)
     estado = db.Column(db.String(20), default='en_espera')
     hora_registro = db.Column(db.DateTime, nullable=False)
@@ -82,9 +148,11 @@ class Ticket(db.Model):
     es_preferencial = db.Column(db.Boolean, default=False)
     servicio_id = db.Column(db.Integer, db.ForeignKey('servicio.id'), nullable=False)
     servicio = relationship('Servicio')
+    sede_id = db.Column(db.Integer, db.ForeignKey('sede.id'), nullable=False)  # La del servicio
     numero_meson = db.Column(db.Integer, nullable=True)
 
-    def get_hora_chile(self, fecha):
+    @staticmethod
+    def get_hora_chile(fecha):
         """Convierte una fecha UTC (o naive) a hora de Chile."""
         if not fecha:
             return None
@@ -93,6 +161,112 @@ class Ticket(db.Model):
             return zona_horaria_chile.localize(fecha)
         return fecha.astimezone(zona_horaria_chile)
 
+# Tickets finalizados antiguos. Se mueven aquí (conservando su id) con el comando
+# 'flask archive-tickets' para que la tabla 'ticket' solo contenga el trabajo vivo.
+class TicketArchive(db.Model):
+    __table_args__ = (
+        db.Index('ix_ticket_archive_rut', 'rut_cliente', 'hora_registro', 'id'),
+        db.Index('ix_ticket_archive_sede_registro', 'sede_id', 'hora_registro'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    numero_ticket = db.Column(db.String(10), nullable=False)
+    rut_cliente = db.Column(db.String(15), nullable=False)
+    modulo_solicitado = db.Column(db.String(100), nullable=False)
+    estado = db.Column(db.String(20))
+    hora_registro = db.Column(db.DateTime, nullable=False, index=True)
+    hora_llamado = db.Column(db.DateTime, nullable=True)
+    hora_finalizado = db.Column(db.DateTime, nullable=True)
+    # Sin llave foránea a 'usuario' para no impedir que se eliminen funcionarios
+    atendido_por_id = db.Column(db.Integer, nullable=True)
+    registrado_por_id = db.Column(db.Integer, nullable=True)
+    es_preferencial = db.Column(db.Boolean, default=False)
+    servicio_id = db.Column(db.Integer, db.ForeignKey('servicio.id'), nullable=False, index=True)
+    servicio = relationship('Servicio')
+    sede_id = db.Column(db.Integer, db.ForeignKey('sede.id'), nullable=False)
+    numero_meson = db.Column(db.Integer, nullable=True)
+    hora_archivado = db.Column(db.DateTime, nullable=False)
+
+    get_hora_chile = Ticket.get_hora_chile
+
+# Columnas que comparten 'ticket' y 'ticket_archive'
+COLUMNAS_TICKET = [
+    'id', 'numero_ticket', 'rut_cliente', 'modulo_solicitado', 'estado',
+    'hora_registro', 'hora_llamado', 'hora_finalizado', 'atendido_por_id',
+    'registrado_por_id', 'es_preferencial', 'servicio_id', 'sede_id', 'numero_meson'
+]
+
+# Tipos de evento de 'ticket_event' (se guardan como enteros pequeños)
+EVENTO_REGISTRADO = 1
+EVENTO_LLAMADO = 2
+EVENTO_RELLAMADO = 3
+EVENTO_FINALIZADO = 4
+EVENTO_CERRADO = 5  # Finalizado sin intervención del funcionario (nuevo llamado, cierre de jornada)
+NOMBRES_EVENTO = {
+    EVENTO_REGISTRADO: 'registrado', EVENTO_LLAMADO: 'llamado', EVENTO_RELLAMADO: 'rellamado',
+    EVENTO_FINALIZADO: 'finalizado', EVENTO_CERRADO: 'cerrado',
+}
+
+# Registro de solo inserción de cada cambio de estado de un ticket, escrito en la
+# misma transacción que el cambio. Filas angostas (solo enteros y una fecha): las
+# estadísticas del día, la exportación de eventos y la reconstrucción del
+# estimador al arrancar leen de aquí en vez de recorrer la tabla 'ticket'.
+class TicketEvent(db.Model):
+    __table_args__ = (
+        db.Index('ix_ticket_event_sede_tipo_momento', 'sede_id', 'tipo', 'momento'),
+        db.Index('ix_ticket_event_ticket', 'ticket_id'),
+    )
+
+    id = db.Column(db.BigInteger().with_variant(db.Integer, 'sqlite'), primary_key=True)
+    # Sin llaves foráneas: el ticket pasa al archivo conservando su id, y cada inserción sale más barata
+    ticket_id = db.Column(db.Integer, nullable=False)
+    tipo = db.Column(db.SmallInteger, nullable=False)  # EVENTO_*
+    momento = db.Column(db.DateTime, nullable=False)
+    sede_id = db.Column(db.Integer, nullable=False)
+    servicio_id = db.Column(db.Integer, nullable=False)
+    usuario_id = db.Column(db.Integer, nullable=True)
+    numero_meson = db.Column(db.SmallInteger, nullable=True)
+    # Llamado: segundos de espera desde el registro. Finalizado/cerrado: duración de la atención.
+    segundos = db.Column(db.Integer, nullable=True)
+
+def evento(tipo, ticket_id, servicio_id, sede_id, momento, usuario=None, segundos=None):
+    """Fila de 'ticket_event' lista para registrar_eventos()."""
+    return {
+        'ticket_id': ticket_id, 'tipo': tipo, 'momento': momento,
+        'sede_id': sede_id, 'servicio_id': servicio_id,
+        'usuario_id': usuario.id if usuario else None,
+        'numero_meson': usuario.numero_meson if usuario else None,
+        'segundos': int(segundos.total_seconds()) if segundos is not None else None,
+    }
+
+def registrar_eventos(eventos):
+    """Agrega los eventos en la transacción en curso (el commit lo hace quien cambia el ticket)."""
+    if eventos:
+        db.session.execute(insert(TicketEvent), eventos)
+
+def registrar_eventos_de(*filtros, tipo, momento, usuario=None):
+    """Un evento por cada ticket que cumple los filtros, con INSERT ... SELECT (sin cargarlos en memoria).
+
+    Debe llamarse ANTES de la sentencia UPDATE que les cambia el estado. Aquí
+    'segundos' queda vacío.
+    """
+    db.session.execute(insert(TicketEvent).from_select(
+        ['ticket_id', 'tipo', 'momento', 'sede_id', 'servicio_id', 'usuario_id', 'numero_meson'],
+        select(
+            Ticket.id, literal(tipo, db.SmallInteger), literal(momento, db.DateTime), Ticket.sede_id, Ticket.servicio_id,
+            literal(usuario.id if usuario else None, db.Integer),
+            literal(usuario.numero_meson if usuario else None, db.SmallInteger)
+        ).where(*filtros)
+    ))
+
+def _eventos_registro(filas):
+    """Eventos de los tickets que escribe el registro diferido, en su misma transacción."""
+    registrar_eventos([
+        dict(evento(EVENTO_REGISTRADO, fila['id'], fila['servicio_id'], fila['sede_id'], fila['hora_registro']),
+             usuario_id=fila['registrado_por_id'])
+        for fila in filas
+    ])
+
 # --- FORMULARIOS ---
 # Los formularios también pueden definirse aquí.
 class LoginForm(FlaskForm):
@@ -100,8 +274,15 @@ class LoginForm(FlaskForm):
     password = PasswordField('Contraseña', validators=[DataRequired()])
     submit = SubmitField('Ingresar')
 
+def validar_rut(form, field):
+    """Valida el RUT y deja en el campo su forma normalizada."""
+    try:
+        field.data = normalizar_rut(field.data)
+    except ValueError as error:
+        raise ValidationError(str(error))
+
 class RegistroForm(FlaskForm):
-    rut = StringField('RUT del Solicitante', validators=[DataRequired()])
+    rut = StringField('RUT del Solicitante', validators=[DataRequired(), validar_rut])
     servicio = SelectField('Servicio Solicitado', coerce=int, validators=[DataRequired()])
     es_preferencial = BooleanField('¿Atención Preferencial?')
     submit = SubmitField('Registrar y Generar Número')
@@ -109,6 +290,10 @@ class RegistroForm(FlaskForm):
 class AccionForm(FlaskForm):
     submit = SubmitField()
 
+class LlamarLoteForm(FlaskForm):
+    cantidad = IntegerField('Cantidad a llamar', default=5, validators=[DataRequired(), NumberRange(min=1)])
+    submit = SubmitField('Llamar Grupo')
+
 class CrearUsuarioForm(FlaskForm):
     username = StringField('Nombre de Funcionario', validators=[DataRequired()])
     password = PasswordField('Contraseña', validators=[DataRequired()])
@@ -138,20 +323,93 @@ class ChangePasswordForm(FlaskForm):
     confirm_password = PasswordField('Confirmar Nueva Contraseña', validators=[DataRequired()])
     submit = SubmitField('Cambiar Contraseña')
 
-# Configuración del sistema (por ejemplo, si está abierto o cerrado)
+# Configuración del sistema de cada sede (por ejemplo, si está abierto o cerrado)
 class ConfigSystem(db.Model):
+    __table_args__ = (
+        db.UniqueConstraint('sede_id', 'key', name='uq_config_system_sede_key'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
-    key = db.Column(db.String(50), unique=True, nullable=False)
+    sede_id = db.Column(db.Integer, db.ForeignKey('sede.id'), nullable=True)
+    key = db.Column(db.String(50), nullable=False)
     value = db.Column(db.String(50), nullable=False) # 'true' o 'false'
 
+# Fila única que indica qué proceso ejecuta las tareas programadas (ver tareas.py)
+class BloqueoProgramador(db.Model):
+    nombre = db.Column(db.String(50), primary_key=True)
+    instancia = db.Column(db.String(100), nullable=False)
+    vence = db.Column(db.DateTime, nullable=False)  # UTC
+
+# Historial de las tareas programadas. La unicidad (tarea, programada) impide que
+# dos procesos ejecuten la misma hora programada de una tarea.
+class EjecucionTarea(db.Model):
+    __table_args__ = (
+        db.UniqueConstraint('tarea', 'programada', name='uq_ejecucion_tarea_programada'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    tarea = db.Column(db.String(50), nullable=False)
+    programada = db.Column(db.DateTime, nullable=False)
+    inicio = db.Column(db.DateTime, nullable=False)
+    fin = db.Column(db.DateTime, nullable=True)
+    estado = db.Column(db.String(20), nullable=False)  # en_curso, ok, error, interrumpida
+    detalle = db.Column(db.String(500), nullable=True)
+    instancia = db.Column(db.String(100), nullable=False)
+
+# Tickets registrados por día y servicio, para los días ya cerrados. Lo llena la
+# tarea nocturna 'resumen_diario': el dashboard suma estas filas en vez de
+# recorrer todo el historial (vivo y archivado) en cada visita.
+class ResumenDiario(db.Model):
+    __table_args__ = (
+        db.Index('ix_resumen_diario_sede_fecha', 'sede_id', 'fecha'),
+    )
+
+    fecha = db.Column(db.Date, primary_key=True)
+    servicio_id = db.Column(db.Integer, db.ForeignKey('servicio.id'), primary_key=True)
+    sede_id = db.Column(db.Integer, db.ForeignKey('sede.id'), nullable=False)
+    tickets = db.Column(db.Integer, nullable=False)
+
 # Función auxiliar para verificar si está abierto
-def sistema_esta_abierto():
-    config = ConfigSystem.query.filter_by(key='sistema_abierto').first()
+def sistema_esta_abierto(sede_id):
+    config = ConfigSystem.query.filter_by(sede_id=sede_id, key='sistema_abierto').first()
     # Si no existe la config, asumimos que está abierto por defecto
     if not config:
         return True
     return config.value == 'true'
 
+def fijar_sistema_abierto(sede_id, abierto):
+    """Abre o cierra el sistema de una sede (sin hacer commit)."""
+    config = ConfigSystem.query.filter_by(sede_id=sede_id, key='sistema_abierto').first()
+    if not config:
+        config = ConfigSystem(sede_id=sede_id, key='sistema_abierto')
+        db.session.add(config)
+    config.value = 'true' if abierto else 'false'
+
+# Sedes por código (y la predeterminada, con código None). Las sedes casi nunca
+# cambian: así la pantalla pública resuelve su sede sin consultar la base.
+_ids_sede = {}
+
+def id_sede(codigo=None):
+    """Id de la sede con ese código (None: la predeterminada). None si no existe."""
+    if codigo not in _ids_sede:
+        consulta = db.session.query(Sede.id)
+        if codigo is None:
+            predeterminada = current_app.config.get('SEDE_PREDETERMINADA')
+            consulta = consulta.filter_by(codigo=predeterminada) if predeterminada else consulta.order_by(Sede.id)
+        else:
+            consulta = consulta.filter_by(codigo=codigo)
+        sede_id = consulta.limit(1).scalar()
+        if sede_id is None:
+            return None  # No se guarda: la sede puede crearse después
+        _ids_sede[codigo] = sede_id
+    return _ids_sede[codigo]
+
+def sede_activa():
+    """Sede con la que trabaja el usuario: la suya o, si administra todas, la que eligió."""
+    if current_user.sede_id is not None:
+        return current_user.sede_id
+    return session.get('sede_id') or id_sede()
+
 
 # --- DECORADORES ---
 def check_sistema_abierto(f):
@@ -161,8 +419,8 @@ def check_sistema_abierto(f):
         if current_user.is_authenticated and current_user.rol == 'admin':
             return f(*args, **kwargs)
         
-        # Si no eres admin, verificamos el interruptor
-        if not sistema_esta_abierto():
+        # Si no eres admin, verificamos el interruptor de tu sede
+        if not sistema_esta_abierto(current_user.sede_id):
             flash('El sistema está cerrado por el administrador. Vuelva mañana.', 'error')
             return redirect(url_for('login')) # O a una página de "Cerrado"
             
@@ -170,10 +428,9 @@ def check_sistema_abierto(f):
     return decorated_function
 
 # Función auxiliar para obtener datos del historial
-def _get_historial_data():
-    """Busca los últimos 4 tickets para el historial y los serializa."""
-    historial = Ticket.query.filter(Ticket.estado.in_(['en_atencion', 'finalizado'])) \
-                        .order_by(Ticket.hora_llamado.desc()).limit(4).all()
+def _get_historial_data(sede_id):
+    """Busca los últimos 4 tickets de la sede para el historial y los serializa."""
+    historial = _historial_pantalla(sede_id)
     historial_data = [{
         'numero_ticket': t.numero_ticket,
         'modulo_solicitado': t.modulo_solicitado,
@@ -183,10 +440,325 @@ def _get_historial_data():
     return historial_data
 
 
+def _llamados_pantalla(sede_id):
+    """Los 2 últimos tickets en atención de la sede (los que muestra la pantalla)."""
+    return Ticket.query.filter_by(sede_id=sede_id, estado='en_atencion') \
+                 .order_by(Ticket.hora_llamado.desc()).limit(2).all()
+
+def _historial_pantalla(sede_id):
+    """Los 4 últimos tickets finalizados o en atención de la sede."""
+    return Ticket.query.filter(Ticket.sede_id == sede_id, Ticket.estado.in_(['en_atencion', 'finalizado'])) \
+                 .order_by(Ticket.hora_llamado.desc()).limit(4).all()
+
+def _get_tickets_historicos(sede_id, desde=None):
+    """Subconsulta con los tickets vivos y los archivados de una sede (registrados desde 'desde'), para reportes."""
+    consultas = []
+    for modelo in (Ticket, TicketArchive):
+        consulta = select(*[getattr(modelo, c) for c in COLUMNAS_TICKET]).where(modelo.sede_id == sede_id)
+        if desde is not None:
+            consulta = consulta.where(modelo.hora_registro >= desde)
+        consultas.append(consulta)
+    return union_all(*consultas).subquery('tickets_historicos')
+
+def _tickets_por_servicio(sede_id):
+    """Tickets históricos por servicio de una sede: {servicio_id: cantidad}.
+
+    Los días ya resumidos salen de 'resumen_diario'; solo se cuentan en el
+    historial los tickets registrados después del último día resumido.
+    """
+    totales = dict(db.session.query(ResumenDiario.servicio_id, func.sum(ResumenDiario.tickets))
+                   .filter(ResumenDiario.sede_id == sede_id).group_by(ResumenDiario.servicio_id).all())
+    ultimo_dia = db.session.query(func.max(ResumenDiario.fecha)).scalar()  # resumir_dias() avanza todas las sedes juntas
+    desde = datetime.combine(ultimo_dia + timedelta(days=1), datetime.min.time()) if ultimo_dia else None
+    tickets_historicos = _get_tickets_historicos(sede_id, desde)
+    for servicio_id, cantidad in db.session.query(
+        tickets_historicos.c.servicio_id, func.count(tickets_historicos.c.id)
+    ).group_by(tickets_historicos.c.servicio_id).all():
+        totales[servicio_id] = totales.get(servicio_id, 0) + cantidad
+    return totales
+
+def resumir_dias(hasta, dias_por_lote=7, al_avanzar=None):
+    """Agrega a 'resumen_diario' los días completos anteriores a 'hasta' (fecha) que aún no tiene.
+
+    Trabaja por lotes de días, con un commit por lote. Devuelve la cantidad de filas agregadas.
+    """
+    ultimo_dia = db.session.query(func.max(ResumenDiario.fecha)).scalar()
+    if ultimo_dia is None:
+        primera = [db.session.query(func.min(modelo.hora_registro)).scalar() for modelo in (Ticket, TicketArchive)]
+        primera = [f for f in primera if f is not None]
+        if not primera:
+            return 0
+        desde = min(primera).date()
+    else:
+        desde = ultimo_dia + timedelta(days=1)
+
+    filas = 0
+    while desde < hasta:
+        lote_hasta = min(desde + timedelta(days=dias_por_lote), hasta)
+        rango = [datetime.combine(d, datetime.min.time()) for d in (desde, lote_hasta)]
+        historicos = union_all(*[
+            select(modelo.hora_registro, modelo.sede_id, modelo.servicio_id, modelo.id).where(
+                modelo.hora_registro >= rango[0], modelo.hora_registro < rango[1]
+            ) for modelo in (Ticket, TicketArchive)
+        ]).subquery('historicos')
+        dia = func.date(historicos.c.hora_registro, type_=db.Date)
+        resumen = db.session.query(
+            dia, historicos.c.sede_id, historicos.c.servicio_id, func.count(historicos.c.id)
+        ).group_by(dia, historicos.c.sede_id, historicos.c.servicio_id).all()
+        if resumen:
+            db.session.execute(insert(ResumenDiario), [
+                {'fecha': fecha, 'sede_id': sede_id, 'servicio_id': servicio_id, 'tickets': cantidad}
+                for fecha, sede_id, servicio_id, cantidad in resumen
+            ])
+        db.session.commit()
+        filas += len(resumen)
+        desde = lote_hasta
+        if al_avanzar:
+            al_avanzar(filas)
+    return filas
+
+# Orden del historial de un RUT: de la visita más reciente a la más antigua (el id desempata)
+COLUMNAS_HISTORIAL_RUT = (Ticket.hora_registro, Ticket.id)
+
+def _historial_rut(rut, cursor=None, limite=50):
+    """Una página de las visitas de una persona (vivas y archivadas), de la más reciente a la más antigua.
+
+    Cada tabla se recorre por su índice (rut_cliente, hora_registro, id) desde el cursor,
+    así que el costo no depende del tamaño del historial completo.
+    """
+    paginas = []
+    for modelo in (Ticket, TicketArchive):
+        columnas_orden = (modelo.hora_registro, modelo.id)
+        paginas.append(select(
+            modelo.id, modelo.numero_ticket, modelo.modulo_solicitado, modelo.estado,
+            modelo.hora_registro, modelo.hora_llamado, modelo.hora_finalizado,
+            modelo.numero_meson, modelo.es_preferencial
+        ).where(
+            modelo.rut_cliente == rut,
+            despues_de(columnas_orden, cursor)
+        ).order_by(*orden(columnas_orden)).limit(limite + 1).subquery())
+
+    visitas = union_all(*[select(pagina) for pagina in paginas]).subquery('visitas')
+    filas = db.session.execute(
+        select(visitas).order_by(*orden((visitas.c.hora_registro, visitas.c.id))).limit(limite + 1)
+    ).all()
+    return cortar_pagina(filas, limite, lambda fila: (fila.hora_registro, fila.id))
+
+def _estadisticas_rut(rut):
+    """Resumen de las visitas de una persona: totales, frecuencia y servicios."""
+    visitas = union_all(*[
+        select(modelo.modulo_solicitado, modelo.hora_registro, modelo.hora_llamado).where(modelo.rut_cliente == rut)
+        for modelo in (Ticket, TicketArchive)
+    ]).subquery('visitas')
+    filas = db.session.execute(select(visitas).order_by(visitas.c.hora_registro)).all()
+    if not filas:
+        return None
+
+    dias = sorted({fila.hora_registro.date() for fila in filas})
+    esperas = [(fila.hora_llamado - fila.hora_registro).total_seconds() for fila in filas if fila.hora_llamado]
+    por_servicio = {}
+    for fila in filas:
+        por_servicio[fila.modulo_solicitado] = por_servicio.get(fila.modulo_solicitado, 0) + 1
+    hace_30_dias = datetime.now(zona_horaria_chile).replace(tzinfo=None) - timedelta(days=30)
+    return {
+        'total': len(filas),
+        'dias_distintos': len(dias),
+        'primera': filas[0].hora_registro,
+        'ultima': filas[-1].hora_registro,
+        'ultimos_30_dias': sum(1 for fila in filas if fila.hora_registro >= hace_30_dias),
+        # Días promedio entre un día de visita y el siguiente (None con un solo día)
+        'dias_entre_visitas': round((dias[-1] - dias[0]).days / (len(dias) - 1), 1) if len(dias) > 1 else None,
+        'espera_promedio_min': round(sum(esperas) / len(esperas) / 60) if esperas else None,
+        'por_servicio': sorted(por_servicio.items(), key=lambda item: item[1], reverse=True),
+    }
+
+def archivar_tickets(*filtros, tamano_lote=500, al_avanzar=None):
+    """Mueve a 'ticket_archive' los tickets que cumplen los filtros.
+
+    Trabaja en lotes de tamaño acotado, con un commit por lote, para no
+    mantener bloqueada la tabla 'ticket' mientras se mueve el historial.
+    Si se entrega 'al_avanzar', se llama con el total acumulado tras cada lote.
+    Devuelve la cantidad de tickets archivados.
+
+    Se niega (RuntimeError) si la base puede volver a entregar los ids archivados.
+    """
+    if ids_de_ticket_reutilizables(db.session.connection()):
+        # Archivar vaciaría 'ticket' y los ids se volverían a entregar (ver migración f3c9a1d8e274)
+        raise RuntimeError("La tabla 'ticket' de SQLite no tiene AUTOINCREMENT: ejecute 'flask db upgrade' antes de archivar")
+    total = 0
+    while True:
+        ids = [t_id for (t_id,) in db.session.query(Ticket.id).filter(*filtros)
+               .order_by(Ticket.id.asc()).limit(tamano_lote).all()]
+        if not ids:
+            break
+
+        ahora = datetime.now(zona_horaria_chile).replace(tzinfo=None)
+        db.session.execute(
+            insert(TicketArchive).from_select(
+                COLUMNAS_TICKET + ['hora_archivado'],
+                select(*[getattr(Ticket, c) for c in COLUMNAS_TICKET], literal(ahora))
+                .where(Ticket.id.in_(ids))
+            )
+        )
+        db.session.execute(delete(Ticket).where(Ticket.id.in_(ids)))
+        db.session.commit()
+        total += len(ids)
+        if al_avanzar:
+            al_avanzar(total)
+    return total
+
+# Progreso de los reinicios de servicio que se están archivando en segundo plano
+# (servicio_id -> {'total', 'procesados', 'estado'})
+reinicios_en_curso = {}
+
+def cerrar_tickets_abiertos(sede_id, registrados_antes_de=None):
+    """Finaliza los tickets de la sede que quedaron en espera o en atención y avisa a sus pantallas.
+
+    Una sola sentencia UPDATE, sin cargar los tickets en memoria. Devuelve cuántos se cerraron.
+    """
+    filtros = [Ticket.sede_id == sede_id, Ticket.estado.in_(['en_atencion', 'en_espera'])]
+    if registrados_antes_de is not None:
+        filtros.append(Ticket.hora_registro < registrados_antes_de)
+    ahora = datetime.now(zona_horaria_chile).replace(tzinfo=None)
+    registrar_eventos_de(*filtros, tipo=EVENTO_CERRADO, momento=ahora)
+    tickets_cerrados = Ticket.query.filter(*filtros).update({
+        'estado': 'finalizado',
+        'hora_finalizado': ahora
+    }, synchronize_session=False)
+    db.session.commit()
+    # Solo cambian las colas de esta sede
+    cache_vistas.cambio(sede_id=sede_id)
+    for (servicio_id,) in db.session.query(Servicio.id).filter_by(sede_id=sede_id).all():
+        cache_vistas.cambio(servicio_id)
+
+    # Avisamos a las pantallas de la sede que deben limpiar todos los paneles
+    payload = {
+        'todos': True,
+        'historial': _get_historial_data(sede_id)
+    }
+    difusion.emitir('atencion_finalizada', payload, room=sala_pantalla(sede_id))
+    return tickets_cerrados
+
+def sala_servicio(servicio_id):
+    """Nombre de la sala Socket.IO de los paneles de un servicio."""
+    return f'servicio_{servicio_id}'
+
+def sala_pantalla(sede_id):
+    """Nombre de la sala Socket.IO de las pantallas públicas de una sede."""
+    return f'pantalla_{sede_id}'
+
+def _get_datos_llamado(ticket, es_rellamado=False):
+    """Serializa un ticket llamado con el formato que esperan las pantallas."""
+    return {
+        'id_ticket': ticket.id,
+        'servicio_id': ticket.servicio_id,
+        'nombre_modulo': ticket.servicio.nombre_modulo,
+        'numero_ticket': ticket.numero_ticket,
+        'color_hex': ticket.servicio.color_hex,
+        'numero_meson': ticket.numero_meson,
+        'es_preferencial': ticket.es_preferencial,
+        'visible': ticket.servicio.visible_en_pantalla,
+        'es_rellamado': es_rellamado,
+        # Anuncio por voz ya compuesto (ver anuncios.py); None si faltan grabaciones
+        'audio_url': anuncios.url(ticket.numero_ticket, ticket.numero_meson)
+    }
+
+def _personas_antes(ticket):
+    """Cuántos tickets en espera de su mismo servicio llegaron antes que éste."""
+    return Ticket.query.filter(
+        Ticket.sede_id == ticket.sede_id,
+        Ticket.servicio_id == ticket.servicio_id,
+        Ticket.estado == 'en_espera',
+        Ticket.id < ticket.id  # IDs menores significan que llegaron antes
+    ).count()
+
+# Orden en que se llama la cola: preferenciales primero, luego por llegada (el id desempata)
+COLUMNAS_COLA = (Ticket.es_preferencial, Ticket.hora_registro, Ticket.id)
+DIRECCION_COLA = (True, False, False)
+
+def _pagina_espera(sede_id, servicio_id, cursor, limite):
+    """Una página de la cola de espera de un servicio, en el orden de llamado."""
+    consulta = Ticket.query.filter_by(sede_id=sede_id, servicio_id=servicio_id, estado='en_espera')
+    return paginar(consulta, COLUMNAS_COLA, cursor, limite, DIRECCION_COLA)
+
+def _ticket_espera_json(ticket):
+    """Mismos campos que el evento 'nuevo_ticket_registrado' que dibuja el panel."""
+    return {
+        'id': ticket.id,
+        'numero_ticket': ticket.numero_ticket,
+        'es_preferencial': ticket.es_preferencial,
+        'hora_registro': ticket.get_hora_chile(ticket.hora_registro).isoformat()
+    }
+
+def _avisar_registrados(filas, colores):
+    """Avisa a los paneles los tickets que el registro diferido acaba de guardar."""
+    for fila in filas:
+        difusion.emitir('nuevo_ticket_registrado', {
+            'numero_ticket': fila['numero_ticket'],
+            'modulo_solicitado': fila['modulo_solicitado'],
+            'color_hex': colores[fila['servicio_id']],
+            'es_preferencial': fila['es_preferencial'],
+            'hora_registro': Ticket.get_hora_chile(fila['hora_registro']).isoformat()
+        }, room=sala_servicio(fila['servicio_id']))
+        current_app.logger.info(f"Ticket {fila['numero_ticket']} emitido",
+                                extra={'ticket_id': fila['id'], 'servicio_id': fila['servicio_id']})
+
+def _atenciones_recientes(limite):
+    """Últimos llamados y atenciones, del más antiguo al más nuevo, para reconstruir el estimador de espera.
+
+    Se reproducen desde 'ticket_event' (recorriendo su llave primaria hacia atrás)
+    en vez de ordenar la tabla 'ticket' por hora de llamado.
+    """
+    consulta = select(
+        TicketEvent.tipo, TicketEvent.servicio_id, TicketEvent.usuario_id, TicketEvent.momento, TicketEvent.segundos
+    ).where(TicketEvent.tipo.in_([EVENTO_LLAMADO, EVENTO_FINALIZADO])).order_by(TicketEvent.id.desc()).limit(limite)
+    # Conexión propia: un error aquí no debe dejar la sesión de la solicitud inservible
+    with db.engine.connect() as conexion:
+        filas = conexion.execute(consulta).all()
+    atenciones = []
+    for tipo, servicio_id, usuario_id, momento, segundos in reversed(filas):
+        if tipo == EVENTO_LLAMADO:
+            atenciones.append((servicio_id, usuario_id, momento, None))
+        elif segundos is not None:
+            atenciones.append((servicio_id, usuario_id, momento - timedelta(seconds=segundos), momento))
+    return atenciones
+
+def _datos_seguimiento(ticket_id):
+    """Estado compacto de un ticket para la API de seguimiento (None si no existe)."""
+    with en_primaria():
+        ticket = db.session.get(Ticket, ticket_id)
+        if ticket is None:
+            ticket = db.session.get(TicketArchive, ticket_id)
+            if ticket is None:
+                return None
+            version = f'{cache_vistas.nonce}.archivado'
+        else:
+            # La versión se toma antes de releer: los datos son al menos así de nuevos
+            version = cache_vistas.version(ticket.servicio_id)
+            db.session.refresh(ticket)
+
+    datos = {
+        'id': ticket.id,
+        'numero_ticket': ticket.numero_ticket,
+        'servicio_id': ticket.servicio_id,
+        'estado': ticket.estado,
+        'numero_meson': ticket.numero_meson,
+        'personas_antes': 0,
+        'espera_estimada_min': 0,
+        'version': version,
+    }
+    if ticket.estado == 'en_espera':
+        datos['personas_antes'] = _personas_antes(ticket)
+        datos['espera_estimada_min'] = estimador_espera.eta_min(ticket.servicio_id, datos['personas_antes'])
+    return datos
+
+
 # --- FUNCIÓN DE FÁBRICA DE LA APLICACIÓN ---
-def create_app():
+def create_app(config=None):
+    """Crea la aplicación. 'config' permite sobrescribir la configuración (p. ej. en benchmarks)."""
     load_dotenv()
     app = Flask(__name__)
+    _ids_sede.clear()  # Las sedes guardadas son de la base de datos anterior
 
     # Aplicamos el proxy fix
     app.wsgi_app = ProxyFix(app.wsgi_app, x_proto=1, x_host=1)
@@ -214,10 +786,135 @@ def create_app():
         app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{db_path}'
         
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    # Máximo de tickets que un funcionario puede llamar de una sola vez ("Llamar Grupo")
+    app.config['LOTE_MAXIMO_LLAMADOS'] = int(os.getenv('LOTE_MAXIMO_LLAMADOS', 10))
+    # Tamaño de los lotes con que 'reset_servicio' archiva el historial en segundo plano
+    app.config['RESET_TAMANO_LOTE'] = int(os.getenv('RESET_TAMANO_LOTE', 500))
+    # Código de la sede que muestra la pantalla en '/' (por defecto, la primera creada)
+    app.config['SEDE_PREDETERMINADA'] = os.getenv('SEDE_PREDETERMINADA')
+    # Tickets en espera que el panel muestra de entrada (el resto se carga a pedido)
+    app.config['PANEL_TAMANO_PAGINA'] = int(os.getenv('PANEL_TAMANO_PAGINA', 50))
+    # Filas por página en los listados de usuarios y servicios del administrador
+    app.config['ADMIN_TAMANO_PAGINA'] = int(os.getenv('ADMIN_TAMANO_PAGINA', 100))
+    # Ventana (ms) en la que se agrupan los eventos Socket.IO de una misma sala.
+    # Los llamados ('nuevo_llamado') se envían siempre de inmediato.
+    app.config['DIFUSION_VENTANA_MS'] = int(os.getenv('DIFUSION_VENTANA_MS', 100))
+    # Fracción de solicitudes que Sentry traza (1.0 = todas, con su costo en cada solicitud)
+    app.config['SENTRY_TRACES_SAMPLE_RATE'] = float(os.getenv('SENTRY_TRACES_SAMPLE_RATE', 0.05))
+    # Token opcional para que Prometheus lea /admin/metrics sin iniciar sesión
+    app.config['METRICAS_TOKEN'] = os.getenv('METRICAS_TOKEN')
+    # Un retraso del hub de eventlet sobre este umbral (segundos) cuenta como bloqueo
+    app.config['METRICAS_HUB_UMBRAL'] = float(os.getenv('METRICAS_HUB_UMBRAL', 0.1))
+    # Modo de perfilado (ver perfilado.py). Apagado por defecto: solo para diagnosticar.
+    app.config['PERFILADO_ACTIVO'] = os.getenv('PERFILADO_ACTIVO', '0').lower() in ('1', 'true', 'si')
+    app.config['PERFILADO_UMBRAL_BLOQUEO_MS'] = int(os.getenv('PERFILADO_UMBRAL_BLOQUEO_MS', 200))
+    app.config['PERFILADO_MUESTREO'] = float(os.getenv('PERFILADO_MUESTREO', 0.1))
+    app.config['PERFILADO_UMBRAL_LENTO_MS'] = int(os.getenv('PERFILADO_UMBRAL_LENTO_MS', 500))
+    app.config['PERFILADO_ARCHIVO'] = os.getenv('PERFILADO_ARCHIVO', 'logs/perfilado.log')
+    # Bitácora de la app: archivo JSON rotativo y umbral para registrar solicitudes lentas
+    app.config['BITACORA_ARCHIVO'] = os.getenv('BITACORA_ARCHIVO', 'logs/sistema_turnos.log')
+    app.config['BITACORA_MAX_BYTES'] = int(os.getenv('BITACORA_MAX_BYTES', 10 * 1024 * 1024))
+    app.config['BITACORA_RESPALDOS'] = int(os.getenv('BITACORA_RESPALDOS', 10))
+    # Copia de la bitácora en stderr (en texto), escrita por el mismo hilo: en Render es el log visible
+    app.config['BITACORA_STDERR'] = os.getenv('BITACORA_STDERR', '1').lower() in ('1', 'true', 'si')
+    app.config['BITACORA_UMBRAL_LENTO_MS'] = int(os.getenv('BITACORA_UMBRAL_LENTO_MS', 1000))
+
+    # Pool de conexiones (ver conexiones.py). Con un solo worker eventlet, todas las
+    # solicitudes comparten estas conexiones: el exceso espera DB_POOL_TIMEOUT segundos
+    # como máximo y, si ya hay DB_POOL_MAX_ESPERANDO esperando, se rechaza de inmediato.
+    app.config['DB_POOL_SIZE'] = int(os.getenv('DB_POOL_SIZE', 10))
+    app.config['DB_POOL_MAX_OVERFLOW'] = int(os.getenv('DB_POOL_MAX_OVERFLOW', 5))
+    app.config['DB_POOL_TIMEOUT'] = int(os.getenv('DB_POOL_TIMEOUT', 5))  # Segundos enteros (SQLAlchemy lo convierte a int)
+    app.config['DB_POOL_RECYCLE'] = int(os.getenv('DB_POOL_RECYCLE', 1800))
+    app.config['DB_POOL_PRE_PING'] = os.getenv('DB_POOL_PRE_PING', '1').lower() in ('1', 'true', 'si')
+    app.config['DB_POOL_MAX_ESPERANDO'] = int(os.getenv('DB_POOL_MAX_ESPERANDO', 50))
+    app.config['DB_STATEMENT_TIMEOUT_MS'] = int(os.getenv('DB_STATEMENT_TIMEOUT_MS', 15000))
+    # Modo de producción de SQLite (ver sqlite_produccion.py): WAL, busy_timeout, synchronous=NORMAL,
+    # memoria mapeada y escrituras de a una. Solo se aplica si la base es un archivo SQLite.
+    app.config['SQLITE_MODO_PRODUCCION'] = os.getenv('SQLITE_MODO_PRODUCCION', '1').lower() in ('1', 'true', 'si')
+    app.config['SQLITE_BUSY_TIMEOUT_MS'] = int(os.getenv('SQLITE_BUSY_TIMEOUT_MS', 5000))
+    app.config['SQLITE_MMAP_MB'] = int(os.getenv('SQLITE_MMAP_MB', 64))
+
+    # Tareas programadas (ver tareas.py). Horarios tipo cron en hora de Chile; '' desactiva la tarea.
+    app.config['PROGRAMADOR_ACTIVO'] = os.getenv('PROGRAMADOR_ACTIVO', '1').lower() in ('1', 'true', 'si')
+    app.config['PROGRAMADOR_INTERVALO_S'] = int(os.getenv('PROGRAMADOR_INTERVALO_S', 30))
+    app.config['PROGRAMADOR_LIDERAZGO_S'] = int(os.getenv('PROGRAMADOR_LIDERAZGO_S', 90))
+    app.config['PROGRAMADOR_RECUPERAR_MIN'] = int(os.getenv('PROGRAMADOR_RECUPERAR_MIN', 120))
+    app.config['TAREAS_CRON'] = {
+        'reinicio_contadores': os.getenv('TAREA_REINICIO_CONTADORES_CRON', '0 3 * * *'),
+        'archivar_finalizados': os.getenv('TAREA_ARCHIVAR_FINALIZADOS_CRON', '15 3 * * *'),
+        'resumen_diario': os.getenv('TAREA_RESUMEN_DIARIO_CRON', '45 3 * * *'),
+        'precalentar_cache': os.getenv('TAREA_PRECALENTAR_CACHE_CRON', '30 7 * * 1-6'),
+        'abrir_sistema': os.getenv('TAREA_ABRIR_SISTEMA_CRON', ''),
+        'cerrar_sistema': os.getenv('TAREA_CERRAR_SISTEMA_CRON', ''),
+    }
+    # Días completos (además del actual) que los tickets finalizados quedan en 'ticket' antes de archivarse
+    app.config['ARCHIVO_DIAS_VIVOS'] = int(os.getenv('ARCHIVO_DIAS_VIVOS', 0))
+
+    # Registro diferido (ver registro_diferido.py): números asignados en memoria y
+    # tickets escritos por lotes. Apagado por defecto: revise sus garantías antes de activarlo.
+    app.config['REGISTRO_DIFERIDO'] = os.getenv('REGISTRO_DIFERIDO', '0').lower() in ('1', 'true', 'si')
+    app.config['REGISTRO_DIFERIDO_INTERVALO_MS'] = int(os.getenv('REGISTRO_DIFERIDO_INTERVALO_MS', 5))
+    app.config['REGISTRO_DIFERIDO_LOTE_MAX'] = int(os.getenv('REGISTRO_DIFERIDO_LOTE_MAX', 200))
+    app.config['REGISTRO_DIFERIDO_MAX_PENDIENTES'] = int(os.getenv('REGISTRO_DIFERIDO_MAX_PENDIENTES', 2000))
+    app.config['REGISTRO_DIFERIDO_BLOQUE_IDS'] = int(os.getenv('REGISTRO_DIFERIDO_BLOQUE_IDS', 100))
+
+    # Reconexiones (ver reconexiones.py): al apagar, los clientes vuelven repartidos en
+    # RECONEXION_VENTANA_S; el drenaje debe durar menos que el graceful timeout de Gunicorn (30 s)
+    app.config['RECONEXION_VENTANA_S'] = int(os.getenv('RECONEXION_VENTANA_S', 20))
+    app.config['RECONEXION_DRENAJE_S'] = int(os.getenv('RECONEXION_DRENAJE_S', 5))
+    app.config['SOCKET_CONEXIONES_POR_S'] = int(os.getenv('SOCKET_CONEXIONES_POR_S', 20))
+    app.config['SOCKET_ESPERA_MAX_S'] = float(os.getenv('SOCKET_ESPERA_MAX_S', 2))
+
+    if config:
+        app.config.update(config)
+    # Después de 'config', por si éste cambia la base de datos o las claves DB_POOL_*
+    app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', opciones_motor(app.config))
+    # Segundos que una consulta de seguimiento (long-poll) espera un cambio antes de responder
+    app.config['SEGUIMIENTO_ESPERA_S'] = int(os.getenv('SEGUIMIENTO_ESPERA_S', 25))
+    # Segundos que se reutiliza el HTML ya renderizado de la pantalla y del seguimiento móvil
+    app.config['CACHE_VISTAS_TTL_S'] = int(os.getenv('CACHE_VISTAS_TTL_S', 30))
+    # Estimador de espera (ver estimaciones.py): peso de cada atención nueva en el promedio
+    # y minutos sin llamar tras los que un mesón deja de contar como activo
+    app.config['ESTIMADOR_ALFA'] = float(os.getenv('ESTIMADOR_ALFA', 0.2))
+    app.config['ESTIMADOR_VENTANA_MIN'] = int(os.getenv('ESTIMADOR_VENTANA_MIN', 15))
+    # Plantillas Jinja compiladas en disco (ver recursos.py) y versión del cliente Socket.IO
+    app.config.setdefault('PLANTILLAS_CACHE_DIR', os.getenv('PLANTILLAS_CACHE_DIR', os.path.join(app.instance_path, 'jinja_cache')))
+    app.config.setdefault('SOCKETIO_CLIENTE_VERSION', os.getenv('SOCKETIO_CLIENTE_VERSION', '4.6.1'))
+    # Anuncios por voz (ver anuncios.py): grabaciones de los segmentos y anuncios ya compuestos
+    app.config.setdefault('VOZ_SEGMENTOS_DIR', os.getenv('VOZ_SEGMENTOS_DIR', os.path.join(app.static_folder, 'sounds', 'voz')))
+    app.config.setdefault('VOZ_CACHE_DIR', os.getenv('VOZ_CACHE_DIR', os.path.join(app.instance_path, 'voz_cache')))
+    app.config['VOZ_CACHE_MAX'] = int(os.getenv('VOZ_CACHE_MAX', 5000))
+    # Réplica de solo lectura opcional para reportes, dashboard, pantalla y seguimiento
+    replica_uri = app.config.get('REPLICA_DATABASE_URL', os.getenv('REPLICA_DATABASE_URL'))
+    app.config.setdefault('REPLICA_MAX_RETRASO_S', float(os.getenv('REPLICA_MAX_RETRASO_S', 10)))
+    if replica_uri:
+        app.config.setdefault('SQLALCHEMY_BINDS', {
+            'replica': {'url': replica_uri, **opciones_motor(dict(app.config, SQLALCHEMY_DATABASE_URI=replica_uri))}
+        })
 
     # --- INICIALIZACIÓN DE EXTENSIONES CON LA APP ---
     db.init_app(app)
-    migrate.init_app(app, db)
+    # Las métricas van antes que CSRF para medir también las solicitudes que este rechaza
+    metricas.init_app(app, difusion)
+    metricas.agregar_exportador('pool', lambda: PoolMedido.estadisticas.lineas_prometheus(db.engine.pool))
+    modo_sqlite.init_app(app, db)
+    metricas.agregar_exportador('modo_sqlite', modo_sqlite.lineas_prometheus)
+    perfilador.init_app(app)
+    cache_vistas.init_app(app)
+    metricas.agregar_exportador('cache_vistas', cache_vistas.lineas_prometheus)
+    recursos.init_app(app, cache_vistas)
+    app.add_template_filter(formatear_rut, 'rut')
+    anuncios.init_app(app)
+    metricas.agregar_exportador('anuncios', anuncios.lineas_prometheus)
+    estimador_espera.init_app(app, cargar=_atenciones_recientes,
+                              reloj=lambda: datetime.now(zona_horaria_chile).replace(tzinfo=None))
+    metricas.agregar_exportador('estimador_espera', estimador_espera.lineas_prometheus)
+    # Flask-Migrate trae alembic (~0,15 s de importación): solo se carga para los
+    # comandos 'flask ...'; el worker que atiende solicitudes no lo necesita.
+    if click.get_current_context(silent=True) is not None:
+        from flask_migrate import Migrate
+        Migrate(app, db)
     login_manager.init_app(app)
     login_manager.login_view = 'login' # Si @login_required falla, ir aquí
     login_manager.login_message = "Su sesión ha expirado. Por favor ingrese nuevamente."
@@ -225,17 +922,26 @@ def create_app():
     csrf.init_app(app)
     # Pasamos el async_mode='eventlet' para producción.
     socketio.init_app(app, async_mode='eventlet', cors_allowed_origins="*")
+    difusion.init_app(app, socketio)
+    programador.init_app(app, socketio, db, bloqueo=BloqueoProgramador, ejecucion=EjecucionTarea,
+                         reloj=lambda: datetime.now(zona_horaria_chile).replace(tzinfo=None))
+    registro_diferido.init_app(app, socketio, db, servicio=Servicio, ticket=Ticket, archivo=TicketArchive,
+                               en_transaccion=_eventos_registro, al_escribir=_avisar_registrados,
+                               reloj=lambda: datetime.now(zona_horaria_chile).replace(tzinfo=None))
+    metricas.agregar_exportador('registro_diferido', registro_diferido.lineas_prometheus)
+    # Al drenar se sueltan los long-poll del seguimiento, que luego reciben 503 con Retry-After
+    reconexiones.init_app(app, socketio, al_drenar=cache_vistas.cambio)
+    metricas.agregar_exportador('reconexiones', reconexiones.lineas_prometheus)
 
 
     # --- CONFIGURACIÓN DE SENTRY Y LOGGING ---
-    sentry_sdk.init(dsn=os.getenv("SENTRY_DSN"), traces_sample_rate=1.0)
+    if os.getenv("SENTRY_DSN"):
+        # Se importa solo si se usa: sentry_sdk y sus integraciones alargan el arranque
+        import sentry_sdk
+        sentry_sdk.init(dsn=os.getenv("SENTRY_DSN"), traces_sample_rate=app.config['SENTRY_TRACES_SAMPLE_RATE'])
     if not app.debug:
-        if not os.path.exists('logs'):
-            os.mkdir('logs')
-        file_handler = RotatingFileHandler('logs/sistema_turnos.log', maxBytes=10240, backupCount=10)
-        file_handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s: %(message)s [in %(pathname)s:%(lineno)d]'))
-        file_handler.setLevel(logging.INFO)
-        app.logger.addHandler(file_handler)
+        # JSON por línea, escrito por un hilo nativo para no detener el hub (ver bitacora.py)
+        configurar_bitacora(app)
         app.logger.setLevel(logging.INFO)
         app.logger.info('Sistema de Turnos iniciado')
 
@@ -255,24 +961,56 @@ def create_app():
             return decorated_function
         return decorator
 
+    @app.errorhandler(PoolTimeoutError)
+    def sistema_ocupado(error):
+        # El pool de conexiones está agotado: mejor avisar que seguir acumulando solicitudes
+        db.session.rollback()
+        app.logger.warning(f"Sistema ocupado: {error}")
+        return render_template('sistema_ocupado.html'), 503, {'Retry-After': '5'}
+
     @login_manager.user_loader
     def load_user(user_id):
         return db.session.get(Usuario, int(user_id))
 
     @app.route('/')
-    def pantalla_publica():
-        # Obtenemos los últimos 2 tickets que estén "en atención"
-        llamados_actuales = Ticket.query.filter_by(estado='en_atencion').order_by(Ticket.hora_llamado.desc()).limit(2).all()
+    @app.route('/sede/<codigo>')
+    @lectura_en_replica
+    def pantalla_publica(codigo=None):
+        # '/' muestra la sede predeterminada (SEDE_PREDETERMINADA, o la primera creada)
+        sede_id = id_sede(codigo)
+        if sede_id is None:
+            return "Sede no encontrada", 404
+
+        # Todas las pantallas de una sede ven lo mismo: si su cola no cambió, 304 o el HTML ya renderizado
+        def generar():
+            # Se guarda con la versión actual de la cola: leerlo de una réplica atrasada dejaría
+            # llamados viejos en todas las pantallas hasta el próximo cambio. Se renderiza
+            # una vez por versión, así que la base principal casi no lo nota.
+            with en_primaria():
+                return render_template(
+                    'public_display.html',
+                    # Los últimos 2 tickets "en atención" y los últimos 4 finalizados o en atención
+                    llamados=_llamados_pantalla(sede_id),
+                    historial=_historial_pantalla(sede_id),
+                    sala=sala_pantalla(sede_id),
+                    sede_id=sede_id,
+                    # La leyenda se guarda como fragmento: los servicios se consultan solo si cambiaron
+                    servicios_sede=lambda: Servicio.query.filter_by(sede_id=sede_id).order_by(Servicio.nombre_modulo).all()
+                )
 
-        # Buscamos los últimos 4 tickets finalizados o en atención para el historial
-        historial = Ticket.query.filter(Ticket.estado.in_(['en_atencion', 'finalizado']))\
-                            .order_by(Ticket.hora_llamado.desc()).limit(4).all()
+        return cache_vistas.responder(f'pantalla-{sede_id}', cache_vistas.version(sede_id=sede_id), generar)
 
-        return render_template(
-            'public_display.html',
-            llamados=llamados_actuales,
-            historial=historial
-        )
+    def _qr_seguimiento(ticket_id):
+        """Código QR (PNG en base64) con el link al seguimiento del ticket."""
+        url_destino = url_for('estado_ticket_movil', ticket_id=ticket_id, _external=True)
+        # qrcode y Pillow se importan recién aquí
+        import base64
+        import io
+        import qrcode
+        img = qrcode.make(url_destino)
+        buffer = io.BytesIO()
+        img.save(buffer, format="PNG")
+        return base64.b64encode(buffer.getvalue()).decode()
 
     @app.route('/registro', methods=['GET', 'POST'])
     @login_required
@@ -281,11 +1019,27 @@ def create_app():
     def registro():
         form = RegistroForm()
         # Llenamos dinámicamente las opciones del menú desplegable
-        form.servicio.choices = [(s.id, s.nombre_modulo) for s in Servicio.query.all()]
+        form.servicio.choices = [(s.id, s.nombre_modulo) for s in
+                                 Servicio.query.filter_by(sede_id=current_user.sede_id).all()]
 
         if form.validate_on_submit():
             rut_cliente = form.rut.data
             servicio_id = form.servicio.data
+
+            if registro_diferido.activo:
+                # El número sale de memoria y el ticket se escribe en el próximo lote (ver registro_diferido.py)
+                nuevo_ticket = registro_diferido.registrar(
+                    servicio_id,
+                    rut_cliente=rut_cliente,
+                    hora_registro=datetime.now(zona_horaria_chile).replace(tzinfo=None),
+                    es_preferencial=form.es_preferencial.data,
+                    registrado_por_id=current_user.id
+                )
+                if nuevo_ticket is None:
+                    flash("El sistema está muy ocupado, intente nuevamente.", "error")
+                    return render_template('registro.html', form=form)
+                return render_template('registro.html', form=form, ticket_exito=nuevo_ticket,
+                                       qr_code=_qr_seguimiento(nuevo_ticket.id))
             
             intentos = 0
             max_intentos = 3 # Intentará 3 veces antes de rendirse
@@ -298,31 +1052,41 @@ def create_app():
                     # --- Lógica para generar el número ---
                     letra_para_ticket = servicio.letra_actual
                     numero_para_ticket = servicio.numero_actual
-                    siguiente_numero = numero_para_ticket + 1
-                    siguiente_letra = letra_para_ticket
-                    if siguiente_numero > 99:
-                        siguiente_numero = 0
-                        siguiente_letra = chr(ord(letra_para_ticket) + 1)
-                        if siguiente_letra > 'E':
-                            siguiente_letra = 'A'
+                    siguiente_letra, siguiente_num = siguiente_numero(letra_para_ticket, numero_para_ticket)
                 
                     numero_ticket_str = f"{servicio.prefijo_ticket}-{letra_para_ticket}{numero_para_ticket:02d}"
                 
-                    # Actualizamos el servicio
-                    servicio.numero_actual = siguiente_numero
-                    servicio.letra_actual = siguiente_letra
+                    # Actualizamos el servicio SOLO SI el contador sigue como lo leímos.
+                    # Si otro registrador tomó ese número primero, se actualizan 0 filas y reintentamos.
+                    filas_actualizadas = Servicio.query.filter(
+                        Servicio.id == servicio.id,
+                        Servicio.letra_actual == letra_para_ticket,
+                        Servicio.numero_actual == numero_para_ticket
+                    ).update({
+                        'numero_actual': siguiente_num,
+                        'letra_actual': siguiente_letra
+                    }, synchronize_session=False)
+
+                    if filas_actualizadas == 0:
+                        db.session.rollback()
+                        intentos += 1
+                        continue
                 
                     nuevo_ticket = Ticket(
                         numero_ticket=numero_ticket_str,
                         rut_cliente=rut_cliente,
                         modulo_solicitado=servicio.nombre_modulo,
                         servicio_id=servicio.id,
+                        sede_id=servicio.sede_id,
                         hora_registro=datetime.now(zona_horaria_chile).replace(tzinfo=None),
                         es_preferencial=form.es_preferencial.data,
                         registrado_por_id=current_user.id
                     )
                 
                     db.session.add(nuevo_ticket)
+                    db.session.flush()  # Para conocer el id del ticket en su evento
+                    registrar_eventos([evento(EVENTO_REGISTRADO, nuevo_ticket.id, servicio.id, servicio.sede_id,
+                                              nuevo_ticket.hora_registro, usuario=current_user)])
                     db.session.commit() # AQUÍ es donde podría chocar
 
                     # --- SI LLEGA AQUÍ, TODO SALIÓ BIEN ---
@@ -332,19 +1096,15 @@ def create_app():
                         'numero_ticket': numero_ticket_str,
                         'modulo_solicitado': servicio.nombre_modulo,
                         'color_hex': servicio.color_hex,
+                        'es_preferencial': nuevo_ticket.es_preferencial,
                         'hora_registro': nuevo_ticket.get_hora_chile(nuevo_ticket.hora_registro).isoformat()
                     }
-                    socketio.emit('nuevo_ticket_registrado', datos_ticket, room=servicio.nombre_modulo)
+                    difusion.emitir('nuevo_ticket_registrado', datos_ticket, room=sala_servicio(servicio.id))
+                    app.logger.info(f"Ticket {numero_ticket_str} emitido",
+                                    extra={'ticket_id': nuevo_ticket.id, 'servicio_id': servicio.id})
 
                     # --- 🔴 NUEVO BLOQUE: GENERACIÓN DE QR ---
-                    # 1. Creamos el link (asegúrate de haber creado la ruta 'estado_ticket_movil' en app.py)
-                    url_destino = url_for('estado_ticket_movil', ticket_id=nuevo_ticket.id, _external=True)
-                    
-                    # 2. Generamos la imagen en memoria
-                    img = qrcode.make(url_destino)
-                    buffer = io.BytesIO()
-                    img.save(buffer, format="PNG")
-                    qr_b64 = base64.b64encode(buffer.getvalue()).decode()
+                    qr_b64 = _qr_seguimiento(nuevo_ticket.id)
 
                     #flash(f"¡Registro Exitoso! Número Asignado: {numero_ticket_str}", "success")
                     return render_template('registro.html', 
@@ -361,6 +1121,9 @@ def create_app():
 
             # Si sale del while es que falló 3 veces seguidas (muy raro)
             flash("Error de concurrencia: El sistema está muy ocupado, intente nuevamente.", "error")
+        else:
+            for error in form.rut.errors:
+                flash(error, "error")
 
         return render_template('registro.html', form=form)
 
@@ -368,24 +1131,92 @@ def create_app():
     # En app.py
 
     @app.route('/seguimiento/<int:ticket_id>')
+    @lectura_en_replica
     def estado_ticket_movil(ticket_id):
         ticket = db.session.get(Ticket, ticket_id)
 
         if not ticket:
+            # Recién registrado: puede que aún no haya llegado a la réplica
+            with en_primaria():
+                ticket = db.session.get(Ticket, ticket_id)
+
+        if not ticket:
+            # Puede que ya haya sido archivado: en ese caso está finalizado (y ya no cambia)
+            ticket_archivado = db.session.get(TicketArchive, ticket_id)
+            if ticket_archivado:
+                return cache_vistas.responder(
+                    f'seguimiento-{ticket_id}', f'{cache_vistas.nonce}.archivado',
+                    lambda: render_template('mobile_view.html', ticket=ticket_archivado, espera=0, finalizado=True)
+                )
             return "Ticket no encontrado", 404
-        # Lógica de optimización:
-        # Si el ticket ya finalizó, mostramos una vista estática (sin sockets)
-        if ticket.estado == 'finalizado':
-            return render_template('mobile_view.html', ticket=ticket, espera=0, finalizado=True)
-
-        # Si está vivo, calculamos cuántos hay antes que él en SU servicio
-        tickets_antes = Ticket.query.filter(
-            Ticket.servicio_id == ticket.servicio_id,
-            Ticket.estado == 'en_espera',
-            Ticket.id < ticket.id  # IDs menores significan que llegaron antes
-        ).count()
 
-        return render_template('mobile_view.html', ticket=ticket, espera=tickets_antes, finalizado=False)
+        # La versión se toma ANTES de releer el ticket: lo renderizado es al menos así de nuevo
+        version = cache_vistas.version(ticket.servicio_id)
+
+        def generar():
+            # El estado del propio ticket siempre de la base principal (la réplica puede ir atrasada)
+            with en_primaria():
+                db.session.refresh(ticket)
+
+            # Lógica de optimización:
+            # Si el ticket ya finalizó, mostramos una vista estática (sin sockets)
+            if ticket.estado == 'finalizado':
+                return render_template('mobile_view.html', ticket=ticket, espera=0, finalizado=True)
+
+            # Si ya lo llamaron, la vista muestra el mesón (como el caso A de procesarEstado)
+            if ticket.estado == 'en_atencion':
+                return render_template('mobile_view.html', ticket=ticket, espera=0, finalizado=False,
+                                       llamado=True, version=version)
+
+            # Si está vivo, calculamos cuántos hay antes que él en SU servicio
+            tickets_antes = _personas_antes(ticket)
+            estimado = estimador_espera.eta_min(ticket.servicio_id, tickets_antes)
+
+            return render_template('mobile_view.html', ticket=ticket, espera=tickets_antes,
+                                   estimado=estimado, finalizado=False, version=version)
+
+        return cache_vistas.responder(f'seguimiento-{ticket_id}', version, generar)
+
+    @app.route('/api/seguimiento/<int:ticket_id>')
+    @lectura_en_replica
+    def api_seguimiento(ticket_id):
+        datos = _datos_seguimiento(ticket_id)
+        if datos is None:
+            return jsonify({'error': 'Ticket no encontrado'}), 404
+        return jsonify(datos)
+
+    @app.route('/api/seguimiento/<int:ticket_id>/esperar')
+    @lectura_en_replica
+    def api_seguimiento_esperar(ticket_id):
+        # Long-poll: si el cliente ya tiene la versión actual, la solicitud queda en
+        # espera hasta que cambie la cola de su servicio (o se cumpla el plazo).
+        if reconexiones.drenando:
+            # El proceso se está apagando: cada teléfono vuelve en un momento distinto
+            return jsonify({'error': 'Reiniciando'}), 503, {'Retry-After': str(round(reconexiones.reintentar_en()))}
+        version_cliente = request.args.get('version', '')
+        datos = _datos_seguimiento(ticket_id)
+        if datos is None:
+            return jsonify({'error': 'Ticket no encontrado'}), 404
+
+        # Solo espera quien sigue en la fila: un ticket llamado o finalizado responde de inmediato
+        if datos['version'] == version_cliente and datos['estado'] == 'en_espera':
+            db.session.close()  # Devolvemos la conexión al pool mientras esperamos
+            if cache_vistas.esperar_cambio(datos['servicio_id'], version_cliente,
+                                           app.config['SEGUIMIENTO_ESPERA_S'],
+                                           socketio.server.eio.create_event):
+                datos = _datos_seguimiento(ticket_id) or datos
+        return jsonify(datos)
+
+    @app.route('/voz/<huella>/<numero_ticket>/<int:numero_meson>.mp3')
+    def anuncio_voz(huella, numero_ticket, numero_meson):
+        # Anuncio del llamado para la pantalla pública: compuesto una vez y luego leído de la caché
+        ruta = anuncios.archivo(huella, numero_ticket, numero_meson)
+        if ruta is None:
+            return "Anuncio no disponible", 404
+        respuesta = send_file(ruta, mimetype='audio/mpeg', conditional=True)
+        # La huella de las grabaciones está en la URL: si cambian, cambia la URL
+        respuesta.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+        return respuesta
     
     @app.route('/login', methods=['GET', 'POST'])
     def login():
@@ -423,59 +1254,71 @@ def create_app():
     @app.route('/admin')
     @login_required
     @role_required('admin')
+    @lectura_en_replica
     def admin_dashboard():
-        # --- CÁLCULO DE ESTADÍSTICAS ---
+        # --- CÁLCULO DE ESTADÍSTICAS (de la sede activa) ---
+        sede_id = sede_activa()
         hoy = datetime.now(zona_horaria_chile).date()
+        # Lo del día sale del registro de eventos: filas angostas y un índice
+        # (sede_id, tipo, momento) que entrega justo los eventos de hoy.
+        inicio_hoy = datetime.combine(hoy, datetime.min.time())
+
+        def eventos_de_hoy(*tipos):
+            return (TicketEvent.sede_id == sede_id, TicketEvent.tipo.in_(tipos),
+                    TicketEvent.momento >= inicio_hoy, TicketEvent.momento < inicio_hoy + timedelta(days=1))
     
-        tickets_hoy = Ticket.query.filter(func.date(Ticket.hora_registro) == hoy).count()
-        tickets_en_espera = Ticket.query.filter_by(estado='en_espera').count()
-        tickets_en_atencion = Ticket.query.filter_by(estado='en_atencion').count()
-        tickets_finalizados_hoy = Ticket.query.filter(
-            func.date(Ticket.hora_registro) == hoy,
-            Ticket.estado == 'finalizado'
-        ).count()
+        tickets_hoy = TicketEvent.query.filter(*eventos_de_hoy(EVENTO_REGISTRADO)).count()
+        tickets_en_espera = Ticket.query.filter_by(sede_id=sede_id, estado='en_espera').count()
+        tickets_en_atencion = Ticket.query.filter_by(sede_id=sede_id, estado='en_atencion').count()
+        tickets_finalizados_hoy = TicketEvent.query.filter(*eventos_de_hoy(EVENTO_FINALIZADO, EVENTO_CERRADO)).count()
 
         # --- CONSULTA PARA GRÁFICO DE DONA (TICKETS POR SERVICIO) ---
-        datos_grafico_dona_raw = db.session.query(
-            Servicio.nombre_modulo, 
-            Servicio.color_hex,
-            func.count(Ticket.id)
-        ).join(Ticket, Servicio.id == Ticket.servicio_id).group_by(
-            Servicio.nombre_modulo, 
-            Servicio.color_hex
-        ).all()
-        chart_data_dona = [list(row) for row in datos_grafico_dona_raw]
+        # Es histórico, así que incluye también los tickets archivados
+        # (los días ya cerrados salen del resumen diario, ver _tickets_por_servicio)
+        tickets_por_servicio = _tickets_por_servicio(sede_id)
+        chart_data_dona = [
+            [servicio.nombre_modulo, servicio.color_hex, tickets_por_servicio[servicio.id]]
+            for servicio in Servicio.query.filter_by(sede_id=sede_id).order_by(Servicio.nombre_modulo).all()
+            if tickets_por_servicio.get(servicio.id)
+        ]
 
         # --- CONSULTA PARA GRÁFICO DE LÍNEAS (TICKETS POR HORA) ---
         tickets_por_hora_raw = db.session.query(
-            func.extract('hour', Ticket.hora_registro).label('hora'),
-            func.count(Ticket.id).label('cantidad')
-        ).filter(func.date(Ticket.hora_registro) == hoy).group_by('hora').order_by('hora').all()
+            func.extract('hour', TicketEvent.momento).label('hora'),
+            func.count(TicketEvent.id).label('cantidad')
+        ).filter(*eventos_de_hoy(EVENTO_REGISTRADO)).group_by('hora').order_by('hora').all()
 
         datos_grafico_lineas = {f"{h:02d}": 0 for h in range(8, 19)} # Horario de 8am a 6pm
         for row in tickets_por_hora_raw:
             datos_grafico_lineas[f"{int(row.hora):02d}"] = row.cantidad
 
         # --- CÁLCULO DE PROMEDIO DE ESPERA ---
-        # Buscamos tickets atendidos hoy que tengan hora de llamado
-        tickets_atendidos_hoy_data = Ticket.query.filter(
-            func.date(Ticket.hora_registro) == hoy,
-            Ticket.hora_llamado.isnot(None)
-        ).all()
+        # Cada llamado de hoy guarda su espera (hora llamado - hora registro) en 'segundos':
+        # el promedio lo calcula la base de datos, sin traer los tickets.
+        espera_promedio_s = db.session.query(func.avg(TicketEvent.segundos)).filter(
+            *eventos_de_hoy(EVENTO_LLAMADO)
+        ).scalar()
 
         promedio_espera_str = "0 min"
-        if tickets_atendidos_hoy_data:
-            total_segundos = 0
-            count = 0
-            for t in tickets_atendidos_hoy_data:
-                # Tiempo espera = Hora Llamado - Hora Registro
-                delta = t.hora_llamado - t.hora_registro
-                total_segundos += delta.total_seconds()
-                count += 1
-            
-            if count > 0:
-                promedio_minutos = int((total_segundos / count) / 60)
-                promedio_espera_str = f"{promedio_minutos} min"
+        if espera_promedio_s is not None:
+            promedio_minutos = int(espera_promedio_s / 60)
+            promedio_espera_str = f"{promedio_minutos} min"
+
+        # --- ESPERA ESTIMADA POR SERVICIO (estimador en memoria, ver estimaciones.py) ---
+        en_espera_por_servicio = dict(db.session.query(Ticket.servicio_id, func.count(Ticket.id)).filter(
+            Ticket.sede_id == sede_id,
+            Ticket.estado == 'en_espera'
+        ).group_by(Ticket.servicio_id).all())
+        atenciones = estimador_espera.resumen()
+        estimaciones = [{
+            'nombre_modulo': servicio.nombre_modulo,
+            'duracion_min': round(atenciones[servicio.id]['duracion_s'] / 60, 1) if servicio.id in atenciones else None,
+            'mesones': estimador_espera.mesones_activos(servicio.id),
+            'en_espera': en_espera_por_servicio.get(servicio.id, 0),
+            # Espera de quien llegue ahora (detrás de todos los que esperan)
+            'espera_min': estimador_espera.eta_min(servicio.id, en_espera_por_servicio.get(servicio.id, 0)),
+        } for servicio in Servicio.query.filter_by(sede_id=sede_id).order_by(Servicio.nombre_modulo).all()
+            if servicio.id in atenciones or servicio.id in en_espera_por_servicio]
         # -----------------------------------------------------------------
     
         return render_template(
@@ -487,24 +1330,49 @@ def create_app():
             promedio_espera=promedio_espera_str,
             chart_data_dona=chart_data_dona,
             chart_data_lineas=datos_grafico_lineas,
-            sistema_abierto=sistema_esta_abierto()
+            sistema_abierto=sistema_esta_abierto(sede_id),
+            sede=db.session.get(Sede, sede_id),
+            # Solo quien administra todas las sedes puede cambiar de sede
+            sedes=Sede.query.order_by(Sede.nombre).all() if current_user.sede_id is None else None,
+            estimaciones=estimaciones,
+            tareas=programador.resumen(),
+            rendimiento=metricas.resumen()
         )
 
     @app.route('/admin/reporte/tickets')
     @login_required
     @role_required('admin')
+    @lectura_en_replica
     def descargar_reporte_tickets():
         # Creamos alias para distinguir al Registrador del Atendedor
         Registrador = aliased(Usuario)
         Atendedor = aliased(Usuario)
 
-        # Consulta avanzada uniendo la tabla Usuario dos veces
-        tickets_query = db.session.query(Ticket, Registrador, Atendedor).outerjoin(
-            Registrador, Ticket.registrado_por_id == Registrador.id
+        # Consulta avanzada uniendo la tabla Usuario dos veces.
+        # El reporte cubre tanto los tickets vivos como los archivados.
+        sede_id = sede_activa()
+        tickets_historicos = _get_tickets_historicos(sede_id)
+        # Los re-llamados solo quedan en el registro de eventos
+        rellamados = db.session.query(
+            TicketEvent.ticket_id, func.count(TicketEvent.id).label('veces')
+        ).filter(TicketEvent.sede_id == sede_id, TicketEvent.tipo == EVENTO_RELLAMADO).group_by(
+            TicketEvent.ticket_id
+        ).subquery('rellamados')
+        tickets_query = db.session.query(
+            tickets_historicos,
+            Registrador.nombre_funcionario.label('nombre_registrador'),
+            Atendedor.nombre_funcionario.label('nombre_atendedor'),
+            rellamados.c.veces.label('veces_rellamado')
+        ).outerjoin(
+            Registrador, tickets_historicos.c.registrado_por_id == Registrador.id
+        ).outerjoin(
+            Atendedor, tickets_historicos.c.atendido_por_id == Atendedor.id
         ).outerjoin(
-            Atendedor, Ticket.atendido_por_id == Atendedor.id
-        ).order_by(Ticket.hora_registro.asc()).all()
+            rellamados, tickets_historicos.c.id == rellamados.c.ticket_id
+        ).order_by(tickets_historicos.c.hora_registro.asc(), tickets_historicos.c.id.asc()).all()
 
+        import csv
+        import io
         output = io.StringIO()
         writer = csv.writer(output)
 
@@ -512,17 +1380,17 @@ def create_app():
         writer.writerow([
             'ID Ticket', 'Numero Ticket', 'RUT Cliente', 'Modulo Solicitado', 'Estado', 
             'Hora Registro', 'Hora Llamado', 'Hora Finalizado', 
-            'Registrado Por', 'Atendido Por', 'Numero Meson'
+            'Registrado Por', 'Atendido Por', 'Numero Meson', 'Veces Rellamado'
         ])
 
-        for ticket, registrador, atendedor in tickets_query:
+        for ticket in tickets_query:
             # Obtenemos los nombres o dejamos string vacío si no existe
-            nombre_registrador = registrador.nombre_funcionario if registrador else 'Sistema/Antiguo'
-            nombre_atendedor = atendedor.nombre_funcionario if atendedor else ''
+            nombre_registrador = ticket.nombre_registrador or 'Sistema/Antiguo'
+            nombre_atendedor = ticket.nombre_atendedor or ''
         
-            h_reg = ticket.get_hora_chile(ticket.hora_registro)
-            h_llam = ticket.get_hora_chile(ticket.hora_llamado)
-            h_fin = ticket.get_hora_chile(ticket.hora_finalizado)
+            h_reg = Ticket.get_hora_chile(ticket.hora_registro)
+            h_llam = Ticket.get_hora_chile(ticket.hora_llamado)
+            h_fin = Ticket.get_hora_chile(ticket.hora_finalizado)
     
             writer.writerow([
                 ticket.id, 
@@ -535,7 +1403,8 @@ def create_app():
                 h_fin.strftime('%Y-%m-%d %H:%M:%S') if h_fin else '',
                 nombre_registrador,  # <--- Nuevo dato en el CSV
                 nombre_atendedor,
-                ticket.numero_meson
+                ticket.numero_meson,
+                ticket.veces_rellamado or 0
             ])
 
         output.seek(0)
@@ -547,13 +1416,80 @@ def create_app():
             headers={"Content-Disposition": "attachment;filename=reporte_tickets_completo.csv"}
         )
 
+    @app.route('/admin/reporte/eventos')
+    @login_required
+    @role_required('admin')
+    @lectura_en_replica
+    def descargar_reporte_eventos():
+        # Registro de eventos de la sede, por defecto de los últimos 30 días (?dias=N)
+        sede_id = sede_activa()
+        dias = max(request.args.get('dias', 30, type=int), 1)
+        desde = datetime.combine(datetime.now(zona_horaria_chile).date() - timedelta(days=dias - 1), datetime.min.time())
+        eventos = db.session.query(TicketEvent).filter(
+            TicketEvent.sede_id == sede_id,
+            TicketEvent.momento >= desde
+        ).order_by(TicketEvent.id.asc()).all()
+        servicios = dict(db.session.query(Servicio.id, Servicio.nombre_modulo).filter_by(sede_id=sede_id).all())
+        ids_usuarios = {e.usuario_id for e in eventos if e.usuario_id is not None}
+        usuarios = dict(db.session.query(Usuario.id, Usuario.nombre_funcionario).filter(
+            Usuario.id.in_(ids_usuarios)).all()) if ids_usuarios else {}
+
+        import csv
+        import io
+        output = io.StringIO()
+        writer = csv.writer(output)
+        writer.writerow(['ID Evento', 'ID Ticket', 'Evento', 'Fecha', 'Servicio', 'Usuario', 'Numero Meson', 'Segundos'])
+        for e in eventos:
+            writer.writerow([
+                e.id,
+                e.ticket_id,
+                NOMBRES_EVENTO.get(e.tipo, e.tipo),
+                e.momento.strftime('%Y-%m-%d %H:%M:%S'),
+                servicios.get(e.servicio_id, ''),
+                usuarios.get(e.usuario_id, ''),
+                e.numero_meson if e.numero_meson is not None else '',
+                e.segundos if e.segundos is not None else ''
+            ])
+
+        return Response(
+            ('\ufeff' + output.getvalue()).encode('utf-8'),
+            mimetype="text/csv",
+            headers={"Content-Disposition": f"attachment;filename=eventos_tickets_{dias}_dias.csv"}
+        )
+
+    @app.route('/admin/clientes')
+    @login_required
+    @role_required('admin')
+    @lectura_en_replica
+    def buscar_cliente():
+        texto = request.args.get('rut', '').strip()
+        if not texto:
+            return render_template('buscar_cliente.html', rut=None)
+        try:
+            rut = normalizar_rut(texto)
+        except ValueError as error:
+            flash(str(error), 'error')
+            return redirect(url_for('buscar_cliente'))
+
+        cursor = decodificar_cursor(request.args.get('despues'), COLUMNAS_HISTORIAL_RUT)
+        visitas, siguiente = _historial_rut(rut, cursor)
+        return render_template(
+            'buscar_cliente.html',
+            rut=rut,
+            visitas=visitas,
+            siguiente=siguiente,
+            # El resumen se muestra solo en la primera página
+            estadisticas=None if cursor is not None else _estadisticas_rut(rut)
+        )
+
     @app.route('/admin/crear_usuario', methods=['GET', 'POST'])
     @login_required
     @role_required('admin')
     def crear_usuario():
         form = CrearUsuarioForm()
-        # Llenamos dinámicamente las opciones del menú desplegable
-        form.modulo_asignado.choices = [(s.id, s.nombre_modulo) for s in Servicio.query.all()]
+        # Llenamos dinámicamente las opciones del menú desplegable (servicios de la sede activa)
+        sede_id = sede_activa()
+        form.modulo_asignado.choices = [(s.id, s.nombre_modulo) for s in Servicio.query.filter_by(sede_id=sede_id).all()]
         form.modulo_asignado.choices.insert(0, (0, 'Ninguno'))
 
         if form.validate_on_submit():
@@ -563,15 +1499,16 @@ def create_app():
             else:
                 nuevo_usuario = Usuario(
                     nombre_funcionario=form.username.data,
-                    rol=form.rol.data
+                    rol=form.rol.data,
+                    sede_id=sede_id
                 )
                 nuevo_usuario.password = form.password.data
 
                 if nuevo_usuario.rol == 'staff':
-                    # Obtenemos el nombre del servicio a partir del ID seleccionado
+                    # Verificamos que el ID seleccionado corresponda a un servicio existente de la sede
                     servicio_seleccionado = db.session.get(Servicio, form.modulo_asignado.data)
-                    if servicio_seleccionado:
-                        nuevo_usuario.modulo_asignado = servicio_seleccionado.nombre_modulo
+                    if servicio_seleccionado and servicio_seleccionado.sede_id == sede_id:
+                        nuevo_usuario.servicio_id = servicio_seleccionado.id
                 
                     if form.numero_meson.data is not None:
                         nuevo_usuario.numero_meson = form.numero_meson.data
@@ -594,7 +1531,7 @@ def create_app():
 
         usuario_a_eliminar = db.session.get(Usuario, user_id)
     
-        if usuario_a_eliminar:
+        if usuario_a_eliminar and usuario_a_eliminar.sede_id == sede_activa():
             db.session.delete(usuario_a_eliminar)
             db.session.commit()
             flash('Usuario eliminado exitosamente.', 'success')
@@ -608,23 +1545,23 @@ def create_app():
     @role_required('admin')
     def editar_usuario(user_id):
         usuario_a_editar = db.session.get(Usuario, user_id)
-        if not usuario_a_editar:
+        if not usuario_a_editar or usuario_a_editar.sede_id != sede_activa():
             flash('Usuario no encontrado.', 'error')
             return redirect(url_for('gestionar_usuarios'))
     
         form = EditarUsuarioForm(obj=usuario_a_editar)
 
         # --- LÓGICA PARA EL MENÚ DESPLEGABLE ---
-        # Obtenemos todos los servicios y los añadimos como opciones
-        form.modulo_asignado.choices = [(s.id, s.nombre_modulo) for s in Servicio.query.all()]
+        # Obtenemos los servicios de su sede y los añadimos como opciones
+        form.modulo_asignado.choices = [(s.id, s.nombre_modulo) for s in
+                                        Servicio.query.filter_by(sede_id=usuario_a_editar.sede_id).all()]
         # Añadimos una opción para "Ninguno"
         form.modulo_asignado.choices.insert(0, (0, 'Ninguno'))
     
-        # Seleccionamos el módulo actual del usuario
-        if usuario_a_editar.modulo_asignado:
-            servicio_actual = Servicio.query.filter_by(nombre_modulo=usuario_a_editar.modulo_asignado).first()
-            if servicio_actual:
-                form.modulo_asignado.data = servicio_actual.id
+        # Seleccionamos el módulo actual del usuario (solo al mostrar el formulario,
+        # para no pisar la opción que viene en el POST)
+        if request.method == 'GET':
+            form.modulo_asignado.data = usuario_a_editar.servicio_id or 0
         # ------------------------------------
 
         if form.validate_on_submit():
@@ -638,15 +1575,14 @@ def create_app():
         
             if usuario_a_editar.rol == 'staff':
                 servicio_seleccionado = db.session.get(Servicio, form.modulo_asignado.data)
-                if servicio_seleccionado:
-                    usuario_a_editar.modulo_asignado = servicio_seleccionado.nombre_modulo
-                else:
-                    usuario_a_editar.modulo_asignado = None
+                if servicio_seleccionado and servicio_seleccionado.sede_id != usuario_a_editar.sede_id:
+                    servicio_seleccionado = None
+                usuario_a_editar.servicio_id = servicio_seleccionado.id if servicio_seleccionado else None
 
                 if form.numero_meson.data is not None:
                     usuario_a_editar.numero_meson = form.numero_meson.data
             else:
-                usuario_a_editar.modulo_asignado = None
+                usuario_a_editar.servicio_id = None
                 usuario_a_editar.numero_meson = None
 
             db.session.commit()
@@ -660,36 +1596,111 @@ def create_app():
     @login_required
     @role_required('admin')
     def gestionar_usuarios():
-        # Esta función solo se preocupa de buscar y mostrar los usuarios
-        usuarios = Usuario.query.all()
-        return render_template('gestionar_usuarios.html', usuarios=usuarios)
+        # Esta función solo se preocupa de buscar y mostrar los usuarios (por nombre, una página a la vez)
+        columnas = (Usuario.nombre_funcionario,)
+        cursor = decodificar_cursor(request.args.get('despues'), columnas)
+        consulta = Usuario.query.filter_by(sede_id=sede_activa())
+        usuarios, siguiente = paginar(
+            consulta, columnas, cursor, app.config['ADMIN_TAMANO_PAGINA'], descendente=False
+        )
+        return render_template('gestionar_usuarios.html', usuarios=usuarios, siguiente=siguiente,
+                               total=consulta.count(), es_primera_pagina=cursor is None)
 
     @app.route('/admin/reset_servicio/<int:service_id>', methods=['POST'])
     @login_required
     @role_required('admin')
     def reset_servicio(service_id):
         servicio = db.session.get(Servicio, service_id)
-        if servicio:
-            # 1. ELIMINAMOS los tickets antiguos de este servicio
-            # Esto es necesario para liberar los números (ej: A00) y que no dé error de duplicado.
-            Ticket.query.filter_by(servicio_id=service_id).delete()
-            
-            # 2. REINICIAMOS los contadores a A - 0
+        if not servicio or servicio.sede_id != sede_activa():
+            flash('Servicio no encontrado.', 'error')
+            return redirect(url_for('gestionar_servicios'))
+
+        progreso = reinicios_en_curso.get(service_id)
+        if progreso and progreso['estado'] == 'en_curso':
+            flash(f'Ya hay un reinicio en curso para "{servicio.nombre_modulo}".', 'error')
+            return redirect(url_for('gestionar_servicios'))
+
+        # 1. REINICIAMOS los contadores a A - 0 de inmediato (transacción corta).
+        # Los tickets nuevos que se registren desde ahora quedan fuera del corte.
+        # En la misma transacción se cierran los que seguían en espera o en atención:
+        # si no, convivirían en la cola con los nuevos del mismo número y el archivo
+        # podría llevarse un ticket que un funcionario acaba de llamar.
+        # Con el registro diferido, los pendientes se escriben antes y el contador se vuelve a leer después
+        with registro_diferido.pausa(service_id):
+            corte_id = db.session.query(func.max(Ticket.id)).filter(Ticket.servicio_id == service_id).scalar()
+            abiertos = [Ticket.servicio_id == service_id, Ticket.estado.in_(['en_atencion', 'en_espera'])]
+            ids_en_atencion = [t_id for (t_id,) in db.session.query(Ticket.id).filter(
+                Ticket.servicio_id == service_id, Ticket.estado == 'en_atencion')]
+            ahora = datetime.now(zona_horaria_chile).replace(tzinfo=None)
+            registrar_eventos_de(*abiertos, tipo=EVENTO_CERRADO, momento=ahora)
+            cerrados = Ticket.query.filter(*abiertos).update({
+                'estado': 'finalizado',
+                'hora_finalizado': ahora
+            }, synchronize_session=False)
             servicio.letra_actual = 'A'
             servicio.numero_actual = 0
-            
             db.session.commit()
-            flash(f'Historial borrado y contador reiniciado para "{servicio.nombre_modulo}".', 'success')
-        else:
-            flash('Servicio no encontrado.', 'error')
+        cache_vistas.cambio(service_id, servicio.sede_id)
+        if ids_en_atencion:
+            difusion.emitir('atencion_finalizada', {
+                'ids_tickets': ids_en_atencion,
+                'historial': _get_historial_data(servicio.sede_id)
+            }, room=sala_pantalla(servicio.sede_id))
+
+        # 2. ARCHIVAMOS los tickets anteriores en segundo plano, por lotes,
+        # para no bloquear 'registro' ni 'llamar_siguiente' de los demás servicios.
+        if corte_id is not None:
+            total = Ticket.query.filter(Ticket.servicio_id == service_id, Ticket.id <= corte_id,
+                                        Ticket.estado == 'finalizado').count()
+            reinicios_en_curso[service_id] = {'total': total, 'procesados': 0, 'estado': 'en_curso'}
+            socketio.start_background_task(_archivar_reinicio, service_id, servicio.sede_id, corte_id)
+
+        flash(f'Contador reiniciado para "{servicio.nombre_modulo}" ({cerrados} tickets pendientes cerrados). '
+              'El historial se está archivando en segundo plano.', 'success')
         return redirect(url_for('gestionar_servicios'))
 
+    def _archivar_reinicio(service_id, sede_id, corte_id):
+        progreso = reinicios_en_curso[service_id]
+
+        def al_avanzar(procesados):
+            progreso['procesados'] = procesados
+            socketio.sleep(0)  # Cedemos el turno a las demás solicitudes entre lotes
+
+        with app.app_context():
+            try:
+                # Solo los finalizados: nunca un ticket que alguien esté atendiendo
+                archivar_tickets(
+                    Ticket.servicio_id == service_id,
+                    Ticket.id <= corte_id,
+                    Ticket.estado == 'finalizado',
+                    tamano_lote=app.config['RESET_TAMANO_LOTE'],
+                    al_avanzar=al_avanzar
+                )
+                progreso['estado'] = 'completado'
+                cache_vistas.cambio(service_id, sede_id)
+            except Exception:
+                db.session.rollback()
+                progreso['estado'] = 'error'
+                app.logger.exception(f"Error al archivar el historial del servicio {service_id}")
+
+    @app.route('/admin/reset_servicio/<int:service_id>/progreso')
+    @login_required
+    @role_required('admin')
+    def progreso_reset_servicio(service_id):
+        return jsonify(reinicios_en_curso.get(service_id, {'estado': 'sin_reinicio'}))
+
     @app.route('/admin/servicios')
     @login_required
     @role_required('admin')
     def gestionar_servicios():
-        servicios = Servicio.query.all()
-        return render_template('gestionar_servicios.html', servicios=servicios)
+        columnas = (Servicio.nombre_modulo,)
+        cursor = decodificar_cursor(request.args.get('despues'), columnas)
+        consulta = Servicio.query.filter_by(sede_id=sede_activa())
+        servicios, siguiente = paginar(
+            consulta, columnas, cursor, app.config['ADMIN_TAMANO_PAGINA'], descendente=False
+        )
+        return render_template('gestionar_servicios.html', servicios=servicios, reinicios=reinicios_en_curso,
+                               siguiente=siguiente, total=consulta.count(), es_primera_pagina=cursor is None)
 
     @app.route('/admin/crear_servicio', methods=['GET', 'POST'])
     @login_required
@@ -697,8 +1708,10 @@ def create_app():
     def crear_servicio():
         form = CrearServicioForm()
         if form.validate_on_submit():
-            # Verificamos que el nombre y el prefijo no existan ya
+            # Verificamos que el nombre y el prefijo no existan ya en la sede
+            sede_id = sede_activa()
             servicio_existente = Servicio.query.filter(
+                Servicio.sede_id == sede_id,
                 (Servicio.nombre_modulo == form.nombre_modulo.data) | 
                 (Servicio.prefijo_ticket == form.prefijo_ticket.data)
             ).first()
@@ -707,6 +1720,7 @@ def create_app():
                 flash('Ya existe un servicio con ese nombre o prefijo.', 'error')
             else:
                 nuevo_servicio = Servicio(
+                    sede_id=sede_id,
                     nombre_modulo=form.nombre_modulo.data,
                     prefijo_ticket=form.prefijo_ticket.data,
                     color_hex=form.color_hex.data,
@@ -714,6 +1728,7 @@ def create_app():
                 )
                 db.session.add(nuevo_servicio)
                 db.session.commit()
+                cache_vistas.cambio()
                 flash('Nuevo servicio creado exitosamente.', 'success')
                 return redirect(url_for('gestionar_servicios'))
             
@@ -724,7 +1739,7 @@ def create_app():
     @role_required('admin')
     def editar_servicio(service_id):
         servicio_a_editar = db.session.get(Servicio, service_id)
-        if not servicio_a_editar:
+        if not servicio_a_editar or servicio_a_editar.sede_id != sede_activa():
             flash('Servicio no encontrado.', 'error')
             return redirect(url_for('gestionar_servicios'))
 
@@ -734,13 +1749,15 @@ def create_app():
         form.submit.label.text = 'Actualizar Servicio'
 
         if form.validate_on_submit():
-            # Actualizamos los datos del objeto con los datos del formulario
-            servicio_a_editar.nombre_modulo = form.nombre_modulo.data
-            servicio_a_editar.prefijo_ticket = form.prefijo_ticket.data
-            servicio_a_editar.color_hex = form.color_hex.data
-            servicio_a_editar.visible_en_pantalla = form.visible_en_pantalla.data
-        
-            db.session.commit()
+            # Con el registro diferido, los próximos tickets deben tomar el prefijo y el nombre nuevos
+            with registro_diferido.pausa(service_id):
+                # Actualizamos los datos del objeto con los datos del formulario
+                servicio_a_editar.nombre_modulo = form.nombre_modulo.data
+                servicio_a_editar.prefijo_ticket = form.prefijo_ticket.data
+                servicio_a_editar.color_hex = form.color_hex.data
+                servicio_a_editar.visible_en_pantalla = form.visible_en_pantalla.data
+                db.session.commit()
+            cache_vistas.cambio()  # Nombre y color aparecen en la pantalla y en el seguimiento
             flash('Servicio actualizado exitosamente.', 'success')
             return redirect(url_for('gestionar_servicios'))
 
@@ -752,18 +1769,24 @@ def create_app():
     def eliminar_servicio(service_id):
         servicio_a_eliminar = db.session.get(Servicio, service_id)
     
-        if not servicio_a_eliminar:
+        if not servicio_a_eliminar or servicio_a_eliminar.sede_id != sede_activa():
             flash('Servicio no encontrado.', 'error')
             return redirect(url_for('gestionar_servicios'))
 
-        # Verificamos si existen tickets asociados a este servicio
-        tickets_asociados = Ticket.query.filter_by(servicio_id=service_id).first()
-    
+        # Con el registro diferido, sus tickets pendientes se escriben antes de revisar
+        with registro_diferido.pausa(service_id):
+            # Verificamos si existen tickets asociados a este servicio (vivos o archivados)
+            tickets_asociados = Ticket.query.filter_by(servicio_id=service_id).first() or \
+                TicketArchive.query.filter_by(servicio_id=service_id).first()
+
+            if not tickets_asociados:
+                db.session.delete(servicio_a_eliminar)
+                db.session.commit()
+
         if tickets_asociados:
             flash('No se puede eliminar este servicio porque tiene tickets históricos asociados.', 'error')
         else:
-            db.session.delete(servicio_a_eliminar)
-            db.session.commit()
+            cache_vistas.cambio()
             flash('Servicio eliminado exitosamente.', 'success')
 
         return redirect(url_for('gestionar_servicios'))
@@ -773,27 +1796,54 @@ def create_app():
     @role_required('staff')
     @check_sistema_abierto
     def panel():
-        # Busca los tickets en espera para el módulo del funcionario
-        tickets_en_espera = Ticket.query.filter_by(
-            modulo_solicitado=current_user.modulo_asignado,
+        # Solo la primera página de la cola: con cientos de personas en espera el
+        # HTML completo era enorme. El resto se pide a '/panel/espera' al desplazarse.
+        tickets_en_espera, siguiente_espera = _pagina_espera(
+            current_user.sede_id, current_user.servicio_id, None, app.config['PANEL_TAMANO_PAGINA']
+        )
+        total_en_espera = len(tickets_en_espera) if siguiente_espera is None else Ticket.query.filter_by(
+            sede_id=current_user.sede_id,
+            servicio_id=current_user.servicio_id,
             estado='en_espera'
-        ).order_by(Ticket.hora_registro.asc()).all()
+        ).count()
 
-        # Busca si este funcionario tiene un ticket "en atencion"
-        ticket_en_atencion = Ticket.query.filter_by(
+        # Busca los tickets que este funcionario tiene "en atencion"
+        # (normalmente uno, pero pueden ser varios si llamó a un grupo)
+        tickets_en_atencion = Ticket.query.filter_by(
             atendido_por_id=current_user.id,
             estado='en_atencion'
-        ).first()
+        ).order_by(Ticket.hora_llamado.asc(), Ticket.id.asc()).all()
+        ticket_en_atencion = tickets_en_atencion[0] if tickets_en_atencion else None
 
         form = AccionForm()
+        form_lote = LlamarLoteForm()
 
         return render_template(
             'panel.html', 
             tickets_en_espera=tickets_en_espera, 
+            siguiente_espera=siguiente_espera,
+            total_en_espera=total_en_espera,
             ticket_en_atencion=ticket_en_atencion,  # <-- Enviamos el ticket actual a la plantilla
-            form=form
+            tickets_en_atencion=tickets_en_atencion,
+            form=form,
+            form_lote=form_lote
         )
 
+    @app.route('/panel/espera')
+    @login_required
+    @role_required('staff')
+    @check_sistema_abierto
+    @lectura_en_replica
+    def panel_espera():
+        """Página siguiente de la cola del panel (JSON), después del cursor 'despues'."""
+        cursor = decodificar_cursor(request.args.get('despues'), COLUMNAS_COLA)
+        if cursor is None:
+            return jsonify({'error': 'Cursor inválido.'}), 400
+        tickets, siguiente = _pagina_espera(
+            current_user.sede_id, current_user.servicio_id, cursor, app.config['PANEL_TAMANO_PAGINA']
+        )
+        return jsonify({'tickets': [_ticket_espera_json(t) for t in tickets], 'siguiente': siguiente})
+
     @app.route('/llamar-siguiente', methods=['POST'])
     @login_required
     @role_required('staff')
@@ -803,7 +1853,8 @@ def create_app():
         while True:
             # 1. Buscar el candidato más antiguo
             ticket_candidato = Ticket.query.filter_by(
-                modulo_solicitado=current_user.modulo_asignado,
+                sede_id=current_user.sede_id,
+                servicio_id=current_user.servicio_id,
                 estado='en_espera'
             ).order_by(
                 Ticket.es_preferencial.desc(),
@@ -818,47 +1869,48 @@ def create_app():
             # Intentamos actualizar el ticket SOLO SI su estado sigue siendo 'en_espera'.
             # Si alguien (Bea) nos ganó el clic hace 1 milisegundo, el estado ya será 'en_atencion'
             # y esta actualización afectará a 0 filas.
+            ahora = datetime.now(zona_horaria_chile).replace(tzinfo=None)
             filas_actualizadas = Ticket.query.filter(
                 Ticket.id == ticket_candidato.id,
                 Ticket.estado == 'en_espera'
             ).update({
                 'estado': 'en_atencion',
-                'hora_llamado': datetime.now(zona_horaria_chile).replace(tzinfo=None),
+                'hora_llamado': ahora,
                 'atendido_por_id': current_user.id,
                 'numero_meson': current_user.numero_meson
             }, synchronize_session=False)
 
-            db.session.commit()
-
             # 3. Verificamos si ganamos la carrera
             if filas_actualizadas > 0:
-                # ¡Ganamos! Somos dueños del ticket, procedemos a notificar.
-                
-                # (Opcional) Limpiar ticket anterior si había uno colgado
-                Ticket.query.filter(
+                # ¡Ganamos! Somos dueños del ticket: en la misma transacción cerramos
+                # el ticket anterior si había uno colgado y dejamos ambos eventos.
+                anterior = (
                     Ticket.atendido_por_id == current_user.id,
                     Ticket.estado == 'en_atencion',
                     Ticket.id != ticket_candidato.id # Que no sea el que acabamos de tomar
-                ).update({'estado': 'finalizado'})
+                )
+                registrar_eventos_de(*anterior, tipo=EVENTO_CERRADO, momento=ahora, usuario=current_user)
+                Ticket.query.filter(*anterior).update(
+                    {'estado': 'finalizado', 'hora_finalizado': ahora}, synchronize_session=False
+                )
+                registrar_eventos([evento(EVENTO_LLAMADO, ticket_candidato.id, ticket_candidato.servicio_id,
+                                          ticket_candidato.sede_id, ahora, usuario=current_user,
+                                          segundos=ahora - ticket_candidato.hora_registro)])
                 db.session.commit()
+                cache_vistas.cambio(ticket_candidato.servicio_id, ticket_candidato.sede_id)
+                estimador_espera.llamado(ticket_candidato.servicio_id, current_user.id)
 
-                # --- Notificación por WebSockets ---
-                datos_llamado = {
-                    'id_ticket': ticket_candidato.id,
-                    'nombre_modulo': ticket_candidato.servicio.nombre_modulo,
-                    'numero_ticket': ticket_candidato.numero_ticket,
-                    'color_hex': ticket_candidato.servicio.color_hex,
-                    'numero_meson': current_user.numero_meson,
-                    'es_preferencial': ticket_candidato.es_preferencial,
-                    'visible': ticket_candidato.servicio.visible_en_pantalla,
-                    'es_rellamado': False
-                }
+                # --- Notificación por WebSockets (solo a las pantallas de su sede) ---
+                datos_llamado = _get_datos_llamado(ticket_candidato)
+                datos_llamado['numero_meson'] = current_user.numero_meson
                 payload = {
                     'llamado': datos_llamado,
-                    'historial': _get_historial_data()
+                    'historial': _get_historial_data(ticket_candidato.sede_id)
                 }
                 
-                socketio.emit('nuevo_llamado', payload, room='pantalla_publica')
+                difusion.emitir('nuevo_llamado', payload, room=sala_pantalla(ticket_candidato.sede_id))
+                app.logger.info(f"Ticket {ticket_candidato.numero_ticket} llamado",
+                                extra={'ticket_id': ticket_candidato.id, 'servicio_id': ticket_candidato.servicio_id})
                 
                 flash(f"Llamando al ticket {ticket_candidato.numero_ticket}", "success")
                 break # ¡Misión cumplida, salimos del bucle!
@@ -867,10 +1919,87 @@ def create_app():
                 # Alguien nos ganó el clic justo en este milisegundo.
                 # No hacemos nada y dejamos que el "while True" repita el proceso
                 # para buscar el SIGUIENTE ticket disponible.
+                db.session.rollback()
                 continue
 
         return redirect(url_for('panel'))
 
+    @app.route('/llamar-grupo', methods=['POST'])
+    @login_required
+    @role_required('staff')
+    @check_sistema_abierto
+    def llamar_grupo():
+        form = LlamarLoteForm()
+        if not form.validate_on_submit():
+            flash("Indique una cantidad válida de tickets a llamar.", "error")
+            return redirect(url_for('panel'))
+
+        cantidad = min(form.cantidad.data, app.config['LOTE_MAXIMO_LLAMADOS'])
+        ahora = datetime.now(zona_horaria_chile).replace(tzinfo=None)
+
+        # Todo ocurre en UNA transacción: cerramos lo que el funcionario tenía
+        # pendiente y reservamos los N tickets, con un único commit al final.
+        pendientes = (Ticket.atendido_por_id == current_user.id, Ticket.estado == 'en_atencion')
+        registrar_eventos_de(*pendientes, tipo=EVENTO_CERRADO, momento=ahora, usuario=current_user)
+        Ticket.query.filter(*pendientes).update({'estado': 'finalizado', 'hora_finalizado': ahora}, synchronize_session=False)
+
+        ids_reservados = []
+        eventos = []
+        while len(ids_reservados) < cantidad:
+            candidatos = db.session.query(Ticket.id, Ticket.hora_registro).filter(
+                Ticket.sede_id == current_user.sede_id,
+                Ticket.servicio_id == current_user.servicio_id,
+                Ticket.estado == 'en_espera'
+            ).order_by(
+                Ticket.es_preferencial.desc(),
+                Ticket.hora_registro.asc()
+            ).limit(cantidad - len(ids_reservados)).all()
+
+            if not candidatos:
+                break
+
+            for candidato_id, hora_registro in candidatos:
+                # Misma reserva atómica que en 'llamar_siguiente': si otro funcionario
+                # tomó el ticket antes, la actualización afecta 0 filas y lo saltamos.
+                filas_actualizadas = Ticket.query.filter(
+                    Ticket.id == candidato_id,
+                    Ticket.estado == 'en_espera'
+                ).update({
+                    'estado': 'en_atencion',
+                    'hora_llamado': ahora,
+                    'atendido_por_id': current_user.id,
+                    'numero_meson': current_user.numero_meson
+                }, synchronize_session=False)
+                if filas_actualizadas > 0:
+                    ids_reservados.append(candidato_id)
+                    eventos.append(evento(EVENTO_LLAMADO, candidato_id, current_user.servicio_id, current_user.sede_id,
+                                          ahora, usuario=current_user, segundos=ahora - hora_registro))
+
+        registrar_eventos(eventos)
+        db.session.commit()
+        cache_vistas.cambio(current_user.servicio_id, current_user.sede_id)
+
+        if not ids_reservados:
+            flash("No hay más personas en espera.", "info")
+            return redirect(url_for('panel'))
+
+        estimador_espera.llamado(current_user.servicio_id, current_user.id)
+        tickets_llamados = Ticket.query.filter(Ticket.id.in_(ids_reservados)).order_by(
+            Ticket.es_preferencial.desc(),
+            Ticket.hora_registro.asc()
+        ).all()
+
+        # Un solo evento con todo el grupo, en vez de uno por ticket
+        payload = {
+            'llamados': [_get_datos_llamado(t) for t in tickets_llamados],
+            'historial': _get_historial_data(current_user.sede_id)
+        }
+        difusion.emitir('nuevo_llamado', payload, room=sala_pantalla(current_user.sede_id))
+
+        numeros = ', '.join(t.numero_ticket for t in tickets_llamados)
+        flash(f"Llamando a {len(tickets_llamados)} tickets: {numeros}", "success")
+        return redirect(url_for('panel'))
+
     @app.route('/rellamar', methods=['POST'])
     @login_required
     @role_required('staff')
@@ -881,25 +2010,20 @@ def create_app():
 
         # Verificación de seguridad
         if ticket_a_rellamar and ticket_a_rellamar.atendido_por_id == current_user.id:
+            # Antes no quedaba rastro de los re-llamados: ahora cada uno deja su evento
+            registrar_eventos([evento(EVENTO_RELLAMADO, ticket_a_rellamar.id, ticket_a_rellamar.servicio_id,
+                                      ticket_a_rellamar.sede_id, datetime.now(zona_horaria_chile).replace(tzinfo=None),
+                                      usuario=current_user)])
+            db.session.commit()
             # Preparamos los mismos datos que en 'llamar_siguiente'
-            datos_llamado = {
-                'id_ticket': ticket_a_rellamar.id,
-                'nombre_modulo': ticket_a_rellamar.servicio.nombre_modulo,
-                'numero_ticket': ticket_a_rellamar.numero_ticket,
-                'color_hex': ticket_a_rellamar.servicio.color_hex,
-                'numero_meson': ticket_a_rellamar.numero_meson,
-                'es_preferencial': ticket_a_rellamar.es_preferencial,
-                'visible': ticket_a_rellamar.servicio.visible_en_pantalla,
-                'es_rellamado': True
-
-            }
+            datos_llamado = _get_datos_llamado(ticket_a_rellamar, es_rellamado=True)
             payload = {
                 'llamado': datos_llamado,
-                'historial': _get_historial_data()
+                'historial': _get_historial_data(ticket_a_rellamar.sede_id)
             }
-            # Reenviamos el evento a la pantalla pública
+            # Reenviamos el evento a la pantalla pública de su sede
             
-            socketio.emit('nuevo_llamado', payload, room='pantalla_publica')
+            difusion.emitir('nuevo_llamado', payload, room=sala_pantalla(ticket_a_rellamar.sede_id))
             flash(f"Se ha vuelto a llamar al ticket {ticket_a_rellamar.numero_ticket}", "info")
         else:
             flash("Error al intentar volver a llamar al ticket.", "error")
@@ -919,19 +2043,84 @@ def create_app():
         if ticket_a_finalizar and ticket_a_finalizar.atendido_por_id == current_user.id:
             ticket_a_finalizar.estado = 'finalizado'
             ticket_a_finalizar.hora_finalizado = datetime.now(zona_horaria_chile).replace(tzinfo=None)
+            registrar_eventos([evento(
+                EVENTO_FINALIZADO, ticket_a_finalizar.id, ticket_a_finalizar.servicio_id, ticket_a_finalizar.sede_id,
+                ticket_a_finalizar.hora_finalizado, usuario=current_user,
+                segundos=ticket_a_finalizar.hora_finalizado - ticket_a_finalizar.hora_llamado if ticket_a_finalizar.hora_llamado else None
+            )])
             db.session.commit()
+            cache_vistas.cambio(ticket_a_finalizar.servicio_id, ticket_a_finalizar.sede_id)
+            if ticket_a_finalizar.hora_llamado:
+                estimador_espera.finalizado(
+                    ticket_a_finalizar.servicio_id, current_user.id,
+                    (ticket_a_finalizar.hora_finalizado - ticket_a_finalizar.hora_llamado).total_seconds()
+                )
             # Emitimos evento para actualizar la pantalla principal
             payload = {
                 'id_ticket': ticket_a_finalizar.id,
-                'historial': _get_historial_data()
+                'historial': _get_historial_data(ticket_a_finalizar.sede_id)
             }
-            socketio.emit('atencion_finalizada', payload, room='pantalla_publica')
+            difusion.emitir('atencion_finalizada', payload, room=sala_pantalla(ticket_a_finalizar.sede_id))
+            app.logger.info(f"Atención del ticket {ticket_a_finalizar.numero_ticket} finalizada",
+                            extra={'ticket_id': ticket_a_finalizar.id, 'servicio_id': ticket_a_finalizar.servicio_id})
             flash(f"Atención del ticket {ticket_a_finalizar.numero_ticket} finalizada.", "info")
         else:
             flash("Error al intentar finalizar el ticket.", "error")
 
         return redirect(url_for('panel'))
 
+    @app.route('/finalizar-grupo', methods=['POST'])
+    @login_required
+    @role_required('staff')
+    @check_sistema_abierto
+    def finalizar_grupo():
+        # Si el formulario trae IDs específicos, solo finalizamos esos;
+        # si no, finalizamos todo lo que el funcionario tenga en atención.
+        filtros = [
+            Ticket.atendido_por_id == current_user.id,
+            Ticket.estado == 'en_atencion'
+        ]
+        ids_solicitados = request.form.getlist('ticket_ids', type=int)
+        if ids_solicitados:
+            filtros.append(Ticket.id.in_(ids_solicitados))
+
+        # Los eventos salen de las filas que el UPDATE cambió de verdad (RETURNING): un ticket
+        # finalizado o vuelto a llamar por otra solicitud entre medio no se cuenta dos veces
+        ahora = datetime.now(zona_horaria_chile).replace(tzinfo=None)
+        tickets_a_finalizar = db.session.execute(
+            update(Ticket)
+            .where(*filtros)
+            .values(estado='finalizado', hora_finalizado=ahora)
+            .returning(Ticket.id, Ticket.servicio_id, Ticket.sede_id, Ticket.hora_llamado)
+        ).all()
+        ids_a_finalizar = [t.id for t in tickets_a_finalizar]
+        if not ids_a_finalizar:
+            db.session.rollback()
+            flash("No hay tickets en atención para finalizar.", "info")
+            return redirect(url_for('panel'))
+
+        registrar_eventos([
+            evento(EVENTO_FINALIZADO, t.id, t.servicio_id, t.sede_id, ahora, usuario=current_user,
+                   segundos=ahora - t.hora_llamado if t.hora_llamado else None)
+            for t in tickets_a_finalizar
+        ])
+        db.session.commit()
+        for servicio_id in {t.servicio_id for t in tickets_a_finalizar}:
+            cache_vistas.cambio(servicio_id, current_user.sede_id)
+            # Un grupo se atiende junto: cada persona cuenta con su parte del tiempo total
+            llamados = [t.hora_llamado for t in tickets_a_finalizar if t.servicio_id == servicio_id and t.hora_llamado]
+            for _ in llamados:
+                estimador_espera.finalizado(servicio_id, current_user.id,
+                                            (ahora - min(llamados)).total_seconds() / len(llamados))
+
+        payload = {
+            'ids_tickets': ids_a_finalizar,
+            'historial': _get_historial_data(current_user.sede_id)
+        }
+        difusion.emitir('atencion_finalizada', payload, room=sala_pantalla(current_user.sede_id))
+        flash(f"Se finalizaron {len(ids_a_finalizar)} atenciones.", "info")
+        return redirect(url_for('panel'))
+
     @app.route('/logout')
     @login_required
     def logout():
@@ -976,31 +2165,165 @@ def create_app():
     @login_required
     @role_required('admin')
     def toggle_sistema():
-        config = ConfigSystem.query.filter_by(key='sistema_abierto').first()
-        if not config:
-            config = ConfigSystem(key='sistema_abierto', value='true')
-            db.session.add(config)
-    
-        # Cambiar estado (si es true pasa a false, y viceversa)
-        nuevo_estado = 'false' if config.value == 'true' else 'true'
-        config.value = nuevo_estado
+        sede_id = sede_activa()
+        # Cambiar estado (si está abierto pasa a cerrado, y viceversa)
+        abierto = not sistema_esta_abierto(sede_id)
+        fijar_sistema_abierto(sede_id, abierto)
         db.session.commit()
     
-        estado_msg = "ABIERTO" if nuevo_estado == 'true' else "CERRADO"
+        estado_msg = "ABIERTO" if abierto else "CERRADO"
         flash(f'Sistema {estado_msg} exitosamente.', 'success')
         return redirect(url_for('admin_dashboard'))
+
+    @app.route('/admin/sede', methods=['POST'])
+    @login_required
+    @role_required('admin')
+    def elegir_sede():
+        # Solo quien administra todas las sedes elige con cuál trabajar
+        sede = db.session.get(Sede, request.form.get('sede_id', type=int) or 0)
+        if current_user.sede_id is not None or not sede:
+            flash('Sede no encontrada.', 'error')
+        else:
+            session['sede_id'] = sede.id
+            flash(f'Trabajando con la sede "{sede.nombre}".', 'success')
+        return redirect(url_for('admin_dashboard'))
+
+    @app.route('/admin/cerrar_jornada', methods=['POST'])
+    @login_required
+    @role_required('admin')
+    def cerrar_jornada():
+        # Una sola sentencia UPDATE para todos los tickets que quedaron abiertos
+        # al final del día (en espera o en atención), sin cargarlos en memoria.
+        sede_id = sede_activa()
+        tickets_cerrados = cerrar_tickets_abiertos(sede_id)
+        app.logger.info(f"Jornada cerrada por '{current_user.nombre_funcionario}': {tickets_cerrados} tickets finalizados")
+        flash(f'Jornada cerrada: {tickets_cerrados} tickets pendientes fueron finalizados.', 'success')
+        return redirect(url_for('admin_dashboard'))
+
+    @app.route('/admin/difusion')
+    @login_required
+    @role_required('admin')
+    def estadisticas_difusion():
+        # Eventos y bytes por segundo enviados a cada sala de Socket.IO
+        return jsonify(difusion.estadisticas.resumen())
+
+    @app.route('/admin/metrics')
+    def metricas_prometheus():
+        # Prometheus no inicia sesión: puede enviar 'Authorization: Bearer <METRICAS_TOKEN>'
+        token = app.config.get('METRICAS_TOKEN')
+        if token and hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}'):
+            return _respuesta_metricas()
+        return _metricas_con_sesion()
+
+    @login_required
+    @role_required('admin')
+    def _metricas_con_sesion():
+        return _respuesta_metricas()
+
+    def _respuesta_metricas():
+        return Response(metricas.exportar_prometheus(), mimetype='text/plain; version=0.0.4')
+
+    # --- TAREAS PROGRAMADAS (ver tareas.py) ---
+    # Corren en un green thread del proceso líder, con su propio contexto de la app.
+    # Las que recorren muchas filas trabajan por lotes y ceden el turno entre lotes,
+    # así el trabajo de madrugada no detiene a las pantallas ni a los paneles.
+    def _inicio_de(fecha):
+        return datetime.combine(fecha, datetime.min.time())
+
+    def _ceder_turno(_avance=None):
+        socketio.sleep(0)
+
+    @programador.tarea('reinicio_contadores', 'Cierra los tickets pendientes de días anteriores y reinicia los contadores (A00).')
+    def tarea_reinicio_contadores():
+        inicio_hoy = _inicio_de(datetime.now(zona_horaria_chile).date())
+        cerrados = 0
+        for (sede_id,) in db.session.query(Sede.id).all():
+            cerrados += cerrar_tickets_abiertos(sede_id, registrados_antes_de=inicio_hoy)
+            _ceder_turno()
+        with registro_diferido.pausa():
+            servicios = Servicio.query.update({'letra_actual': 'A', 'numero_actual': 0}, synchronize_session=False)
+            db.session.commit()
+        cache_vistas.cambio()
+        return f'{servicios} servicios reiniciados, {cerrados} tickets pendientes cerrados'
+
+    @programador.tarea('archivar_finalizados', 'Mueve al archivo los tickets finalizados de días anteriores.')
+    def tarea_archivar_finalizados():
+        hoy = datetime.now(zona_horaria_chile).date()
+        corte = _inicio_de(hoy - timedelta(days=app.config['ARCHIVO_DIAS_VIVOS']))
+        total = archivar_tickets(
+            Ticket.estado == 'finalizado',
+            Ticket.hora_registro < corte,
+            tamano_lote=app.config['RESET_TAMANO_LOTE'],
+            al_avanzar=_ceder_turno
+        )
+        if total:
+            cache_vistas.cambio()
+        return f'{total} tickets archivados (registrados antes del {corte:%d-%m-%Y})'
+
+    @programador.tarea('resumen_diario', 'Agrega los días cerrados al resumen por servicio que usa el dashboard.')
+    def tarea_resumen_diario():
+        filas = resumir_dias(datetime.now(zona_horaria_chile).date(), al_avanzar=_ceder_turno)
+        return f'{filas} filas agregadas al resumen diario'
+
+    @programador.tarea('precalentar_cache', 'Carga plantillas, huellas de archivos estáticos, sedes y pantallas antes de abrir.')
+    def tarea_precalentar_cache():
+        plantillas = app.jinja_env.list_templates(extensions=['html'])
+        for nombre in plantillas:
+            app.jinja_env.get_template(nombre)
+        _ceder_turno()
+
+        estaticos = 0
+        for carpeta, _, archivos in os.walk(app.static_folder):
+            for archivo in archivos:
+                recursos.huella(os.path.relpath(os.path.join(carpeta, archivo), app.static_folder).replace(os.sep, '/'))
+                estaticos += 1
+        _ceder_turno()
+
+        # Pantalla de cada sede: resuelve su id y deja su HTML en la caché de vistas
+        _ids_sede.clear()
+        sedes = Sede.query.order_by(Sede.id).all()
+        id_sede()
+        for sede in sedes:
+            with app.test_request_context(f'/sede/{sede.codigo}'):
+                app.view_functions['pantalla_publica'](sede.codigo)
+            _ceder_turno()
+        return f'{len(plantillas)} plantillas, {estaticos} archivos estáticos, {len(sedes)} pantallas'
+
+    def _fijar_sistema_todas(abierto):
+        sedes = db.session.query(Sede.id).all()
+        for (sede_id,) in sedes:
+            fijar_sistema_abierto(sede_id, abierto)
+        db.session.commit()
+        return f"{len(sedes)} sedes {'abiertas' if abierto else 'cerradas'}"
+
+    @programador.tarea('abrir_sistema', 'Abre el sistema en todas las sedes.')
+    def tarea_abrir_sistema():
+        return _fijar_sistema_todas(True)
+
+    @programador.tarea('cerrar_sistema', 'Cierra el sistema en todas las sedes.')
+    def tarea_cerrar_sistema():
+        return _fijar_sistema_todas(False)
+
     # --- COMANDOS DE LA CLI ---
     # Movemos el comando de seed aquí para que esté asociado a la app.
     @app.cli.command("seed")
     def seed_command():
         """Puebla la base de datos con datos iniciales."""
+        # Los servicios iniciales van en la primera sede (se crea si no hay ninguna)
+        sede = Sede.query.order_by(Sede.id).first()
+        if not sede:
+            sede = Sede(nombre='Casa Central', codigo='central')
+            db.session.add(sede)
+            db.session.flush()
+            print(f"Sede '{sede.nombre}' creada.")
+
         servicios_iniciales = [
             {'nombre': 'Matrícula', 'prefijo': 'M', 'color': '#000000'},
             {'nombre': 'Bienestar Estudiantil', 'prefijo': 'B', 'color': '#CF142B'}
         ]
         for s_data in servicios_iniciales:
-            if not Servicio.query.filter_by(nombre_modulo=s_data['nombre']).first():
-                nuevo_servicio = Servicio(nombre_modulo=s_data['nombre'], prefijo_ticket=s_data['prefijo'], color_hex=s_data['color'])
+            if not Servicio.query.filter_by(sede_id=sede.id, nombre_modulo=s_data['nombre']).first():
+                nuevo_servicio = Servicio(sede_id=sede.id, nombre_modulo=s_data['nombre'], prefijo_ticket=s_data['prefijo'], color_hex=s_data['color'])
                 db.session.add(nuevo_servicio)
                 print(f"Servicio '{s_data['nombre']}' creado.")
         
@@ -1016,7 +2339,119 @@ def create_app():
 
         db.session.commit()
         print("Seeding de datos completado.")
+
+    @app.cli.command("crear-sede")
+    @click.argument('codigo')
+    @click.argument('nombre')
+    def crear_sede_command(codigo, nombre):
+        """Crea una sede; su pantalla pública queda en /sede/<codigo>."""
+        if Sede.query.filter((Sede.codigo == codigo) | (Sede.nombre == nombre)).first():
+            print(f"Ya existe una sede con el código '{codigo}' o el nombre '{nombre}'.")
+            raise SystemExit(1)
+        sede = Sede(codigo=codigo, nombre=nombre)
+        db.session.add(sede)
+        db.session.commit()
+        print(f"Sede '{nombre}' creada (id {sede.id}, pantalla en /sede/{codigo}).")
     
+    @app.cli.command("archive-tickets")
+    @click.option('--dias', default=30, show_default=True, help='Antigüedad mínima (en días) de los tickets a archivar.')
+    @click.option('--lote', default=500, show_default=True, help='Cantidad de tickets movidos por transacción.')
+    def archive_tickets_command(dias, lote):
+        """Mueve al archivo los tickets finalizados más antiguos que N días."""
+        corte = datetime.now(zona_horaria_chile).replace(tzinfo=None) - timedelta(days=dias)
+        try:
+            total = archivar_tickets(
+                Ticket.estado == 'finalizado',
+                Ticket.hora_registro < corte,
+                tamano_lote=lote
+            )
+        except RuntimeError as error:
+            print(error)
+            raise SystemExit(1)
+        print(f"{total} tickets archivados (finalizados antes de {corte:%Y-%m-%d %H:%M}).")
+
+    @app.cli.command("ejecutar-tarea")
+    @click.argument('nombre', required=False)
+    def ejecutar_tarea_command(nombre):
+        """Ejecuta ahora una tarea programada (sin nombre, lista las tareas y su horario)."""
+        tareas = programador.tareas
+        if nombre not in tareas:
+            if nombre:
+                print(f"No existe la tarea '{nombre}'.")
+            for tarea in tareas.values():
+                print(f"{tarea.nombre:22} {tarea.cron.expresion if tarea.cron else '(desactivada)':15} {tarea.descripcion}")
+            raise SystemExit(1 if nombre else 0)
+
+        ejecucion = programador.ejecutar_ahora(nombre, origen='cli')
+        if ejecucion is None:
+            print(f"La tarea '{nombre}' ya se registró en este mismo segundo.")
+            raise SystemExit(1)
+        print(f"Tarea '{nombre}': {ejecucion.estado}. {ejecucion.detalle or ''}")
+        if ejecucion.estado != 'ok':
+            raise SystemExit(1)
+
+    @app.cli.command("perfilado-resumen")
+    @click.option('--top', default=10, show_default=True, help='Cantidad de casos a mostrar por sección.')
+    @click.option('--archivo', default=None, help='Archivo de perfilado (por defecto PERFILADO_ARCHIVO).')
+    def perfilado_resumen_command(top, archivo):
+        """Muestra los bloqueos del hub y las solicitudes lentas que más tiempo sumaron."""
+        archivo = archivo or app.config['PERFILADO_ARCHIVO']
+        resumen = resumir_perfilado(archivo, top=top)
+        if not any(resumen.values()):
+            print(f"No hay registros en {archivo}. ¿Se activó PERFILADO_ACTIVO?")
+            return
+
+        print("=== Bloqueos del hub (ruta / código que no soltó el control) ===")
+        for (ruta, ubicacion), datos in resumen['bloqueos']:
+            print(f"{datos['cantidad']:>5} veces  total {datos['total_ms']:>7} ms  máx {datos['max_ms']:>6} ms  {ruta}  ->  {ubicacion}")
+
+        print("\n=== Solicitudes lentas perfiladas ===")
+        for ruta, datos in resumen['lentas']:
+            print(f"{datos['cantidad']:>5} veces  total {datos['total_ms']:>7} ms  máx {datos['max_ms']:>6} ms  {ruta}")
+
+        print("\n=== Funciones con más tiempo propio en las solicitudes lentas ===")
+        for funcion, datos in resumen['funciones']:
+            print(f"{datos['apariciones']:>5} perfiles  {datos['propio_ms']:>9.1f} ms  {funcion}")
+
+    @app.cli.command("startup-bench")
+    @click.option('--repeticiones', default=3, show_default=True, help='Arranques medidos, cada uno en un proceso nuevo.')
+    @click.option('--ruta', default='/login', show_default=True, help='Ruta de la primera solicitud.')
+    @click.option('--max-ms', type=float, default=None, help='Falla (código 1) si la mediana hasta la primera respuesta supera este tiempo.')
+    @click.option('--json', 'ruta_json', default=None, help='Guarda el resumen en este archivo JSON.')
+    def startup_bench_command(repeticiones, ruta, max_ms, ruta_json):
+        """Mide el tiempo de importación, de create_app() y hasta la primera respuesta de un worker nuevo."""
+        from benchmarks.arranque import ejecutar, imprimir_reporte
+        from benchmarks.comun import guardar_json
+        resumen = ejecutar(repeticiones=repeticiones, ruta=ruta)
+        imprimir_reporte(resumen)
+        if ruta_json:
+            guardar_json(resumen, ruta_json)
+
+        total = resumen['mediana']['hasta_primera_respuesta_ms']
+        if max_ms is not None and total > max_ms:
+            print(f"\nREGRESIÓN: {total} ms hasta la primera respuesta > {max_ms} ms")
+            raise SystemExit(1)
+
+    @app.cli.command("voz-segmentos")
+    def voz_segmentos_command():
+        """Lista las grabaciones que faltan para anunciar los servicios y mesones actuales."""
+        prefijos = {s.prefijo_ticket for s in Servicio.query.all()}
+        mesones = {m for (m,) in db.session.query(Usuario.numero_meson).filter(Usuario.numero_meson.isnot(None)).distinct()}
+        # Todos los números posibles de cada prefijo: letras A-E y 00-99
+        numeros = [f'{p}-{l}{n:02d}' for p in prefijos for l in 'ABCDE' for n in range(100)]
+        faltantes = anuncios.faltantes(numeros, mesones or {1})
+        print(f"Segmentos en {app.config['VOZ_SEGMENTOS_DIR']}")
+        if faltantes:
+            print(f"Faltan {len(faltantes)} grabaciones (.mp3): {', '.join(faltantes)}")
+        else:
+            print("Están todas las grabaciones: los llamados se anuncian por voz.")
+
+    @app.cli.command("vendorizar-socketio")
+    def vendorizar_socketio_command():
+        """Descarga el cliente Socket.IO a static/vendor para no depender de la CDN."""
+        ruta, tamano = recursos.vendorizar_socketio()
+        print(f"Cliente Socket.IO {app.config['SOCKETIO_CLIENTE_VERSION']} guardado en {ruta} ({tamano} bytes).")
+
     # --- HANDLERS DE SOCKET.IO ---
     
     @socketio.on('connect')
@@ -1028,18 +2463,24 @@ def create_app():
         # Ejemplo:
         # if not current_user.is_authenticated and request.sid in private_namespaces:
         #     disconnect()
+        # Control de admisión: en una ola de reconexiones, el exceso espera su turno o se rechaza
+        reconexiones.admitir()
         print('Cliente conectado')
 
+    @socketio.on('disconnect')
+    def handle_disconnect(*args):
+        reconexiones.desconectado()
+
     @socketio.on('join')
     def handle_join(data):
         room = data.get('room')
         if room:
-            # 1. Permitir que CUALQUIERA (incluido staff) se una a la pantalla pública
-            if room == 'pantalla_publica':
+            # 1. Permitir que CUALQUIERA (incluido staff) se una a la pantalla pública de una sede
+            if room.startswith('pantalla_'):
                 join_room(room)
-            # 2. Si es staff intentando unirse a otra sala, verificamos que sea su módulo
+            # 2. Si es staff intentando unirse a otra sala, verificamos que sea la de su servicio
             elif current_user.is_authenticated and current_user.rol == 'staff':
-                if room == current_user.modulo_asignado:
+                if current_user.servicio_id and room == sala_servicio(current_user.servicio_id):
                     join_room(room)
 
     return app
@@ -0,0 +1,4 @@
+# benchmarks/
+# Pruebas de carga y mediciones de rendimiento del Sistema de Turnos.
+# Cada script se ejecuta como módulo, por ejemplo:
+#     python -m benchmarks.jornada_matricula --duracion 60
@@ -0,0 +1,106 @@
+# benchmarks/arranque.py
+# Mide el arranque en frío de un worker: cuánto tarda en importar la app, en
+# ejecutar create_app() y en responder su primera solicitud. Mientras tanto, las
+# pantallas quedan desconectadas (cada deploy o reciclaje de worker en Render).
+#
+# Cada medición corre en un proceso nuevo (igual que un worker recién creado),
+# con eventlet.monkey_patch() como en wsgi.py. Se usa la configuración del entorno.
+#
+# Uso:
+#     flask startup-bench
+#     flask startup-bench --repeticiones 5 --max-ms 1500    # compuerta de regresión
+#     python -m benchmarks.arranque --ruta /login           # una sola medición (JSON)
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FASES = ('eventlet_ms', 'importacion_ms', 'create_app_ms', 'primera_solicitud_ms', 'hasta_primera_respuesta_ms')
+
+
+def medir_arranque(ruta):
+    """Mide las fases del arranque en ESTE proceso (debe ser un proceso nuevo)."""
+    t0 = time.perf_counter()
+    import eventlet
+    eventlet.monkey_patch()
+    t1 = time.perf_counter()
+    from app import create_app
+    t2 = time.perf_counter()
+    app = create_app()
+    t3 = time.perf_counter()
+    respuesta = app.test_client().get(ruta)
+    t4 = time.perf_counter()
+    return {
+        'eventlet_ms': round((t1 - t0) * 1000, 1),
+        'importacion_ms': round((t2 - t1) * 1000, 1),
+        'create_app_ms': round((t3 - t2) * 1000, 1),
+        'primera_solicitud_ms': round((t4 - t3) * 1000, 1),
+        'hasta_primera_respuesta_ms': round((t4 - t0) * 1000, 1),
+        'estado': respuesta.status_code,
+    }
+
+
+def _proceso(ruta, *opciones_python):
+    comando = [sys.executable, *opciones_python, '-m', 'benchmarks.arranque', '--ruta', ruta]
+    inicio = time.perf_counter()
+    salida = subprocess.run(comando, cwd=RAIZ, capture_output=True, text=True)
+    if salida.returncode != 0:
+        raise RuntimeError(f"Falló la medición de arranque:\n{salida.stderr[-2000:]}")
+    datos = json.loads(salida.stdout.strip().splitlines()[-1])
+    datos['proceso_ms'] = round((time.perf_counter() - inicio) * 1000, 1)
+    return datos, salida.stderr
+
+
+def importaciones_lentas(stderr, top):
+    """Módulos importados directamente por nivel superior que más tiempo acumulan (-X importtime)."""
+    modulos = []
+    for linea in stderr.splitlines():
+        if not linea.startswith('import time:') or 'cumulative' in linea:
+            continue
+        _, acumulado, nombre = linea[len('import time:'):].split('|')
+        nombre = nombre[1:]  # Después del separador, dos espacios por nivel de anidación
+        if nombre.startswith('  ') and not nombre.startswith('   '):
+            modulos.append((int(acumulado) / 1000, nombre.strip()))
+    return sorted(modulos, reverse=True)[:top]
+
+
+def ejecutar(repeticiones=3, ruta='/login', top_importaciones=10):
+    """Mide 'repeticiones' arranques en procesos nuevos y devuelve la mediana de cada fase."""
+    mediciones = [_proceso(ruta)[0] for _ in range(repeticiones)]
+    resumen = {
+        'repeticiones': repeticiones,
+        'ruta': ruta,
+        'estado': mediciones[-1]['estado'],
+        'mediana': {fase: round(statistics.median(m[fase] for m in mediciones), 1)
+                    for fase in FASES + ('proceso_ms',)},
+    }
+    if top_importaciones:
+        _, stderr = _proceso(ruta, '-X', 'importtime')
+        resumen['importaciones'] = importaciones_lentas(stderr, top_importaciones)
+    return resumen
+
+
+def imprimir_reporte(resumen):
+    print(f"=== Arranque en frío ({resumen['repeticiones']} procesos, GET {resumen['ruta']} -> {resumen['estado']}) ===")
+    for fase, valor in resumen['mediana'].items():
+        print(f"{fase:<30}{valor:>10} ms")
+    if resumen.get('importaciones'):
+        print("\n=== Importaciones más lentas (acumulado) ===")
+        for ms, modulo in resumen['importaciones']:
+            print(f"{modulo:<30}{ms:>10.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Una medición de arranque en frío (salida JSON).')
+    parser.add_argument('--ruta', default='/login', help='Ruta de la primera solicitud (por defecto /login).')
+    args = parser.parse_args()
+    print(json.dumps(medir_arranque(args.ruta)))
+
+
+if __name__ == '__main__':
+    main()
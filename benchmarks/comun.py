@@ -0,0 +1,169 @@
+# benchmarks/comun.py
+# Utilidades compartidas por los benchmarks: creación de la app contra una base
+# de datos desechable, datos iniciales, medición de latencias y reporte.
+#
+# IMPORTANTE: los scripts que usan este módulo deben aplicar
+# eventlet.monkey_patch() ANTES de importarlo, igual que wsgi.py.
+
+import json
+import os
+import tempfile
+import time
+from collections import defaultdict
+
+from app import create_app, db, Usuario, Servicio
+
+
+def aplicar_parche_postgres():
+    """Mismo parche que wsgi.py para que psycopg2 no bloquee el hub de eventlet."""
+    try:
+        from psycogreen.eventlet import patch_psycopg
+        patch_psycopg()
+    except ImportError:
+        pass
+
+
+def crear_app_benchmark(db_uri=None, **config):
+    """Crea la app apuntando a una base de datos de pruebas y la deja vacía.
+
+    Si no se indica 'db_uri' se usa un archivo SQLite temporal.
+    ¡Todas las tablas de la base indicada se BORRAN!
+    """
+    if not db_uri:
+        directorio = tempfile.mkdtemp(prefix='turnos_bench_')
+        db_uri = f"sqlite:///{os.path.join(directorio, 'benchmark.db')}"
+
+    configuracion = {
+        'SQLALCHEMY_DATABASE_URI': db_uri,
+        'SECRET_KEY': 'benchmark',
+        'WTF_CSRF_ENABLED': False,
+        'DEBUG': False,
+        # Las tareas nocturnas no deben caer en medio de una medición
+        'PROGRAMADOR_ACTIVO': False,
+    }
+    configuracion.update(config)
+    app = create_app(configuracion)
+
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+    return app
+
+
+def sembrar(app, registradores=2, funcionarios=4, password='benchmark'):
+    """Usa el comando 'flask seed' y agrega los usuarios de la prueba.
+
+    Los funcionarios se reparten entre los servicios, con la mayoría en el
+    primero (Matrícula). Devuelve los nombres de registradores y funcionarios.
+    """
+    resultado = app.test_cli_runner().invoke(args=['seed'])
+    if resultado.exit_code != 0:
+        raise RuntimeError(f"Falló 'flask seed': {resultado.output}")
+
+    nombres_registradores = [f'bench_registrador_{i}' for i in range(registradores)]
+    nombres_funcionarios = [f'bench_staff_{i}' for i in range(funcionarios)]
+
+    with app.app_context():
+        servicios = Servicio.query.order_by(Servicio.id).all()
+        for nombre in nombres_registradores:
+            usuario = Usuario(nombre_funcionario=nombre, rol='registrador', sede_id=servicios[0].sede_id)
+            usuario.password = password
+            db.session.add(usuario)
+        for i, nombre in enumerate(nombres_funcionarios):
+            # 3 de cada 4 funcionarios atienden el primer servicio
+            servicio = servicios[0] if i % 4 != 3 or len(servicios) == 1 else servicios[1]
+            usuario = Usuario(nombre_funcionario=nombre, rol='staff', sede_id=servicio.sede_id,
+                              servicio_id=servicio.id, numero_meson=i + 1)
+            usuario.password = password
+            db.session.add(usuario)
+        db.session.commit()
+
+    return nombres_registradores, nombres_funcionarios
+
+
+def iniciar_sesion(app, nombre, password='benchmark'):
+    """Devuelve un cliente de pruebas con la sesión del usuario iniciada."""
+    cliente = app.test_client()
+    respuesta = cliente.post('/login', data={'username': nombre, 'password': password})
+    if respuesta.status_code != 302 or '/login' in respuesta.headers.get('Location', ''):
+        raise RuntimeError(f"No se pudo iniciar sesión como '{nombre}'")
+    return cliente
+
+
+def percentil(valores_ordenados, p):
+    """Percentil por rango más cercano de una lista ya ordenada."""
+    if not valores_ordenados:
+        return 0.0
+    indice = max(0, min(len(valores_ordenados) - 1, int(round(p / 100 * len(valores_ordenados))) - 1))
+    return valores_ordenados[indice]
+
+
+class Medidor:
+    """Acumula latencias y errores por nombre de operación (ruta, evento...)."""
+
+    def __init__(self):
+        self.latencias = defaultdict(list)
+        self.errores = defaultdict(int)
+        self.inicio = time.perf_counter()
+        self.fin = None
+
+    def medir(self, nombre, funcion, *args, **kwargs):
+        """Ejecuta la función, registra su latencia y marca como error los códigos >= 400."""
+        t0 = time.perf_counter()
+        try:
+            respuesta = funcion(*args, **kwargs)
+        except Exception:
+            self.errores[nombre] += 1
+            raise
+        finally:
+            self.latencias[nombre].append(time.perf_counter() - t0)
+        if getattr(respuesta, 'status_code', 200) >= 400:
+            self.errores[nombre] += 1
+        return respuesta
+
+    def registrar(self, nombre, segundos):
+        self.latencias[nombre].append(segundos)
+
+    def terminar(self):
+        self.fin = time.perf_counter()
+
+    def resumen(self):
+        duracion = (self.fin or time.perf_counter()) - self.inicio
+        resultado = {}
+        for nombre, valores in sorted(self.latencias.items()):
+            ordenados = sorted(valores)
+            resultado[nombre] = {
+                'cantidad': len(ordenados),
+                'errores': self.errores[nombre],
+                'por_segundo': round(len(ordenados) / duracion, 2) if duracion else 0.0,
+                'p50_ms': round(percentil(ordenados, 50) * 1000, 2),
+                'p95_ms': round(percentil(ordenados, 95) * 1000, 2),
+                'p99_ms': round(percentil(ordenados, 99) * 1000, 2),
+                'max_ms': round(ordenados[-1] * 1000, 2) if ordenados else 0.0,
+            }
+        return {'duracion_s': round(duracion, 2), 'operaciones': resultado}
+
+
+def imprimir_reporte(resumen, titulo):
+    print()
+    print(f"=== {titulo} ({resumen['duracion_s']} s) ===")
+    print(f"{'Operación':<32}{'Cant.':>8}{'Err.':>6}{'Op/s':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'máx ms':>10}")
+    for nombre, datos in resumen['operaciones'].items():
+        print(f"{nombre:<32}{datos['cantidad']:>8}{datos['errores']:>6}{datos['por_segundo']:>9}"
+              f"{datos['p50_ms']:>10}{datos['p95_ms']:>10}{datos['p99_ms']:>10}{datos['max_ms']:>10}")
+
+
+def guardar_json(resumen, ruta):
+    with open(ruta, 'w', encoding='utf-8') as archivo:
+        json.dump(resumen, archivo, indent=2, ensure_ascii=False)
+
+
+def verificar_umbrales(resumen, max_p95_ms=None, max_errores=None):
+    """Devuelve la lista de operaciones que superan los umbrales (para usar como compuerta)."""
+    fallas = []
+    for nombre, datos in resumen['operaciones'].items():
+        if max_p95_ms is not None and datos['p95_ms'] > max_p95_ms:
+            fallas.append(f"{nombre}: p95 {datos['p95_ms']} ms > {max_p95_ms} ms")
+        if max_errores is not None and datos['errores'] > max_errores:
+            fallas.append(f"{nombre}: {datos['errores']} errores > {max_errores}")
+    return fallas
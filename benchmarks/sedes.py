@@ -0,0 +1,259 @@
+# benchmarks/sedes.py
+# Comprueba que la latencia de una sede no crece al agregar más sedes.
+#
+# Para cada escala (por defecto 1, 2, 4 y 8 sedes) crea una base desechable con
+# esa cantidad de sedes, cada una con sus servicios, funcionarios y un historial
+# de tickets (--tickets-por-sede, una parte todavía en espera). Luego simula la
+# jornada en la primera sede y mide sus latencias: como las consultas frecuentes
+# y sus índices parten por sede_id, el costo no depende de los datos de las demás.
+#
+# Con --carga-otras las demás sedes también atienden durante la medición. El
+# worker es uno solo, así que entonces se mide además el reparto de la CPU.
+#
+# Cada escala corre en un proceso nuevo (la app se crea una vez por proceso).
+#
+# Uso:
+#     python -m benchmarks.sedes
+#     python -m benchmarks.sedes --escalas 1 4 16 --tickets-por-sede 20000 --duracion 20
+#     python -m benchmarks.sedes --max-crecimiento 1.5     # compuerta de regresión
+
+import eventlet
+eventlet.monkey_patch()
+
+import argparse
+import json
+import random
+import subprocess
+import sys
+import time
+from datetime import timedelta
+
+from sqlalchemy import insert
+
+from benchmarks.comun import (
+    aplicar_parche_postgres, crear_app_benchmark, sembrar, iniciar_sesion,
+    Medidor, guardar_json
+)
+from benchmarks.jornada_matricula import registrador, funcionario, rut_al_azar, ahora_chile
+from benchmarks.arranque import RAIZ
+from app import db, Sede, Servicio, Ticket, Usuario
+
+OPERACIONES = ('POST /registro', 'GET /panel', 'POST /llamar-siguiente', 'POST /finalizar',
+               'GET /sede/<codigo>', 'GET /admin')
+
+
+def crear_sede(app, indice, registradores, funcionarios, password='benchmark'):
+    """Crea la sede 'indice' (> 0) con los mismos servicios que 'flask seed' y sus usuarios."""
+    with app.app_context():
+        primera = Sede.query.order_by(Sede.id).first()
+        sede = Sede(nombre=f'Sede {indice}', codigo=f'sede{indice}')
+        db.session.add(sede)
+        db.session.flush()
+        servicios = []
+        for modelo in Servicio.query.filter_by(sede_id=primera.id).order_by(Servicio.id).all():
+            servicio = Servicio(sede_id=sede.id, nombre_modulo=modelo.nombre_modulo,
+                                prefijo_ticket=modelo.prefijo_ticket, color_hex=modelo.color_hex)
+            db.session.add(servicio)
+            servicios.append(servicio)
+        db.session.flush()
+
+        nombres_registradores = [f'bench_s{indice}_registrador_{i}' for i in range(registradores)]
+        nombres_funcionarios = [f'bench_s{indice}_staff_{i}' for i in range(funcionarios)]
+        for nombre in nombres_registradores:
+            usuario = Usuario(nombre_funcionario=nombre, rol='registrador', sede_id=sede.id)
+            usuario.password = password
+            db.session.add(usuario)
+        for i, nombre in enumerate(nombres_funcionarios):
+            usuario = Usuario(nombre_funcionario=nombre, rol='staff', sede_id=sede.id,
+                              servicio_id=servicios[i % len(servicios)].id, numero_meson=i + 1)
+            usuario.password = password
+            db.session.add(usuario)
+        db.session.commit()
+        return sede.codigo, [s.id for s in servicios], nombres_registradores, nombres_funcionarios
+
+
+def poblar_historial(app, tickets, fraccion_en_espera=0.05, lote=5000):
+    """Agrega a cada sede 'tickets' tickets de los últimos 30 días (los más nuevos, en espera)."""
+    ahora = ahora_chile()
+    with app.app_context():
+        servicios = Servicio.query.order_by(Servicio.id).all()
+        for sede_id in sorted({s.sede_id for s in servicios}):
+            de_la_sede = [s for s in servicios if s.sede_id == sede_id]
+            en_espera = int(tickets * fraccion_en_espera)
+            filas = []
+            for i in range(tickets):
+                servicio = random.choice(de_la_sede)
+                vivo = i >= tickets - en_espera
+                registro = ahora - timedelta(minutes=tickets - i) if vivo else \
+                    ahora - timedelta(days=random.uniform(0, 30))
+                filas.append({
+                    'numero_ticket': f'{servicio.prefijo_ticket}-A{i % 100:02d}',
+                    'rut_cliente': rut_al_azar(),
+                    'modulo_solicitado': servicio.nombre_modulo,
+                    'estado': 'en_espera' if vivo else 'finalizado',
+                    'hora_registro': registro,
+                    'hora_llamado': None if vivo else registro + timedelta(minutes=random.uniform(1, 30)),
+                    'hora_finalizado': None if vivo else registro + timedelta(minutes=random.uniform(31, 40)),
+                    'es_preferencial': random.random() < 0.1,
+                    'servicio_id': servicio.id,
+                    'sede_id': sede_id,
+                })
+            for inicio in range(0, len(filas), lote):
+                db.session.execute(insert(Ticket), filas[inicio:inicio + lote])
+            db.session.commit()
+
+
+def visitante(medidor, nombre, cliente, ruta, hasta, intervalo):
+    """Consulta una página cada 'intervalo' segundos (pantalla pública, dashboard)."""
+    while time.perf_counter() < hasta:
+        medidor.medir(nombre, cliente.get, ruta)
+        eventlet.sleep(intervalo)
+
+
+def medir_escala(sedes, args):
+    """Arma la base con 'sedes' sedes, simula la jornada y devuelve el resumen de la primera."""
+    app = crear_app_benchmark(args.db)
+    registradores, funcionarios = sembrar(app, args.registradores, args.funcionarios)
+    with app.app_context():
+        primera = Sede.query.order_by(Sede.id).first()
+        codigo = primera.codigo
+        servicios = [s.id for s in Servicio.query.filter_by(sede_id=primera.id).order_by(Servicio.id).all()]
+        administrador = Usuario(nombre_funcionario='bench_admin', rol='admin', sede_id=primera.id)
+        administrador.password = 'benchmark'
+        db.session.add(administrador)
+        db.session.commit()
+    otras = [crear_sede(app, i, args.registradores, args.funcionarios) for i in range(1, sedes)]
+    poblar_historial(app, args.tickets_por_sede)
+
+    medidor = Medidor()
+    medidor_otras = Medidor()
+    hasta = time.perf_counter() + args.duracion
+    medidor.inicio = medidor_otras.inicio = time.perf_counter()
+    pool = eventlet.GreenPool()
+    for nombre in registradores:
+        pool.spawn(registrador, medidor, iniciar_sesion(app, nombre), servicios, hasta, args.pausa_registro)
+    for nombre in funcionarios:
+        pool.spawn(funcionario, medidor, iniciar_sesion(app, nombre), hasta, args.atencion)
+    pool.spawn(visitante, medidor, 'GET /sede/<codigo>', app.test_client(), f'/sede/{codigo}', hasta, 1.0)
+    pool.spawn(visitante, medidor, 'GET /admin', iniciar_sesion(app, 'bench_admin'), '/admin', hasta, 2.0)
+    if args.carga_otras:
+        for _, servicios_otra, registradores_otra, funcionarios_otra in otras:
+            for nombre in registradores_otra:
+                pool.spawn(registrador, medidor_otras, iniciar_sesion(app, nombre), servicios_otra,
+                           hasta, args.pausa_registro)
+            for nombre in funcionarios_otra:
+                pool.spawn(funcionario, medidor_otras, iniciar_sesion(app, nombre), hasta, args.atencion)
+    pool.waitall()
+    medidor.terminar()
+
+    with app.app_context():
+        total_tickets = Ticket.query.count()
+    resumen = medidor.resumen()
+    resumen.update({'sedes': sedes, 'tickets_en_base': total_tickets})
+    if args.carga_otras:
+        resumen['otras_sedes'] = medidor_otras.resumen()['operaciones']
+    return resumen
+
+
+def ejecutar(escalas, args_escala):
+    """Mide cada escala en un proceso nuevo y devuelve {sedes: resumen}."""
+    resultados = {}
+    for sedes in escalas:
+        print(f"Midiendo con {sedes} sede(s)...", flush=True)
+        comando = [sys.executable, '-m', 'benchmarks.sedes', '--escala', str(sedes), *args_escala]
+        salida = subprocess.run(comando, cwd=RAIZ, capture_output=True, text=True)
+        if salida.returncode != 0:
+            raise RuntimeError(f"Falló la medición con {sedes} sedes:\n{salida.stderr[-2000:]}")
+        resultados[sedes] = json.loads(salida.stdout.strip().splitlines()[-1])
+    return resultados
+
+
+def imprimir_reporte(resultados):
+    escalas = sorted(resultados)
+    print()
+    print("=== Latencia de la primera sede según la cantidad de sedes (p50 / p95 ms) ===")
+    print(f"{'Operación':<26}" + ''.join(f"{f'{n} sede(s)':>20}" for n in escalas))
+    for operacion in OPERACIONES:
+        celdas = []
+        for n in escalas:
+            datos = resultados[n]['operaciones'].get(operacion)
+            celdas.append(f"{datos['p50_ms']:>9} / {datos['p95_ms']:<8}" if datos else f"{'-':>20}")
+        print(f"{operacion:<26}" + ''.join(f"{c:>20}" for c in celdas))
+    print(f"{'Tickets en la base':<26}" + ''.join(f"{resultados[n]['tickets_en_base']:>20}" for n in escalas))
+
+
+def verificar_crecimiento(resultados, max_crecimiento, tolerancia_ms):
+    """Operaciones cuyo p95 con más sedes supera 'max_crecimiento' veces el de la escala menor."""
+    menor, mayor = resultados[min(resultados)], resultados[max(resultados)]
+    fallas = []
+    for operacion in OPERACIONES:
+        base = menor['operaciones'].get(operacion)
+        final = mayor['operaciones'].get(operacion)
+        if not base or not final:
+            continue
+        # Con latencias de pocos ms el ruido domina: se exige además una diferencia mínima
+        if final['p95_ms'] > base['p95_ms'] * max_crecimiento and final['p95_ms'] - base['p95_ms'] > tolerancia_ms:
+            fallas.append(f"{operacion}: p95 {base['p95_ms']} ms con {min(resultados)} sede(s) -> "
+                          f"{final['p95_ms']} ms con {max(resultados)}")
+    return fallas
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Mide si la latencia de una sede se mantiene al agregar sedes.')
+    parser.add_argument('--escalas', type=int, nargs='+', default=[1, 2, 4, 8], help='Cantidades de sedes a medir.')
+    parser.add_argument('--db', help='URI de la base de datos (por defecto, SQLite temporal). ¡Se borra!')
+    parser.add_argument('--confirmar-borrado', action='store_true',
+                        help='Necesario para usar una base de datos que no sea SQLite temporal.')
+    parser.add_argument('--duracion', type=float, default=15, help='Segundos de carga por escala (por defecto 15).')
+    parser.add_argument('--tickets-por-sede', type=int, default=5000, help='Historial de cada sede antes de medir.')
+    parser.add_argument('--registradores', type=int, default=2, help='Registradores por sede.')
+    parser.add_argument('--funcionarios', type=int, default=4, help='Funcionarios por sede.')
+    parser.add_argument('--pausa-registro', type=float, default=1.0, help='Segundos medios entre registros.')
+    parser.add_argument('--atencion', type=float, default=2.0, help='Segundos medios de atención.')
+    parser.add_argument('--carga-otras', action='store_true', help='Las demás sedes también atienden mientras se mide.')
+    parser.add_argument('--semilla', type=int, default=None)
+    parser.add_argument('--json', help='Guarda los resultados en este archivo JSON.')
+    parser.add_argument('--max-crecimiento', type=float,
+                        help='Falla (código 1) si algún p95 con más sedes supera este múltiplo del p95 con menos.')
+    parser.add_argument('--tolerancia-ms', type=float, default=5.0,
+                        help='Diferencia de p95 bajo la cual no se considera crecimiento (por defecto 5 ms).')
+    parser.add_argument('--escala', type=int, help=argparse.SUPPRESS)  # Uso interno: una sola escala (salida JSON)
+    args = parser.parse_args()
+
+    if args.db and not args.confirmar_borrado:
+        parser.error('--db borra todas las tablas de esa base de datos; agregue --confirmar-borrado.')
+
+    if args.escala:
+        if args.db and args.db.startswith('postgresql'):
+            aplicar_parche_postgres()
+        random.seed(args.semilla)
+        print(json.dumps(medir_escala(args.escala, args)))
+        return
+
+    # Opciones que se repiten en el proceso de cada escala
+    args_escala = ['--duracion', str(args.duracion), '--tickets-por-sede', str(args.tickets_por_sede),
+                   '--registradores', str(args.registradores), '--funcionarios', str(args.funcionarios),
+                   '--pausa-registro', str(args.pausa_registro), '--atencion', str(args.atencion)]
+    if args.db:
+        args_escala += ['--db', args.db, '--confirmar-borrado']
+    if args.carga_otras:
+        args_escala.append('--carga-otras')
+    if args.semilla is not None:
+        args_escala += ['--semilla', str(args.semilla)]
+
+    resultados = ejecutar(sorted(set(args.escalas)), args_escala)
+    imprimir_reporte(resultados)
+    if args.json:
+        guardar_json(resultados, args.json)
+
+    if args.max_crecimiento is not None:
+        fallas = verificar_crecimiento(resultados, args.max_crecimiento, args.tolerancia_ms)
+        if fallas:
+            print('\nLA LATENCIA CRECE CON LAS SEDES:')
+            for falla in fallas:
+                print(f'  - {falla}')
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,184 @@
+# bitacora.py
+# Registro (logging) asíncrono de la aplicación.
+#
+# Los manejadores de archivo escriben en disco de forma síncrona: en el worker
+# eventlet eso detiene el hub en cada línea (y en cada rotación). Aquí el green
+# thread que registra solo deja el registro en una cola; un hilo REAL del sistema
+# operativo lo saca de la cola, le da formato JSON y lo escribe en el archivo.
+# Si la cola se llena, los registros se descartan en vez de bloquear la solicitud.
+# El mismo hilo copia cada registro, en texto, a stderr (BITACORA_STDERR): en
+# Render es lo único que ve el operador.
+
+import atexit
+import copy
+import json
+import os
+import sys
+import time
+import traceback
+from datetime import datetime
+from logging import Formatter, Filter, StreamHandler
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+from flask import g, request, has_request_context
+from flask.logging import default_handler
+
+# Datos extra que se agregan al JSON si el registro los trae (extra={...})
+CAMPOS_EXTRA = ('ruta', 'metodo', 'usuario_id', 'ticket_id', 'servicio_id', 'latencia_ms')
+
+
+def _modulos_nativos():
+    """Módulos 'threading' y 'queue' originales, aunque eventlet los haya parchado."""
+    try:
+        from eventlet import patcher
+        return patcher.original('threading'), patcher.original('queue')
+    except ImportError:
+        import threading
+        import queue
+        return threading, queue
+
+
+class FormatoJSON(Formatter):
+    """Una línea JSON por registro, con los campos de CAMPOS_EXTRA que tenga."""
+
+    def format(self, record):
+        datos = {
+            'fecha': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'nivel': record.levelname,
+            'origen': record.name,
+            'mensaje': record.getMessage(),
+        }
+        for campo in CAMPOS_EXTRA:
+            valor = getattr(record, campo, None)
+            if valor is not None:
+                datos[campo] = valor
+        excepcion = getattr(record, 'excepcion', None)
+        if excepcion:
+            datos['excepcion'] = excepcion
+        return json.dumps(datos, ensure_ascii=False, default=str)
+
+
+class FormatoConsola(Formatter):
+    """El formato de Flask en stderr, más el traceback que ManejadorEnCola guardó en 'excepcion'."""
+
+    def __init__(self):
+        super().__init__('[%(asctime)s] %(levelname)s in %(module)s: %(message)s')
+
+    def format(self, record):
+        texto = super().format(record)
+        excepcion = getattr(record, 'excepcion', None)
+        return f'{texto}\n{excepcion.rstrip()}' if excepcion else texto
+
+
+class ContextoSolicitud(Filter):
+    """Agrega la ruta y el usuario de la solicitud en curso (sin consultar la base de datos)."""
+
+    def filter(self, record):
+        if has_request_context():
+            if getattr(record, 'ruta', None) is None:
+                record.ruta = request.url_rule.rule if request.url_rule else request.path
+                record.metodo = request.method
+            usuario = g.get('_login_user')  # Flask-Login ya lo cargó, si hay sesión
+            if getattr(record, 'usuario_id', None) is None and getattr(usuario, 'is_authenticated', False):
+                record.usuario_id = usuario.id
+        return True
+
+
+class ManejadorEnCola(QueueHandler):
+    """QueueHandler que nunca bloquea: si la cola está llena, descarta y cuenta."""
+
+    def __init__(self, cola):
+        super().__init__(cola)
+        self.descartados = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except Exception:
+            self.descartados += 1
+
+    def prepare(self, record):
+        # El formato final lo da el hilo escritor; aquí solo se congela el mensaje
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.excepcion = ''.join(traceback.format_exception(*record.exc_info))
+        record.exc_info = None
+        record.exc_text = None
+        return record
+
+
+class OyenteNativo(QueueListener):
+    """QueueListener cuyo hilo es un hilo real aunque eventlet haya parchado 'threading'."""
+
+    def start(self):
+        threading_nativo, _ = _modulos_nativos()
+        self._thread = threading_nativo.Thread(target=self._monitor, name='bitacora', daemon=True)
+        self._thread.start()
+
+
+def crear_manejador(archivo, formateador, max_bytes, respaldos, capacidad=10000, consola=None):
+    """Devuelve un manejador de cola cuyo archivo rotativo escribe un hilo nativo.
+
+    Con 'consola' (un formateador), el mismo hilo copia cada registro a stderr.
+    El hilo se detiene (vaciando la cola) al terminar el proceso.
+    """
+    threading_nativo, queue_nativo = _modulos_nativos()
+    os.makedirs(os.path.dirname(archivo) or '.', exist_ok=True)
+
+    archivo_rotativo = RotatingFileHandler(archivo, maxBytes=max_bytes, backupCount=respaldos, encoding='utf-8')
+    archivo_rotativo.setFormatter(formateador)
+    destinos = [archivo_rotativo]
+    if consola is not None:
+        salida = StreamHandler(sys.stderr)
+        salida.setFormatter(consola)
+        destinos.append(salida)
+    # Solo los usa el hilo escritor: sus locks no deben ser locks verdes de eventlet
+    for destino in destinos:
+        destino.lock = threading_nativo.RLock()
+
+    manejador = ManejadorEnCola(queue_nativo.Queue(capacidad))
+    oyente = OyenteNativo(manejador.queue, *destinos, respect_handler_level=True)
+    oyente.start()
+    atexit.register(oyente.stop)
+    return manejador
+
+
+def configurar_bitacora(app):
+    """Conecta app.logger al archivo JSON asíncrono y registra las solicitudes lentas.
+
+    Configuración: ``BITACORA_ARCHIVO``, ``BITACORA_MAX_BYTES``, ``BITACORA_RESPALDOS``,
+    ``BITACORA_STDERR`` y ``BITACORA_UMBRAL_LENTO_MS``.
+    """
+    if any(isinstance(h, ManejadorEnCola) for h in app.logger.handlers):
+        return
+
+    manejador = crear_manejador(
+        app.config.get('BITACORA_ARCHIVO', 'logs/sistema_turnos.log'),
+        FormatoJSON(),
+        app.config.get('BITACORA_MAX_BYTES', 10 * 1024 * 1024),
+        app.config.get('BITACORA_RESPALDOS', 10),
+        consola=FormatoConsola() if app.config.get('BITACORA_STDERR', True) else None,
+    )
+    manejador.addFilter(ContextoSolicitud())
+    app.logger.addHandler(manejador)
+    # Flask instala su manejador de stderr al primer uso de app.logger (p. ej. en
+    # metricas.init_app): escribe de forma síncrona en el hub y repetiría cada
+    # línea que el hilo escritor ya copia a stderr, así que se quita
+    app.logger.removeHandler(default_handler)
+
+    umbral = app.config.get('BITACORA_UMBRAL_LENTO_MS', 1000) / 1000
+
+    @app.before_request
+    def _bitacora_inicio():
+        g._bitacora_inicio = time.perf_counter()
+
+    @app.teardown_request
+    def _bitacora_fin(error=None):
+        inicio = g.pop('_bitacora_inicio', None)
+        if inicio is None:
+            return
+        latencia = time.perf_counter() - inicio
+        if latencia >= umbral:
+            app.logger.warning('Solicitud lenta', extra={'latencia_ms': round(latencia * 1000)})
@@ -15,4 +15,8 @@ flask db upgrade
 echo "Poblando la base de datos con datos iniciales..."
 flask seed
 
+# Las pantallas y paneles cargan el cliente Socket.IO desde static/vendor, no desde la CDN
+echo "Descargando el cliente Socket.IO..."
+flask vendorizar-socketio
+
 echo "Build finalizado correctamente."
\ No newline at end of file
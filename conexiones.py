@@ -0,0 +1,112 @@
+# conexiones.py
+# Pool de conexiones a la base de datos: configuración, medición y contención.
+#
+# En producción cientos de green threads comparten unas pocas conexiones a
+# PostgreSQL. Si el pool se agota, las solicitudes esperan en silencio y se
+# acumulan. PoolMedido mide cuánto espera cada una por su conexión y, si ya hay
+# demasiadas esperando, rechaza de inmediato (sqlalchemy.exc.TimeoutError) para
+# que la app muestre la página "Sistema ocupado" en vez de seguir encolando.
+
+import threading
+import time
+
+from sqlalchemy import exc
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import QueuePool
+
+from metricas import Histograma, encabezado, lineas_histograma, linea
+
+LIMITES_ESPERA = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+class EstadisticasPool:
+    """Esperas por conexión, tiempos agotados y rechazos del pool."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.esperas = Histograma(LIMITES_ESPERA)
+        self.esperando = 0
+        self.agotados = 0
+        self.rechazados = 0
+
+    def entrar(self, max_esperando):
+        """Anota una solicitud más en la fila; False si la fila ya está llena."""
+        with self._lock:
+            if self.esperando >= max_esperando:
+                self.rechazados += 1
+                return False
+            self.esperando += 1
+            return True
+
+    def salir(self, espera, agotado=False):
+        with self._lock:
+            self.esperando -= 1
+            self.esperas.observar(espera)
+            if agotado:
+                self.agotados += 1
+
+    def lineas_prometheus(self, pool=None):
+        with self._lock:
+            lineas = encabezado('turnos_db_pool_espera_segundos', 'histogram', 'Tiempo esperando una conexión del pool.')
+            lineas += lineas_histograma('turnos_db_pool_espera_segundos', self.esperas)
+            lineas += encabezado('turnos_db_pool_agotado_total', 'counter', 'Solicitudes que esperaron pool_timeout sin obtener conexión.')
+            lineas.append(linea('turnos_db_pool_agotado_total', self.agotados))
+            lineas += encabezado('turnos_db_pool_rechazos_total', 'counter', 'Solicitudes rechazadas de inmediato por exceso de espera.')
+            lineas.append(linea('turnos_db_pool_rechazos_total', self.rechazados))
+            lineas += encabezado('turnos_db_pool_esperando', 'gauge', 'Solicitudes esperando una conexión en este momento.')
+            lineas.append(linea('turnos_db_pool_esperando', self.esperando))
+        if isinstance(pool, QueuePool):
+            lineas += encabezado('turnos_db_pool_en_uso', 'gauge', 'Conexiones prestadas en este momento.')
+            lineas.append(linea('turnos_db_pool_en_uso', pool.checkedout()))
+            lineas += encabezado('turnos_db_pool_tamano', 'gauge', 'Conexiones permanentes del pool (sin contar el overflow).')
+            lineas.append(linea('turnos_db_pool_tamano', pool.size()))
+        return lineas
+
+
+class PoolMedido(QueuePool):
+    """QueuePool que mide la espera por conexión y rechaza cuando la fila es muy larga.
+
+    ``max_esperando`` es un atributo de clase porque el pool lo crea SQLAlchemy.
+    """
+
+    estadisticas = EstadisticasPool()
+    max_esperando = 50
+
+    def _do_get(self):
+        if not self.estadisticas.entrar(self.max_esperando):
+            raise exc.TimeoutError(
+                f"Hay {self.max_esperando} solicitudes esperando una conexión; se rechaza sin esperar."
+            )
+        inicio = time.perf_counter()
+        agotado = False
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            agotado = True
+            raise
+        finally:
+            self.estadisticas.salir(time.perf_counter() - inicio, agotado)
+
+
+def opciones_motor(config):
+    """Arma SQLALCHEMY_ENGINE_OPTIONS a partir de las claves DB_POOL_* de la configuración.
+
+    SQLite en memoria usa su propio pool (StaticPool) y se deja como está.
+    """
+    url = make_url(config['SQLALCHEMY_DATABASE_URI'])
+    if url.get_backend_name() == 'sqlite' and url.database in (None, '', ':memory:'):
+        return {}
+
+    PoolMedido.max_esperando = config['DB_POOL_MAX_ESPERANDO']
+    opciones = {
+        'poolclass': PoolMedido,
+        'pool_size': config['DB_POOL_SIZE'],
+        'max_overflow': config['DB_POOL_MAX_OVERFLOW'],
+        'pool_timeout': config['DB_POOL_TIMEOUT'],
+        'pool_recycle': config['DB_POOL_RECYCLE'],
+        'pool_pre_ping': config['DB_POOL_PRE_PING'],
+    }
+    if url.get_backend_name() == 'postgresql' and config['DB_STATEMENT_TIMEOUT_MS']:
+        # Ninguna consulta puede retener una conexión por más de este tiempo
+        opciones['connect_args'] = {'options': f"-c statement_timeout={config['DB_STATEMENT_TIMEOUT_MS']}"}
+    return opciones
@@ -1,4 +1,4 @@
-from app import create_app, db, Usuario
+from app import create_app, db, Usuario, Servicio
 
 app = create_app()
 
@@ -9,12 +9,15 @@ with app.app_context():
     rol = input("Rol (registrador o staff): ")
 
     # Valores por defecto
-    modulo = None
+    servicio = None
     meson = None
 
     # Solo pide módulo y mesón si el rol es 'staff'
     if rol == 'staff':
         modulo = input("Módulo asignado (ej: Matrícula, Bienestar Estudiantil): ")
+        servicio = Servicio.query.filter_by(nombre_modulo=modulo).first()
+        if not servicio:
+            print(f"Advertencia: no existe el servicio '{modulo}', el usuario quedará sin módulo.")
         meson = int(input("Número de mesón/puesto: "))
 
     if Usuario.query.filter_by(nombre_funcionario=nombre).first():
@@ -23,7 +26,7 @@ with app.app_context():
         nuevo_usuario = Usuario(
             nombre_funcionario=nombre, 
             rol=rol, 
-            modulo_asignado=modulo,
+            servicio_id=servicio.id if servicio else None,
             numero_meson=meson
         )
         # Se asigna la contraseña a través del setter para que se guarde el hash
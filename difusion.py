@@ -0,0 +1,148 @@
+# difusion.py
+# Programador de difusión para Socket.IO.
+#
+# En vez de emitir cada cambio directamente a todos los clientes de una sala,
+# los eventos se acumulan por sala durante una ventana corta (por defecto 100 ms)
+# y se envían como un único mensaje 'eventos_agrupados'. Los eventos marcados como
+# inmediatos (los llamados a la pantalla pública) se envían sin espera.
+
+import json
+import threading
+import time
+from collections import defaultdict, deque
+
+
+class EstadisticasDifusion:
+    """Contadores de eventos y bytes emitidos por sala (con tasas por segundo) y por nombre de evento."""
+
+    def __init__(self, ventana_segundos=60):
+        self.ventana_segundos = ventana_segundos
+        self._lock = threading.Lock()
+        self._totales = defaultdict(lambda: {'eventos': 0, 'mensajes': 0, 'bytes': 0})
+        self._recientes = defaultdict(deque)  # sala -> [(instante, eventos, bytes)]
+        self._por_evento = defaultdict(lambda: {'eventos': 0, 'bytes': 0})
+
+    def registrar(self, sala, eventos, bytes_enviados):
+        ahora = time.monotonic()
+        with self._lock:
+            totales = self._totales[sala]
+            totales['eventos'] += eventos
+            totales['mensajes'] += 1
+            totales['bytes'] += bytes_enviados
+            recientes = self._recientes[sala]
+            recientes.append((ahora, eventos, bytes_enviados))
+            self._descartar_antiguos(recientes, ahora)
+
+    def registrar_evento(self, evento, bytes_enviados):
+        with self._lock:
+            totales = self._por_evento[evento]
+            totales['eventos'] += 1
+            totales['bytes'] += bytes_enviados
+
+    def _descartar_antiguos(self, recientes, ahora):
+        limite = ahora - self.ventana_segundos
+        while recientes and recientes[0][0] < limite:
+            recientes.popleft()
+
+    def resumen(self):
+        """Devuelve, por sala, los totales y las tasas de la última ventana."""
+        ahora = time.monotonic()
+        resultado = {}
+        with self._lock:
+            for sala, totales in self._totales.items():
+                recientes = self._recientes[sala]
+                self._descartar_antiguos(recientes, ahora)
+                eventos_ventana = sum(r[1] for r in recientes)
+                bytes_ventana = sum(r[2] for r in recientes)
+                resultado[sala] = dict(
+                    totales,
+                    eventos_por_segundo=round(eventos_ventana / self.ventana_segundos, 3),
+                    bytes_por_segundo=round(bytes_ventana / self.ventana_segundos, 1),
+                )
+        return resultado
+
+    def resumen_eventos(self):
+        """Devuelve los totales por nombre de evento (los agrupados se cuentan por separado)."""
+        with self._lock:
+            return {evento: dict(totales) for evento, totales in self._por_evento.items()}
+
+
+class ProgramadorDifusion:
+    """Agrupa los eventos Socket.IO por sala durante una ventana configurable.
+
+    Se inicializa como las demás extensiones (``init_app``). Configuración:
+
+    * ``DIFUSION_VENTANA_MS``: duración de la ventana de agrupación (0 la desactiva).
+    * ``DIFUSION_EVENTOS_INMEDIATOS``: eventos que nunca esperan la ventana.
+    """
+
+    EVENTO_AGRUPADO = 'eventos_agrupados'
+
+    def __init__(self, app=None, socketio=None):
+        self.socketio = None
+        self.ventana = 0.1
+        self.eventos_inmediatos = {'nuevo_llamado'}
+        self.estadisticas = EstadisticasDifusion()
+        self._lock = threading.Lock()
+        self._pendientes = defaultdict(list)
+        self._programadas = set()
+        if app is not None:
+            self.init_app(app, socketio)
+
+    def init_app(self, app, socketio):
+        self.socketio = socketio
+        self.ventana = app.config.get('DIFUSION_VENTANA_MS', 100) / 1000
+        self.eventos_inmediatos = set(app.config.get('DIFUSION_EVENTOS_INMEDIATOS', self.eventos_inmediatos))
+        app.extensions['difusion'] = self
+
+    def emitir(self, evento, datos, room, inmediato=None):
+        """Encola un evento para la sala, o lo envía de inmediato si corresponde."""
+        if inmediato is None:
+            inmediato = evento in self.eventos_inmediatos
+
+        if inmediato or self.ventana <= 0:
+            # Vaciamos lo pendiente antes para no alterar el orden de los eventos
+            self.vaciar(room)
+            self._enviar(evento, datos, room)
+            return
+
+        with self._lock:
+            self._pendientes[room].append((evento, datos))
+            programar = room not in self._programadas
+            self._programadas.add(room)
+
+        if programar:
+            self.socketio.start_background_task(self._vaciar_tras_ventana, room)
+
+    def _vaciar_tras_ventana(self, room):
+        self.socketio.sleep(self.ventana)
+        self.vaciar(room)
+
+    def vaciar(self, room):
+        """Envía de una vez todo lo acumulado para la sala."""
+        with self._lock:
+            pendientes = self._pendientes.pop(room, [])
+            self._programadas.discard(room)
+
+        if not pendientes:
+            return
+        if len(pendientes) == 1:
+            evento, datos = pendientes[0]
+            self._enviar(evento, datos, room)
+        else:
+            datos = {'eventos': [{'evento': evento, 'datos': d} for evento, d in pendientes]}
+            self._enviar(self.EVENTO_AGRUPADO, datos, room, cantidad_eventos=len(pendientes))
+
+    def _enviar(self, evento, datos, room, cantidad_eventos=1):
+        self.socketio.emit(evento, datos, room=room)
+        tamano = _tamano_json(datos)
+        self.estadisticas.registrar(room, cantidad_eventos, tamano)
+        if evento == self.EVENTO_AGRUPADO:
+            for e in datos['eventos']:
+                self.estadisticas.registrar_evento(e['evento'], _tamano_json(e['datos']))
+        else:
+            self.estadisticas.registrar_evento(evento, tamano)
+
+
+def _tamano_json(datos):
+    return len(json.dumps(datos, default=str, separators=(',', ':')))
@@ -0,0 +1,159 @@
+# estimaciones.py
+# Estimación del tiempo de espera por servicio.
+#
+# Se mantiene en memoria un promedio móvil exponencial (EWMA) de la duración de las
+# atenciones (hora_finalizado - hora_llamado), uno por servicio y otro por mesón
+# (funcionario), junto con los mesones que están atendiendo en este momento.
+# 'llamar_siguiente' y 'finalizar_atencion' lo actualizan al vuelo, así que la
+# espera estimada de un ticket sale de unas pocas multiplicaciones, sin recorrer el
+# historial en cada solicitud. Al arrancar se reconstruye a partir de los tickets
+# atendidos más recientes.
+
+import threading
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+from metricas import encabezado, linea
+
+
+class EstimadorEspera:
+    """Promedios móviles de la duración de las atenciones y espera estimada por ticket.
+
+    Se inicializa como las demás extensiones (``init_app``). Configuración:
+
+    * ``ESTIMADOR_ALFA``: peso de cada atención nueva en el promedio (0-1).
+    * ``ESTIMADOR_VENTANA_MIN``: minutos sin actividad tras los que un mesón deja de contar como activo.
+    * ``ESTIMADOR_DURACION_MAX_MIN``: atenciones más largas se ignoran (tickets olvidados abiertos).
+    * ``ESTIMADOR_HISTORIAL``: tickets recientes con que se reconstruye al arrancar.
+    """
+
+    def __init__(self, app=None, **kwargs):
+        self.alfa = 0.2
+        self.ventana = timedelta(minutes=15)
+        self.duracion_maxima = 60 * 60
+        self.historial = 500
+        self.cargado = False
+        self._lock = threading.Lock()
+        self._servicios = {}  # servicio_id -> EWMA de la duración (segundos)
+        self._mesones = defaultdict(dict)  # servicio_id -> {usuario_id: [EWMA o None, última actividad]}
+        self._tasas = {}  # servicio_id -> (atenciones por segundo, válida hasta)
+        self._cargar = None
+        self._reloj = datetime.now
+        if app is not None:
+            self.init_app(app, **kwargs)
+
+    def init_app(self, app, cargar, reloj=None):
+        """'cargar(limite)' entrega los tickets llamados más recientes como tuplas
+        (servicio_id, usuario_id, hora_llamado, hora_finalizado), del más antiguo al más nuevo.
+        'reloj()' entrega la hora actual con la misma zona horaria que los tickets.
+        """
+        self.alfa = app.config.get('ESTIMADOR_ALFA', 0.2)
+        self.ventana = timedelta(minutes=app.config.get('ESTIMADOR_VENTANA_MIN', 15))
+        self.duracion_maxima = app.config.get('ESTIMADOR_DURACION_MAX_MIN', 60) * 60
+        self.historial = app.config.get('ESTIMADOR_HISTORIAL', 500)
+        self._cargar = cargar
+        self._reloj = reloj or datetime.now
+        app.extensions['estimador_espera'] = self
+        # Antes de la primera vista, cuando la base de datos ya está disponible
+        app.before_request(self._asegurar_cargado)
+
+    def _asegurar_cargado(self):
+        if self.cargado:
+            return
+        self.cargado = True
+        try:
+            tickets = self._cargar(self.historial)
+        except Exception:
+            # Sin historial (p. ej. tablas aún sin crear) se parte de cero
+            return
+        with self._lock:
+            for servicio_id, usuario_id, hora_llamado, hora_finalizado in tickets:
+                if usuario_id is None:
+                    continue
+                if hora_finalizado is None:
+                    self._actividad(servicio_id, usuario_id, hora_llamado)
+                else:
+                    self._observar(servicio_id, usuario_id,
+                                   (hora_finalizado - hora_llamado).total_seconds(), hora_finalizado)
+
+    # --- ACTUALIZACIONES (desde las vistas del panel) ---
+    def llamado(self, servicio_id, usuario_id):
+        """Un mesón llamó a un ticket: cuenta como activo."""
+        with self._lock:
+            self._actividad(servicio_id, usuario_id, self._reloj())
+
+    def finalizado(self, servicio_id, usuario_id, duracion_s):
+        """Un mesón terminó una atención de 'duracion_s' segundos."""
+        with self._lock:
+            self._observar(servicio_id, usuario_id, duracion_s, self._reloj())
+
+    def _actividad(self, servicio_id, usuario_id, cuando):
+        meson = self._mesones[servicio_id].setdefault(usuario_id, [None, cuando])
+        meson[1] = max(meson[1], cuando)
+        self._tasas.pop(servicio_id, None)
+
+    def _observar(self, servicio_id, usuario_id, duracion_s, cuando):
+        self._actividad(servicio_id, usuario_id, cuando)
+        if not 0 < duracion_s <= self.duracion_maxima:
+            return
+        self._servicios[servicio_id] = self._ewma(self._servicios.get(servicio_id), duracion_s)
+        meson = self._mesones[servicio_id][usuario_id]
+        meson[0] = self._ewma(meson[0], duracion_s)
+
+    def _ewma(self, anterior, valor):
+        return valor if anterior is None else anterior + self.alfa * (valor - anterior)
+
+    # --- CONSULTAS ---
+    def _tasa(self, servicio_id, ahora):
+        """Atenciones por segundo de los mesones activos del servicio (se recalcula solo si algo cambió)."""
+        guardada = self._tasas.get(servicio_id)
+        if guardada and ahora < guardada[1]:
+            return guardada[0]
+
+        promedio = self._servicios.get(servicio_id)
+        tasa, valida_hasta = 0.0, ahora + self.ventana
+        for duracion, ultima in self._mesones[servicio_id].values():
+            if ahora - ultima > self.ventana:
+                continue
+            # Un mesón sin atenciones propias se estima con el promedio del servicio
+            duracion = duracion or promedio
+            if duracion:
+                tasa += 1 / duracion
+            valida_hasta = min(valida_hasta, ultima + self.ventana)
+        if not tasa and promedio:
+            tasa = 1 / promedio  # Nadie atendiendo ahora: se supone que volverá un mesón
+        self._tasas[servicio_id] = (tasa, valida_hasta)
+        return tasa
+
+    def eta_min(self, servicio_id, personas_antes):
+        """Minutos estimados hasta que llamen al ticket que tiene 'personas_antes' delante (None sin datos)."""
+        with self._lock:
+            tasa = self._tasa(servicio_id, self._reloj())
+        if not tasa:
+            return None
+        return round((personas_antes + 1) / tasa / 60)
+
+    def mesones_activos(self, servicio_id):
+        ahora = self._reloj()
+        with self._lock:
+            return sum(1 for _, ultima in self._mesones[servicio_id].values() if ahora - ultima <= self.ventana)
+
+    def resumen(self):
+        """{servicio_id: {'duracion_s', 'mesones'}} para el dashboard y las métricas."""
+        with self._lock:
+            servicios = list(self._servicios.items())
+        return {
+            servicio_id: {'duracion_s': round(duracion), 'mesones': self.mesones_activos(servicio_id)}
+            for servicio_id, duracion in servicios
+        }
+
+    def lineas_prometheus(self):
+        resumen = sorted(self.resumen().items())
+        lineas = encabezado('turnos_atencion_duracion_segundos', 'gauge',
+                            'Duración de las atenciones por servicio (promedio móvil exponencial).')
+        for servicio_id, datos in resumen:
+            lineas.append(linea('turnos_atencion_duracion_segundos', datos['duracion_s'], servicio=servicio_id))
+        lineas += encabezado('turnos_mesones_activos', 'gauge', 'Mesones que atendieron en la ventana reciente.')
+        for servicio_id, datos in resumen:
+            lineas.append(linea('turnos_mesones_activos', datos['mesones'], servicio=servicio_id))
+        return lineas
@@ -0,0 +1,287 @@
+# metricas.py
+# Instrumentación liviana del Sistema de Turnos.
+#
+# Sin depender de servicios externos, mide:
+#   * la latencia de cada solicitud HTTP, como histograma por ruta,
+#   * cuántas consultas SQL hace cada solicitud y cuánto tiempo toman,
+#   * los eventos Socket.IO emitidos por nombre (los cuenta el programador de difusión),
+#   * los bloqueos del hub de eventlet: un vigilante que debería despertar cada
+#     medio segundo despierta tarde si algún green thread no cede el control.
+#
+# Todo se expone en el formato de texto de Prometheus (ver /admin/metrics).
+
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict
+
+from flask import g, request, has_request_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+LIMITES_LATENCIA = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+LIMITES_HUB = (0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+FUERA_DE_SOLICITUD = ('(fuera de solicitud)', '-')
+
+
+class Histograma:
+    """Histograma acumulativo con límites fijos, como los de Prometheus."""
+
+    def __init__(self, limites):
+        self.limites = limites
+        self.conteos = [0] * (len(limites) + 1)  # El último casillero es +Inf
+        self.suma = 0.0
+        self.total = 0
+
+    def observar(self, valor):
+        self.conteos[bisect_left(self.limites, valor)] += 1
+        self.suma += valor
+        self.total += 1
+
+    def acumulados(self):
+        """Pares (límite, observaciones <= límite), terminando en '+Inf'."""
+        acumulado = 0
+        for limite, conteo in zip(list(self.limites) + ['+Inf'], self.conteos):
+            acumulado += conteo
+            yield limite, acumulado
+
+    def percentil(self, p):
+        """Límite superior del casillero donde cae el percentil (aproximado)."""
+        if not self.total:
+            return 0.0
+        objetivo = p / 100 * self.total
+        for limite, acumulado in self.acumulados():
+            if acumulado >= objetivo:
+                return float('inf') if limite == '+Inf' else limite
+        return float('inf')
+
+
+def _etiquetas(**etiquetas):
+    partes = []
+    for nombre, valor in etiquetas.items():
+        valor = str(valor).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        partes.append(f'{nombre}="{valor}"')
+    return '{' + ','.join(partes) + '}'
+
+
+def _en_ms(segundos):
+    """Segundos a milisegundos; None si cayó en el casillero +Inf."""
+    return None if segundos == float('inf') else round(segundos * 1000, 1)
+
+
+def _numero(valor):
+    return repr(float(valor)) if isinstance(valor, float) else str(valor)
+
+
+def encabezado(nombre, tipo, ayuda):
+    """Líneas HELP y TYPE de una métrica."""
+    return [f'# HELP {nombre} {ayuda}', f'# TYPE {nombre} {tipo}']
+
+
+def lineas_histograma(nombre, hist, **etiquetas):
+    """Líneas _bucket, _sum y _count de un Histograma."""
+    lineas = [f'{nombre}_bucket{_etiquetas(**etiquetas, le=limite)} {acumulado}'
+              for limite, acumulado in hist.acumulados()]
+    sufijo = _etiquetas(**etiquetas) if etiquetas else ''
+    lineas.append(f'{nombre}_sum{sufijo} {_numero(hist.suma)}')
+    lineas.append(f'{nombre}_count{sufijo} {hist.total}')
+    return lineas
+
+
+def linea(nombre, valor, **etiquetas):
+    return f'{nombre}{_etiquetas(**etiquetas) if etiquetas else ""} {_numero(valor)}'
+
+
+class Metricas:
+    """Recolector de métricas de la app.
+
+    Se inicializa como las demás extensiones (``init_app``). Configuración:
+
+    * ``METRICAS_VIGILAR_HUB``: activa el vigilante del hub de eventlet.
+    * ``METRICAS_HUB_INTERVALO``: cada cuántos segundos despierta el vigilante.
+    * ``METRICAS_HUB_UMBRAL``: retraso (segundos) desde el que se considera bloqueo.
+    """
+
+    def __init__(self, app=None, difusion=None):
+        self.difusion = None
+        self.logger = None
+        self._lock = threading.Lock()
+        self._latencias = defaultdict(lambda: Histograma(LIMITES_LATENCIA))  # (ruta, método)
+        self._respuestas = defaultdict(int)  # (ruta, método, código)
+        self._sql = defaultdict(lambda: [0, 0.0])  # (ruta, método) -> [consultas, segundos]
+        self._hub_retrasos = Histograma(LIMITES_HUB)
+        self._hub_bloqueos = 0
+        self._hub_umbral = 0.1
+        self._escuchando_sql = False
+        self._vigilante = None
+        self._exportadores = {}  # nombre -> función
+        if app is not None:
+            self.init_app(app, difusion)
+
+    def init_app(self, app, difusion=None):
+        self.difusion = difusion
+        self.logger = app.logger
+        app.extensions['metricas'] = self
+        app.before_request(self._antes_de_solicitud)
+        app.after_request(self._despues_de_solicitud)
+        app.teardown_request(self._al_terminar_solicitud)
+
+        # Los eventos se registran sobre la clase Engine: cubren el engine que
+        # Flask-SQLAlchemy crea más tarde. Solo una vez aunque haya varias apps.
+        if not self._escuchando_sql:
+            event.listen(Engine, 'before_cursor_execute', self._antes_de_consulta)
+            event.listen(Engine, 'after_cursor_execute', self._despues_de_consulta)
+            self._escuchando_sql = True
+
+        if app.config.get('METRICAS_VIGILAR_HUB', True):
+            self._iniciar_vigilante(app.config.get('METRICAS_HUB_INTERVALO', 0.5),
+                                    app.config.get('METRICAS_HUB_UMBRAL', 0.1))
+
+    def agregar_exportador(self, nombre, funcion):
+        """Registra una función sin argumentos que devuelve más líneas para /admin/metrics.
+
+        Con el mismo nombre reemplaza a la anterior: crear otra app (p. ej. en los
+        benchmarks) no repite las series.
+        """
+        self._exportadores[nombre] = funcion
+
+    # --- SOLICITUDES HTTP ---
+    def _antes_de_solicitud(self):
+        g._metricas_inicio = time.perf_counter()
+        g._metricas_sql = [0, 0.0]
+
+    def _despues_de_solicitud(self, response):
+        g._metricas_codigo = response.status_code
+        return response
+
+    def _al_terminar_solicitud(self, error=None):
+        inicio = g.pop('_metricas_inicio', None)
+        if inicio is None:
+            return
+        duracion = time.perf_counter() - inicio
+        clave = (request.url_rule.rule if request.url_rule else '(sin ruta)', request.method)
+        codigo = g.pop('_metricas_codigo', 500 if error else 200)
+        consultas, segundos_sql = g.pop('_metricas_sql', (0, 0.0))
+        with self._lock:
+            self._latencias[clave].observar(duracion)
+            self._respuestas[clave + (codigo,)] += 1
+            sql = self._sql[clave]
+            sql[0] += consultas
+            sql[1] += segundos_sql
+
+    # --- CONSULTAS SQL ---
+    def _antes_de_consulta(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('_metricas_inicio', []).append(time.perf_counter())
+
+    def _despues_de_consulta(self, conn, cursor, statement, parameters, context, executemany):
+        inicios = conn.info.get('_metricas_inicio')
+        if not inicios:
+            return
+        duracion = time.perf_counter() - inicios.pop()
+        if has_request_context() and '_metricas_sql' in g:
+            g._metricas_sql[0] += 1
+            g._metricas_sql[1] += duracion
+        else:
+            # Tareas en segundo plano y comandos de la CLI
+            with self._lock:
+                sql = self._sql[FUERA_DE_SOLICITUD]
+                sql[0] += 1
+                sql[1] += duracion
+
+    # --- HUB DE EVENTLET ---
+    def _iniciar_vigilante(self, intervalo, umbral):
+        # Solo tiene sentido en el worker eventlet (wsgi.py), no en 'flask db upgrade' ni en la CLI
+        try:
+            import eventlet
+            from eventlet import patcher
+        except ImportError:
+            return
+        if self._vigilante is not None or not patcher.is_monkey_patched('thread'):
+            return
+        self._hub_umbral = umbral
+        self._vigilante = eventlet.spawn(self._vigilar_hub, eventlet.sleep, intervalo, umbral)
+
+    def _vigilar_hub(self, dormir, intervalo, umbral):
+        while True:
+            inicio = time.perf_counter()
+            dormir(intervalo)
+            retraso = max(0.0, time.perf_counter() - inicio - intervalo)
+            with self._lock:
+                self._hub_retrasos.observar(retraso)
+                if retraso >= umbral:
+                    self._hub_bloqueos += 1
+            if retraso >= umbral:
+                self.logger.warning(f'Hub de eventlet bloqueado durante {retraso * 1000:.0f} ms')
+
+    # --- EXPORTACIÓN ---
+    def exportar_prometheus(self):
+        """Devuelve todas las métricas en el formato de texto de Prometheus."""
+        lineas = []
+
+        with self._lock:
+            lineas += encabezado('turnos_http_duracion_segundos', 'histogram', 'Latencia de las solicitudes HTTP por ruta.')
+            for (ruta, metodo), hist in sorted(self._latencias.items()):
+                lineas += lineas_histograma('turnos_http_duracion_segundos', hist, ruta=ruta, metodo=metodo)
+
+            lineas += encabezado('turnos_http_respuestas_total', 'counter', 'Respuestas HTTP por ruta y código.')
+            for (ruta, metodo, codigo), cantidad in sorted(self._respuestas.items()):
+                lineas.append(linea('turnos_http_respuestas_total', cantidad, ruta=ruta, metodo=metodo, codigo=codigo))
+
+            lineas += encabezado('turnos_sql_consultas_total', 'counter', 'Consultas SQL ejecutadas, por ruta.')
+            for (ruta, metodo), (consultas, _) in sorted(self._sql.items()):
+                lineas.append(linea('turnos_sql_consultas_total', consultas, ruta=ruta, metodo=metodo))
+
+            lineas += encabezado('turnos_sql_duracion_segundos_total', 'counter', 'Tiempo total en consultas SQL, por ruta.')
+            for (ruta, metodo), (_, segundos) in sorted(self._sql.items()):
+                lineas.append(linea('turnos_sql_duracion_segundos_total', segundos, ruta=ruta, metodo=metodo))
+
+            lineas += encabezado('turnos_hub_retraso_segundos', 'histogram', 'Retraso con que despierta el vigilante del hub de eventlet.')
+            lineas += lineas_histograma('turnos_hub_retraso_segundos', self._hub_retrasos)
+
+            lineas += encabezado('turnos_hub_bloqueos_total', 'counter', 'Veces que el hub de eventlet estuvo bloqueado sobre el umbral.')
+            lineas.append(linea('turnos_hub_bloqueos_total', self._hub_bloqueos))
+
+        if self.difusion is not None:
+            estadisticas = self.difusion.estadisticas
+            por_evento = estadisticas.resumen_eventos()
+            lineas += encabezado('turnos_socketio_eventos_total', 'counter', 'Eventos Socket.IO emitidos, por nombre.')
+            for evento, datos in sorted(por_evento.items()):
+                lineas.append(linea('turnos_socketio_eventos_total', datos['eventos'], evento=evento))
+            lineas += encabezado('turnos_socketio_bytes_total', 'counter', 'Bytes de datos emitidos por Socket.IO, por nombre de evento.')
+            for evento, datos in sorted(por_evento.items()):
+                lineas.append(linea('turnos_socketio_bytes_total', datos['bytes'], evento=evento))
+
+            por_sala = estadisticas.resumen()
+            lineas += encabezado('turnos_socketio_mensajes_total', 'counter', 'Mensajes Socket.IO enviados, por sala.')
+            for sala, datos in sorted(por_sala.items()):
+                lineas.append(linea('turnos_socketio_mensajes_total', datos['mensajes'], sala=sala))
+
+        for exportador in self._exportadores.values():
+            lineas += exportador()
+
+        return '\n'.join(lineas) + '\n'
+
+    def resumen(self, limite=10):
+        """Resumen para el dashboard: las rutas que más tiempo acumulan y el estado del hub."""
+        with self._lock:
+            rutas = []
+            for (ruta, metodo), hist in self._latencias.items():
+                consultas, segundos_sql = self._sql.get((ruta, metodo), (0, 0.0))
+                rutas.append({
+                    'ruta': ruta,
+                    'metodo': metodo,
+                    'solicitudes': hist.total,
+                    'tiempo_total_s': hist.suma,
+                    'promedio_ms': round(hist.suma / hist.total * 1000, 1),
+                    'p95_ms': _en_ms(hist.percentil(95)),
+                    'consultas_promedio': round(consultas / hist.total, 1),
+                    'sql_promedio_ms': round(segundos_sql / hist.total * 1000, 1),
+                })
+            hub = {
+                'activo': self._vigilante is not None,
+                'bloqueos': self._hub_bloqueos,
+                'umbral_ms': round(self._hub_umbral * 1000),
+                'p99_ms': _en_ms(self._hub_retrasos.percentil(99)),
+            }
+        rutas.sort(key=lambda r: r['tiempo_total_s'], reverse=True)
+        return {'rutas': rutas[:limite], 'hub': hub}
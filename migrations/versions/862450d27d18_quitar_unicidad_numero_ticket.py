@@ -0,0 +1,46 @@
+"""Quitar unicidad de numero_ticket
+
+El número de ticket se repite en cada ciclo del contador (A00..E99) y tras
+cada reinicio del servicio, así que la unicidad global impedía reiniciar los
+contadores antes de terminar de archivar el historial. La exclusión entre
+registradores concurrentes ahora la garantiza la actualización condicional del
+contador en 'servicio'.
+
+Revision ID: 862450d27d18
+Revises: 020a326d835b
+Create Date: 2026-10-19 11:02:17.448190
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '862450d27d18'
+down_revision = '020a326d835b'
+branch_labels = None
+depends_on = None
+
+# La restricción original se creó sin nombre; en SQLite le asignamos uno al
+# recrear la tabla para poder eliminarla. El downgrade la vuelve a crear con el
+# mismo nombre, así un downgrade seguido de upgrade funciona.
+naming_convention = {
+    "uq": "uq_%(table_name)s_%(column_0_name)s",
+}
+
+
+def _nombre_restriccion():
+    # PostgreSQL le dio su nombre por defecto al crearla sin nombre
+    return 'ticket_numero_ticket_key' if op.get_context().dialect.name == 'postgresql' else 'uq_ticket_numero_ticket'
+
+
+def upgrade():
+    if op.get_context().dialect.name == 'postgresql':
+        op.drop_constraint(_nombre_restriccion(), 'ticket', type_='unique')
+    else:
+        with op.batch_alter_table('ticket', schema=None, naming_convention=naming_convention) as batch_op:
+            batch_op.drop_constraint(_nombre_restriccion(), type_='unique')
+
+
+def downgrade():
+    with op.batch_alter_table('ticket', schema=None) as batch_op:
+        batch_op.create_unique_constraint(_nombre_restriccion(), ['numero_ticket'])
@@ -0,0 +1,53 @@
+"""Usuario referencia a servicio por id
+
+Revision ID: 8f0269e81421
+Revises: 862450d27d18
+Create Date: 2026-10-19 13:27:54.916302
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8f0269e81421'
+down_revision = '862450d27d18'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('usuario', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('servicio_id', sa.Integer(), nullable=True))
+        batch_op.create_foreign_key('fk_usuario_servicio_id_servicio', 'servicio', ['servicio_id'], ['id'])
+
+    # Traspasamos la asignación actual (por nombre de módulo) a la llave foránea
+    op.execute(
+        "UPDATE usuario SET servicio_id = ("
+        "SELECT servicio.id FROM servicio WHERE servicio.nombre_modulo = usuario.modulo_asignado"
+        ") WHERE modulo_asignado IS NOT NULL"
+    )
+
+    with op.batch_alter_table('usuario', schema=None) as batch_op:
+        batch_op.drop_column('modulo_asignado')
+
+    with op.batch_alter_table('ticket', schema=None) as batch_op:
+        batch_op.create_index('ix_ticket_cola', ['servicio_id', 'estado', 'es_preferencial', 'hora_registro'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('ticket', schema=None) as batch_op:
+        batch_op.drop_index('ix_ticket_cola')
+
+    with op.batch_alter_table('usuario', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('modulo_asignado', sa.String(length=100), nullable=True))
+
+    op.execute(
+        "UPDATE usuario SET modulo_asignado = ("
+        "SELECT servicio.nombre_modulo FROM servicio WHERE servicio.id = usuario.servicio_id"
+        ") WHERE servicio_id IS NOT NULL"
+    )
+
+    with op.batch_alter_table('usuario', schema=None) as batch_op:
+        batch_op.drop_constraint('fk_usuario_servicio_id_servicio', type_='foreignkey')
+        batch_op.drop_column('servicio_id')
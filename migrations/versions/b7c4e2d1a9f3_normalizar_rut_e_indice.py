@@ -0,0 +1,48 @@
+"""Normalizar rut_cliente e indexarlo
+
+Revision ID: b7c4e2d1a9f3
+Revises: 8f0269e81421
+Create Date: 2026-10-20 10:05:12.481930
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'b7c4e2d1a9f3'
+down_revision = '8f0269e81421'
+branch_labels = None
+depends_on = None
+
+
+def _rut_normalizado(columna):
+    """Misma forma que rut.limpiar_rut(): sin puntos, guiones, espacios ni ceros a la izquierda, 'NNNNNNNN-D'."""
+    limpio = f"LTRIM(UPPER(REPLACE(REPLACE(REPLACE({columna}, '.', ''), '-', ''), ' ', '')), '0')"
+    return (f"CASE WHEN LENGTH({limpio}) > 1 "
+            f"THEN SUBSTR({limpio}, 1, LENGTH({limpio}) - 1) || '-' || SUBSTR({limpio}, LENGTH({limpio})) "
+            f"ELSE {limpio} END")
+
+
+def upgrade():
+    # Los RUT históricos se digitaron libremente ('12.345.678-5', '123456785'...).
+    # Se llevan a la forma normalizada para que el historial se busque por igualdad.
+    for tabla in ('ticket', 'ticket_archive'):
+        op.execute(
+            f"UPDATE {tabla} SET rut_cliente = {_rut_normalizado('rut_cliente')} "
+            f"WHERE rut_cliente <> {_rut_normalizado('rut_cliente')}"
+        )
+
+    with op.batch_alter_table('ticket', schema=None) as batch_op:
+        batch_op.create_index('ix_ticket_rut', ['rut_cliente', 'hora_registro', 'id'], unique=False)
+
+    with op.batch_alter_table('ticket_archive', schema=None) as batch_op:
+        batch_op.create_index('ix_ticket_archive_rut', ['rut_cliente', 'hora_registro', 'id'], unique=False)
+
+
+def downgrade():
+    # La normalización de los RUT no se revierte (el formato original no se guardó)
+    with op.batch_alter_table('ticket_archive', schema=None) as batch_op:
+        batch_op.drop_index('ix_ticket_archive_rut')
+
+    with op.batch_alter_table('ticket', schema=None) as batch_op:
+        batch_op.drop_index('ix_ticket_rut')
@@ -0,0 +1,130 @@
+"""Agregar sedes
+
+Cada servicio, funcionario, ticket y clave de configuración pasa a pertenecer a
+una sede. Los datos existentes quedan en la sede 'Casa Central' (id 1); los
+administradores existentes quedan sin sede, es decir, administran todas.
+Los índices de las consultas frecuentes parten por sede_id.
+
+Revision ID: c5d81f3e6a27
+Revises: b7c4e2d1a9f3
+Create Date: 2026-10-21 09:12:40.118205
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c5d81f3e6a27'
+down_revision = 'b7c4e2d1a9f3'
+branch_labels = None
+depends_on = None
+
+# Las restricciones de unicidad originales se crearon sin nombre; en SQLite les
+# asignamos uno al recrear la tabla para poder eliminarlas.
+naming_convention = {
+    "uq": "uq_%(table_name)s_%(column_0_name)s",
+}
+
+
+def _quitar_unicidad(tabla, columna):
+    if op.get_context().dialect.name == 'postgresql':
+        op.drop_constraint(f'{tabla}_{columna}_key', tabla, type_='unique')
+    else:
+        with op.batch_alter_table(tabla, schema=None, naming_convention=naming_convention) as batch_op:
+            batch_op.drop_constraint(f'uq_{tabla}_{columna}', type_='unique')
+
+
+def _agregar_sede_id(tabla, valor, nullable=False):
+    """Agrega 'sede_id' con su llave foránea y la llena con 'valor' (SQL)."""
+    with op.batch_alter_table(tabla, schema=None) as batch_op:
+        batch_op.add_column(sa.Column('sede_id', sa.Integer(), nullable=True))
+        batch_op.create_foreign_key(f'fk_{tabla}_sede', 'sede', ['sede_id'], ['id'])
+    op.execute(f"UPDATE {tabla} SET sede_id = {valor}")
+    if not nullable:
+        with op.batch_alter_table(tabla, schema=None) as batch_op:
+            batch_op.alter_column('sede_id', existing_type=sa.Integer(), nullable=False)
+
+
+def upgrade():
+    sede = op.create_table('sede',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('nombre', sa.String(length=100), nullable=False),
+    sa.Column('codigo', sa.String(length=20), nullable=False),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('codigo'),
+    sa.UniqueConstraint('nombre')
+    )
+    op.bulk_insert(sede, [{'id': 1, 'nombre': 'Casa Central', 'codigo': 'central'}])
+    if op.get_context().dialect.name == 'postgresql':
+        # El id se insertó a mano: la secuencia debe seguir desde ahí
+        op.execute("SELECT setval('sede_id_seq', (SELECT MAX(id) FROM sede))")
+
+    # Servicios: nombre y prefijo pasan a ser únicos dentro de cada sede
+    _agregar_sede_id('servicio', '1')
+    _quitar_unicidad('servicio', 'nombre_modulo')
+    _quitar_unicidad('servicio', 'prefijo_ticket')
+    with op.batch_alter_table('servicio', schema=None) as batch_op:
+        batch_op.create_unique_constraint('uq_servicio_sede_nombre', ['sede_id', 'nombre_modulo'])
+        batch_op.create_unique_constraint('uq_servicio_sede_prefijo', ['sede_id', 'prefijo_ticket'])
+
+    _agregar_sede_id('usuario', "CASE WHEN rol = 'admin' THEN NULL ELSE 1 END", nullable=True)
+    with op.batch_alter_table('usuario', schema=None) as batch_op:
+        batch_op.create_index('ix_usuario_sede_nombre', ['sede_id', 'nombre_funcionario'], unique=False)
+
+    # Tickets: la sede se copia de su servicio para que los índices partan por ella
+    _agregar_sede_id('ticket', '(SELECT servicio.sede_id FROM servicio WHERE servicio.id = ticket.servicio_id)')
+    with op.batch_alter_table('ticket', schema=None) as batch_op:
+        batch_op.drop_index('ix_ticket_cola')
+        batch_op.create_index('ix_ticket_cola', ['sede_id', 'servicio_id', 'estado', 'es_preferencial', 'hora_registro'], unique=False)
+        batch_op.create_index('ix_ticket_sede_llamado', ['sede_id', 'estado', 'hora_llamado'], unique=False)
+        batch_op.create_index('ix_ticket_sede_registro', ['sede_id', 'hora_registro'], unique=False)
+
+    _agregar_sede_id('ticket_archive', '(SELECT servicio.sede_id FROM servicio WHERE servicio.id = ticket_archive.servicio_id)')
+    with op.batch_alter_table('ticket_archive', schema=None) as batch_op:
+        batch_op.create_index('ix_ticket_archive_sede_registro', ['sede_id', 'hora_registro'], unique=False)
+
+    # Configuración: cada sede abre y cierra su propio sistema
+    _agregar_sede_id('config_system', '1', nullable=True)
+    _quitar_unicidad('config_system', 'key')
+    with op.batch_alter_table('config_system', schema=None) as batch_op:
+        batch_op.create_unique_constraint('uq_config_system_sede_key', ['sede_id', 'key'])
+
+
+def downgrade():
+    # La configuración de las demás sedes se pierde. Falla si dos sedes tienen
+    # servicios con el mismo nombre o prefijo (vuelven a ser únicos globalmente).
+    op.execute("DELETE FROM config_system WHERE sede_id IS NOT NULL AND sede_id <> 1")
+    with op.batch_alter_table('config_system', schema=None) as batch_op:
+        batch_op.drop_constraint('uq_config_system_sede_key', type_='unique')
+        batch_op.create_unique_constraint('config_system_key_key', ['key'])
+        batch_op.drop_constraint('fk_config_system_sede', type_='foreignkey')
+        batch_op.drop_column('sede_id')
+
+    with op.batch_alter_table('ticket_archive', schema=None) as batch_op:
+        batch_op.drop_index('ix_ticket_archive_sede_registro')
+        batch_op.drop_constraint('fk_ticket_archive_sede', type_='foreignkey')
+        batch_op.drop_column('sede_id')
+
+    with op.batch_alter_table('ticket', schema=None) as batch_op:
+        batch_op.drop_index('ix_ticket_sede_registro')
+        batch_op.drop_index('ix_ticket_sede_llamado')
+        batch_op.drop_index('ix_ticket_cola')
+        batch_op.create_index('ix_ticket_cola', ['servicio_id', 'estado', 'es_preferencial', 'hora_registro'], unique=False)
+        batch_op.drop_constraint('fk_ticket_sede', type_='foreignkey')
+        batch_op.drop_column('sede_id')
+
+    with op.batch_alter_table('usuario', schema=None) as batch_op:
+        batch_op.drop_index('ix_usuario_sede_nombre')
+        batch_op.drop_constraint('fk_usuario_sede', type_='foreignkey')
+        batch_op.drop_column('sede_id')
+
+    with op.batch_alter_table('servicio', schema=None) as batch_op:
+        batch_op.drop_constraint('uq_servicio_sede_prefijo', type_='unique')
+        batch_op.drop_constraint('uq_servicio_sede_nombre', type_='unique')
+        batch_op.create_unique_constraint('servicio_nombre_modulo_key', ['nombre_modulo'])
+        batch_op.create_unique_constraint('servicio_prefijo_ticket_key', ['prefijo_ticket'])
+        batch_op.drop_constraint('fk_servicio_sede', type_='foreignkey')
+        batch_op.drop_column('sede_id')
+
+    op.drop_table('sede')
@@ -0,0 +1,61 @@
+"""Agregar tareas programadas y resumen diario
+
+Tablas del programador de tareas (fila de liderazgo e historial de ejecuciones)
+y el resumen diario de tickets por servicio que usa el dashboard.
+
+Revision ID: d2a47b9c1e05
+Revises: c5d81f3e6a27
+Create Date: 2026-10-22 11:40:03.528114
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd2a47b9c1e05'
+down_revision = 'c5d81f3e6a27'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('bloqueo_programador',
+    sa.Column('nombre', sa.String(length=50), nullable=False),
+    sa.Column('instancia', sa.String(length=100), nullable=False),
+    sa.Column('vence', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('nombre')
+    )
+    op.create_table('ejecucion_tarea',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('tarea', sa.String(length=50), nullable=False),
+    sa.Column('programada', sa.DateTime(), nullable=False),
+    sa.Column('inicio', sa.DateTime(), nullable=False),
+    sa.Column('fin', sa.DateTime(), nullable=True),
+    sa.Column('estado', sa.String(length=20), nullable=False),
+    sa.Column('detalle', sa.String(length=500), nullable=True),
+    sa.Column('instancia', sa.String(length=100), nullable=False),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('tarea', 'programada', name='uq_ejecucion_tarea_programada')
+    )
+    # El resumen se llena con la tarea 'resumen_diario' (o 'flask ejecutar-tarea resumen_diario')
+    op.create_table('resumen_diario',
+    sa.Column('fecha', sa.Date(), nullable=False),
+    sa.Column('servicio_id', sa.Integer(), nullable=False),
+    sa.Column('sede_id', sa.Integer(), nullable=False),
+    sa.Column('tickets', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['sede_id'], ['sede.id'], ),
+    sa.ForeignKeyConstraint(['servicio_id'], ['servicio.id'], ),
+    sa.PrimaryKeyConstraint('fecha', 'servicio_id')
+    )
+    with op.batch_alter_table('resumen_diario', schema=None) as batch_op:
+        batch_op.create_index('ix_resumen_diario_sede_fecha', ['sede_id', 'fecha'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('resumen_diario', schema=None) as batch_op:
+        batch_op.drop_index('ix_resumen_diario_sede_fecha')
+
+    op.drop_table('resumen_diario')
+    op.drop_table('ejecucion_tarea')
+    op.drop_table('bloqueo_programador')
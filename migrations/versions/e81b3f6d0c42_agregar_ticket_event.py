@@ -0,0 +1,71 @@
+"""Agregar registro de eventos de tickets
+
+Tabla de solo inserción con cada cambio de estado de los tickets. Se llena con
+los tickets vivos (los archivados no): registro, llamado y finalización según
+sus horas guardadas. Los re-llamados anteriores no dejaron rastro.
+
+Revision ID: e81b3f6d0c42
+Revises: d2a47b9c1e05
+Create Date: 2026-10-23 09:02:51.774310
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e81b3f6d0c42'
+down_revision = 'd2a47b9c1e05'
+branch_labels = None
+depends_on = None
+
+
+def _segundos(hasta, desde):
+    if op.get_context().dialect.name == 'postgresql':
+        return f"CAST(EXTRACT(EPOCH FROM ({hasta} - {desde})) AS INTEGER)"
+    return f"CAST(ROUND((julianday({hasta}) - julianday({desde})) * 86400) AS INTEGER)"
+
+
+def upgrade():
+    op.create_table('ticket_event',
+    sa.Column('id', sa.BigInteger().with_variant(sa.Integer(), 'sqlite'), nullable=False),
+    sa.Column('ticket_id', sa.Integer(), nullable=False),
+    sa.Column('tipo', sa.SmallInteger(), nullable=False),
+    sa.Column('momento', sa.DateTime(), nullable=False),
+    sa.Column('sede_id', sa.Integer(), nullable=False),
+    sa.Column('servicio_id', sa.Integer(), nullable=False),
+    sa.Column('usuario_id', sa.Integer(), nullable=True),
+    sa.Column('numero_meson', sa.SmallInteger(), nullable=True),
+    sa.Column('segundos', sa.Integer(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('ticket_event', schema=None) as batch_op:
+        batch_op.create_index('ix_ticket_event_sede_tipo_momento', ['sede_id', 'tipo', 'momento'], unique=False)
+        batch_op.create_index('ix_ticket_event_ticket', ['ticket_id'], unique=False)
+
+    # Tipos: 1 registrado, 2 llamado, 4 finalizado (ver EVENTO_* en app.py), en orden cronológico
+    op.execute(f"""
+        INSERT INTO ticket_event (ticket_id, tipo, momento, sede_id, servicio_id, usuario_id, numero_meson, segundos)
+        SELECT ticket_id, tipo, momento, sede_id, servicio_id, usuario_id, numero_meson, segundos FROM (
+            SELECT id AS ticket_id, 1 AS tipo, hora_registro AS momento, sede_id, servicio_id,
+                   registrado_por_id AS usuario_id, NULL AS numero_meson, NULL AS segundos
+            FROM ticket
+            UNION ALL
+            SELECT id, 2, hora_llamado, sede_id, servicio_id, atendido_por_id, numero_meson,
+                   {_segundos('hora_llamado', 'hora_registro')}
+            FROM ticket WHERE hora_llamado IS NOT NULL
+            UNION ALL
+            SELECT id, 4, hora_finalizado, sede_id, servicio_id, atendido_por_id, numero_meson,
+                   CASE WHEN hora_llamado IS NOT NULL THEN {_segundos('hora_finalizado', 'hora_llamado')} END
+            FROM ticket WHERE hora_finalizado IS NOT NULL
+        ) eventos
+        ORDER BY momento, tipo
+    """)
+
+
+def downgrade():
+    with op.batch_alter_table('ticket_event', schema=None) as batch_op:
+        batch_op.drop_index('ix_ticket_event_ticket')
+        batch_op.drop_index('ix_ticket_event_sede_tipo_momento')
+
+    op.drop_table('ticket_event')
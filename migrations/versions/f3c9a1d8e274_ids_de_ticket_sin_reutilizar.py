@@ -0,0 +1,51 @@
+"""Ids de ticket sin reutilizar
+
+Los tickets archivados conservan su id en 'ticket_archive' (y en el seguimiento,
+los QR impresos y 'ticket_event'). En SQLite la tabla 'ticket' no tenía
+AUTOINCREMENT: al vaciarse por el archivo se volvían a entregar los ids 1, 2,
+3..., el siguiente archivo fallaba por id duplicado y los enlaces de
+seguimiento apuntaban a otro ticket. Se recrea la tabla con AUTOINCREMENT y el
+contador parte sobre el mayor id ya usado. En PostgreSQL la secuencia nunca
+repite ids; solo se asegura que vaya sobre los archivados.
+
+Revision ID: f3c9a1d8e274
+Revises: e81b3f6d0c42
+Create Date: 2026-10-24 10:14:37.902615
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'f3c9a1d8e274'
+down_revision = 'e81b3f6d0c42'
+branch_labels = None
+depends_on = None
+
+MAYOR_ID_USADO = """
+    SELECT MAX(id) FROM (
+        SELECT COALESCE(MAX(id), 0) AS id FROM ticket
+        UNION ALL SELECT COALESCE(MAX(id), 0) FROM ticket_archive
+        UNION ALL SELECT COALESCE(MAX(ticket_id), 0) FROM ticket_event
+    ) ids
+"""
+
+
+def upgrade():
+    if op.get_context().dialect.name == 'postgresql':
+        op.execute(f"SELECT setval(pg_get_serial_sequence('ticket', 'id'), GREATEST(({MAYOR_ID_USADO}), 1))")
+        return
+
+    with op.batch_alter_table('ticket', schema=None, recreate='always',
+                              table_kwargs={'sqlite_autoincrement': True}):
+        pass
+    op.execute("DELETE FROM sqlite_sequence WHERE name = 'ticket'")
+    op.execute(f"INSERT INTO sqlite_sequence (name, seq) SELECT 'ticket', ({MAYOR_ID_USADO})")
+
+
+def downgrade():
+    if op.get_context().dialect.name == 'postgresql':
+        return
+    with op.batch_alter_table('ticket', schema=None, recreate='always',
+                              table_kwargs={'sqlite_autoincrement': False}):
+        pass
@@ -0,0 +1,121 @@
+# paginacion.py
+# Paginación por cursor ("keyset") para listados largos.
+#
+# Con OFFSET, pedir la página 5.000 obliga a la base de datos a leer y descartar
+# todas las filas anteriores. Aquí cada página se pide "después de" la última
+# fila vista: el cursor guarda los valores de las columnas de orden de esa fila
+# y la consulta sigue desde ahí por el índice, así que cualquier página cuesta lo
+# mismo que la primera. La última columna de orden debe ser única (p. ej. el id).
+#
+# 'descendente' puede ser un solo valor para todas las columnas o uno por columna
+# (p. ej. la cola de espera: preferenciales primero, luego por hora de llegada).
+
+import base64
+import json
+from datetime import datetime
+
+from sqlalchemy import and_, false, literal, or_, true, tuple_
+
+_PREFIJO_FECHA = 'fecha:'
+
+
+def codificar_cursor(valores):
+    """Texto opaco (apto para una URL) con los valores de orden de la última fila."""
+    valores = [f'{_PREFIJO_FECHA}{v.isoformat()}' if isinstance(v, datetime) else v for v in valores]
+    return base64.urlsafe_b64encode(json.dumps(valores).encode()).decode().rstrip('=')
+
+
+def decodificar_cursor(texto, columnas=None):
+    """Valores del cursor, o None si no viene o está dañado (se vuelve a la primera página).
+
+    Con 'columnas' (las de orden), también es None si los valores no son de sus
+    tipos: un cursor alterado no debe llegar a la comparación de la consulta.
+    """
+    if not texto:
+        return None
+    try:
+        valores = json.loads(base64.urlsafe_b64decode(texto + '=' * (-len(texto) % 4)))
+        if not isinstance(valores, list):
+            return None
+        valores = [datetime.fromisoformat(v[len(_PREFIJO_FECHA):])
+                   if isinstance(v, str) and v.startswith(_PREFIJO_FECHA) else v for v in valores]
+    except ValueError:
+        return None
+    if columnas is not None and (len(valores) != len(columnas)
+                                 or not all(map(_del_tipo, columnas, valores))):
+        return None
+    return valores
+
+
+def _del_tipo(columna, valor):
+    """True si 'valor' se puede comparar con 'columna' (las columnas de orden no admiten NULL)."""
+    try:
+        tipo = columna.type.python_type
+    except NotImplementedError:
+        return valor is not None
+    if tipo is bool:
+        return isinstance(valor, bool)
+    if tipo in (int, float):
+        # En JSON un booleano no es un número, aunque en Python bool sea un int
+        return isinstance(valor, (int, float) if tipo is float else int) and not isinstance(valor, bool)
+    return isinstance(valor, tipo)
+
+
+def _direcciones(columnas, descendente):
+    if isinstance(descendente, bool):
+        return [descendente] * len(columnas)
+    return list(descendente)
+
+
+def despues_de(columnas, valores, descendente=True):
+    """Condición 'fila después del cursor' para el orden dado por 'columnas'.
+
+    Con una sola dirección se expresa como comparación de tuplas, que PostgreSQL
+    resuelve con el índice de esas columnas; con direcciones mixtas se expande a
+    (a < x) OR (a = x AND b > y) OR ... Los valores nulos no se pueden comparar
+    así: las columnas de orden no deben admitir NULL.
+    """
+    if valores is None:
+        return true()
+    if len(valores) != len(columnas):
+        return false()
+    direcciones = _direcciones(columnas, descendente)
+    if len(columnas) == 1:
+        return columnas[0] < valores[0] if direcciones[0] else columnas[0] > valores[0]
+    if all(direcciones):
+        return tuple_(*columnas) < tuple_(*valores)
+    if not any(direcciones):
+        return tuple_(*columnas) > tuple_(*valores)
+    # literal(): SQLAlchemy no acepta '<' ni '>' contra True/False de Python
+    valores = [literal(v, c.type) for c, v in zip(columnas, valores)]
+    return or_(*[
+        and_(*[c == v for c, v in zip(columnas[:i], valores[:i])],
+             columna < valor if desc else columna > valor)
+        for i, (columna, valor, desc) in enumerate(zip(columnas, valores, direcciones))
+    ])
+
+
+def orden(columnas, descendente=True):
+    return [c.desc() if desc else c.asc() for c, desc in zip(columnas, _direcciones(columnas, descendente))]
+
+
+def cortar_pagina(filas, limite, valores_de):
+    """Recibe hasta limite + 1 filas; devuelve (filas de la página, cursor siguiente o None).
+
+    'valores_de(fila)' entrega los valores de las columnas de orden de una fila.
+    """
+    if len(filas) <= limite:
+        return filas, None
+    filas = filas[:limite]
+    return filas, codificar_cursor(valores_de(filas[-1]))
+
+
+def paginar(consulta, columnas, valores, limite, descendente=True):
+    """Una página de una consulta ORM ('Modelo.query...') ordenada por 'columnas'.
+
+    Devuelve (filas, cursor siguiente o None), igual que cortar_pagina().
+    """
+    filas = consulta.filter(despues_de(columnas, valores, descendente)).order_by(
+        *orden(columnas, descendente)
+    ).limit(limite + 1).all()
+    return cortar_pagina(filas, limite, lambda fila: [getattr(fila, c.key) for c in columnas])
@@ -0,0 +1,246 @@
+# perfilado.py
+# Modo de perfilado opcional (PERFILADO_ACTIVO=1) para encontrar lo que congela el worker.
+#
+# La app corre en un solo worker eventlet: cualquier paso que use la CPU sin ceder
+# el control (generar un QR, calcular un hash de contraseña, armar un CSV) detiene
+# a todos los demás clientes, incluidas las pantallas. Este módulo:
+#   * detecta esos bloqueos con un vigilante en un hilo REAL del sistema operativo,
+#     que sigue corriendo aunque el hub esté detenido y puede capturar, en ese
+#     momento, la pila del código que no suelta el control y la ruta que lo ejecuta;
+#   * perfila con cProfile una muestra de las solicitudes y guarda las que resultan lentas.
+#
+# Todo se escribe como una línea JSON por registro en logs/perfilado.log (rotativo,
+# a través de la bitácora asíncrona).
+# 'flask perfilado-resumen' muestra los peores casos.
+
+import glob
+import json
+import logging
+import os
+import random
+import sys
+import time
+import traceback
+from collections import defaultdict, deque
+
+from flask import g, request
+
+from bitacora import crear_manejador
+
+SIN_SOLICITUD = '(tarea en segundo plano)'
+
+
+def _hilos_nativos():
+    """Módulos 'threading' y 'time' originales, aunque eventlet los haya parchado."""
+    try:
+        from eventlet import patcher
+        return patcher.original('threading'), patcher.original('time')
+    except ImportError:
+        import threading
+        return threading, time
+
+
+def _ruta_de_pila(frame):
+    """Busca, en la pila capturada, el 'environ' WSGI de la solicitud en curso."""
+    while frame is not None:
+        if frame.f_code.co_name == 'wsgi_app':
+            environ = frame.f_locals.get('environ')
+            if isinstance(environ, dict):
+                return f"{environ.get('REQUEST_METHOD', '?')} {environ.get('PATH_INFO', '?')}"
+        frame = frame.f_back
+    return SIN_SOLICITUD
+
+
+class Perfilador:
+    """Detector de bloqueos del hub y perfilador de solicitudes lentas.
+
+    Se inicializa como las demás extensiones (``init_app``). Configuración:
+
+    * ``PERFILADO_ACTIVO``: activa el modo de perfilado (apagado por defecto).
+    * ``PERFILADO_UMBRAL_BLOQUEO_MS``: tiempo sin que el hub responda para registrar un bloqueo.
+    * ``PERFILADO_MUESTREO``: fracción de solicitudes que se perfilan con cProfile.
+    * ``PERFILADO_UMBRAL_LENTO_MS``: duración desde la que se guarda el perfil de una solicitud.
+    * ``PERFILADO_ARCHIVO``: archivo donde se escriben los registros.
+    """
+
+    def __init__(self, app=None):
+        self.activo = False
+        self.raiz = None
+        self.registro = None
+        self.umbral_bloqueo = 0.2
+        self.muestreo = 0.1
+        self.umbral_lento = 0.5
+        self._latido = time.perf_counter()
+        self._bloqueos = deque()  # Los llena el hilo vigilante, los escribe el hub
+        self._perfilando = False
+        self._vigilante = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.activo = app.config.get('PERFILADO_ACTIVO', False)
+        app.extensions['perfilado'] = self
+        if not self.activo:
+            return
+
+        self.raiz = app.root_path
+        self.umbral_bloqueo = app.config.get('PERFILADO_UMBRAL_BLOQUEO_MS', 200) / 1000
+        self.muestreo = app.config.get('PERFILADO_MUESTREO', 0.1)
+        self.umbral_lento = app.config.get('PERFILADO_UMBRAL_LENTO_MS', 500) / 1000
+
+        self.registro = logging.getLogger('perfilado')
+        self.registro.propagate = False
+        self.registro.setLevel(logging.INFO)
+        if not self.registro.handlers:
+            # Se escribe desde un hilo nativo, igual que la bitácora de la app
+            self.registro.addHandler(crear_manejador(
+                app.config.get('PERFILADO_ARCHIVO', 'logs/perfilado.log'),
+                logging.Formatter('%(message)s'), 5 * 1024 * 1024, 5
+            ))
+
+        app.before_request(self._antes_de_solicitud)
+        app.teardown_request(self._al_terminar_solicitud)
+        self._iniciar_vigilante()
+
+    def _escribir(self, **datos):
+        datos['fecha'] = time.strftime('%Y-%m-%dT%H:%M:%S')
+        self.registro.info(json.dumps(datos, ensure_ascii=False))
+
+    # --- DETECCIÓN DE BLOQUEOS DEL HUB ---
+    def _iniciar_vigilante(self):
+        try:
+            import eventlet
+            from eventlet import patcher
+        except ImportError:
+            return
+        # Sin monkey patching (CLI, migraciones) no hay hub que vigilar
+        if self._vigilante is not None or not patcher.is_monkey_patched('thread'):
+            return
+
+        threading_nativo, time_nativo = _hilos_nativos()
+        hilo_del_hub = threading_nativo.get_ident()
+        self._latido = time.perf_counter()
+        eventlet.spawn(self._latir, eventlet.sleep)
+        self._vigilante = threading_nativo.Thread(
+            target=self._vigilar, args=(hilo_del_hub, time_nativo.sleep),
+            name='perfilado-vigilante', daemon=True
+        )
+        self._vigilante.start()
+
+    def _latir(self, dormir):
+        """Green thread: marca que el hub sigue vivo y escribe los bloqueos detectados."""
+        intervalo = self.umbral_bloqueo / 4
+        while True:
+            self._latido = time.perf_counter()
+            while self._bloqueos:
+                self._escribir(tipo='bloqueo', **self._bloqueos.popleft())
+            dormir(intervalo)
+
+    def _vigilar(self, hilo_del_hub, dormir):
+        """Hilo nativo: si el latido se atrasa, captura la pila que tiene tomado el hub."""
+        intervalo = self.umbral_bloqueo / 4
+        bloqueo = None
+        while True:
+            dormir(intervalo)
+            atraso = time.perf_counter() - self._latido
+            if atraso < self.umbral_bloqueo:
+                if bloqueo is not None:
+                    # El hub se liberó: el registro sale con la duración total
+                    bloqueo['duracion_ms'] = round((time.perf_counter() - bloqueo.pop('inicio')) * 1000)
+                    self._bloqueos.append(bloqueo)
+                    bloqueo = None
+                continue
+            if bloqueo is not None:
+                continue
+
+            frame = sys._current_frames().get(hilo_del_hub)
+            if frame is None:
+                continue
+            pila = traceback.extract_stack(frame)
+            bloqueo = {
+                'inicio': self._latido,
+                'ruta': _ruta_de_pila(frame),
+                'ubicacion': self._ubicacion(pila),
+                'pila': traceback.format_list(pila[-15:]),
+            }
+            del frame
+
+    def _ubicacion(self, pila):
+        """Primera línea del código propio (no de librerías) desde lo más interno."""
+        for linea in reversed(pila):
+            if linea.filename.startswith(self.raiz) and 'site-packages' not in linea.filename:
+                return f"{os.path.relpath(linea.filename, self.raiz)}:{linea.lineno} ({linea.name})"
+        linea = pila[-1]
+        return f"{linea.filename}:{linea.lineno} ({linea.name})"
+
+    # --- PERFILES DE SOLICITUDES LENTAS ---
+    def _antes_de_solicitud(self):
+        # cProfile perfila todo el hilo: solo una solicitud a la vez
+        if self._perfilando or random.random() >= self.muestreo:
+            return
+        import cProfile  # Solo con el perfilado activo: no pesa en el arranque normal
+        self._perfilando = True
+        g._perfil = cProfile.Profile()
+        g._perfil_inicio = time.perf_counter()
+        g._perfil.enable()
+
+    def _al_terminar_solicitud(self, error=None):
+        perfil = g.pop('_perfil', None)
+        if perfil is None:
+            return
+        perfil.disable()
+        self._perfilando = False
+        duracion = time.perf_counter() - g.pop('_perfil_inicio')
+        if duracion < self.umbral_lento:
+            return
+
+        import pstats
+        estadisticas = pstats.Stats(perfil).stats
+        funciones = sorted(estadisticas.items(), key=lambda item: item[1][3], reverse=True)[:20]
+        self._escribir(
+            tipo='lenta',
+            ruta=f"{request.method} {request.url_rule.rule if request.url_rule else request.path}",
+            duracion_ms=round(duracion * 1000),
+            funciones=[{
+                'funcion': f"{os.path.basename(archivo)}:{linea}({nombre})",
+                'llamadas': llamadas,
+                'propio_ms': round(propio * 1000, 2),
+                'acumulado_ms': round(acumulado * 1000, 2),
+            } for (archivo, linea, nombre), (_, llamadas, propio, acumulado, _) in funciones],
+        )
+
+
+def resumir(archivo, top=10):
+    """Agrupa los registros de 'archivo' (y sus rotaciones) en los peores casos."""
+    bloqueos = defaultdict(lambda: {'cantidad': 0, 'total_ms': 0, 'max_ms': 0})
+    lentas = defaultdict(lambda: {'cantidad': 0, 'total_ms': 0, 'max_ms': 0})
+    funciones = defaultdict(lambda: {'apariciones': 0, 'propio_ms': 0.0})
+
+    for nombre in sorted(glob.glob(f'{glob.escape(archivo)}*')):
+        with open(nombre, encoding='utf-8') as entrada:
+            for linea in entrada:
+                try:
+                    datos = json.loads(linea)
+                except ValueError:
+                    continue
+                if datos.get('tipo') == 'bloqueo':
+                    grupo = bloqueos[(datos['ruta'], datos['ubicacion'])]
+                elif datos.get('tipo') == 'lenta':
+                    grupo = lentas[datos['ruta']]
+                    for funcion in datos['funciones']:
+                        funciones[funcion['funcion']]['apariciones'] += 1
+                        funciones[funcion['funcion']]['propio_ms'] += funcion['propio_ms']
+                else:
+                    continue
+                grupo['cantidad'] += 1
+                grupo['total_ms'] += datos['duracion_ms']
+                grupo['max_ms'] = max(grupo['max_ms'], datos['duracion_ms'])
+
+    def peores(grupos, clave):
+        return sorted(grupos.items(), key=lambda item: item[1][clave], reverse=True)[:top]
+
+    return {
+        'bloqueos': peores(bloqueos, 'total_ms'),
+        'lentas': peores(lentas, 'total_ms'),
+        'funciones': peores(funciones, 'propio_ms'),
+    }
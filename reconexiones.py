@@ -0,0 +1,201 @@
+# reconexiones.py
+# Reconexiones escalonadas de pantallas, paneles y teléfonos en los reinicios.
+#
+# Al reiniciar el worker (despliegue), todos los sockets se cortaban a la vez y
+# todos los clientes volvían en el mismo segundo contra un worker recién iniciado.
+# Ahora:
+#   * Al recibir SIGTERM, antes de seguir con el apagado normal, se avisa a los
+#     clientes conectados ('reconectar'): cada uno se desconecta y vuelve en un
+#     momento al azar dentro de RECONEXION_VENTANA_S. El proceso espera
+#     RECONEXION_DRENAJE_S para que el aviso alcance a salir.
+#   * Control de admisión: se aceptan como máximo SOCKET_CONEXIONES_POR_S
+#     conexiones nuevas por segundo. Las que exceden esperan su turno en el
+#     servidor (hasta SOCKET_ESPERA_MAX_S); si les toca más tarde, se rechazan
+#     indicando cuándo reintentar. Mientras se drena, se rechazan todas.
+#   * Se mide el tamaño de cada "ola": conexiones nuevas durante los segundos
+#     seguidos en que llegaron más de SOCKET_CONEXIONES_POR_S.
+#
+# El cliente (static/js/reconexion.js) atiende el aviso y los rechazos. El
+# seguimiento móvil no usa sockets: recibe 503 con Retry-After al azar.
+
+import os
+import random
+import signal
+import threading
+import time
+
+from flask_socketio import ConnectionRefusedError
+
+from metricas import encabezado, linea
+
+
+class ControlReconexiones:
+    """Drenaje de sockets al apagar, admisión de conexiones nuevas y medición de las olas.
+
+    Se inicializa como las demás extensiones (``init_app``); el manejador de
+    'connect' llama a ``admitir`` y el de 'disconnect' a ``desconectado``.
+    Configuración:
+
+    * ``RECONEXION_VENTANA_S``: ventana en que los clientes reparten su reconexión.
+    * ``RECONEXION_DRENAJE_S``: segundos entre el aviso y el apagado normal (menos que el graceful timeout de Gunicorn).
+    * ``SOCKET_CONEXIONES_POR_S``: conexiones nuevas aceptadas por segundo (y ráfaga máxima).
+    * ``SOCKET_ESPERA_MAX_S``: cuánto puede esperar su turno una conexión antes de rechazarla.
+    """
+
+    def __init__(self, app=None, **kwargs):
+        self.ventana = 20
+        self.drenaje = 5
+        self.por_segundo = 20
+        self.espera_maxima = 2
+        self.drenando = False
+        self.conectados = 0
+        self._lock = threading.Lock()
+        self._disponibles = 0.0
+        self._ultimo = time.monotonic()
+        self._segundo = 0
+        self._en_segundo = 0
+        self._ola = self._ola_segundos = 0
+        self.ultima_ola = (0, 0)  # (conexiones, segundos)
+        self.ola_maxima = 0
+        self.contadores = {'aceptada': 0, 'diferida': 0, 'rechazada': 0, 'olas': 0}
+        if app is not None:
+            self.init_app(app, **kwargs)
+
+    def init_app(self, app, socketio, al_drenar=None):
+        """'al_drenar()' se llama al empezar el drenaje (p. ej. para soltar los long-poll)."""
+        self.app = app
+        self.socketio = socketio
+        self._al_drenar = al_drenar
+        self.ventana = app.config.get('RECONEXION_VENTANA_S', 20)
+        self.drenaje = app.config.get('RECONEXION_DRENAJE_S', 5)
+        self.por_segundo = app.config.get('SOCKET_CONEXIONES_POR_S', 20)
+        self.espera_maxima = app.config.get('SOCKET_ESPERA_MAX_S', 2)
+        self._disponibles = float(self.por_segundo)
+        app.extensions['reconexiones'] = self
+        self._instalar_senal()
+
+    # --- ADMISIÓN ---
+    def admitir(self):
+        """Deja pasar la conexión, la hace esperar su turno o la rechaza (ConnectionRefusedError)."""
+        self._contar_intento()
+        if self.drenando:
+            self._rechazar(self.reintentar_en())
+        espera = self._reservar_turno()
+        if espera > self.espera_maxima:
+            self._rechazar(espera)
+        if espera > 0:
+            self.contadores['diferida'] += 1
+            self.socketio.sleep(espera)
+        self.contadores['aceptada'] += 1
+        self.conectados += 1
+
+    def desconectado(self):
+        self.conectados = max(0, self.conectados - 1)
+
+    def reintentar_en(self):
+        """Segundos al azar dentro de la ventana, para que los clientes no vuelvan juntos."""
+        return random.uniform(1, max(1, self.ventana))
+
+    def _rechazar(self, segundos):
+        self.contadores['rechazada'] += 1
+        raise ConnectionRefusedError('ocupado', {'reintentar_ms': int(segundos * 1000)})
+
+    def _reservar_turno(self):
+        """Cubeta de fichas: segundos que debe esperar esta conexión (y reserva su ficha si puede esperar)."""
+        with self._lock:
+            ahora = time.monotonic()
+            self._disponibles = min(self.por_segundo,
+                                    self._disponibles + (ahora - self._ultimo) * self.por_segundo)
+            self._ultimo = ahora
+            espera = max(0.0, (1 - self._disponibles) / self.por_segundo)
+            if espera <= self.espera_maxima:
+                self._disponibles -= 1
+            return espera
+
+    # --- OLAS DE RECONEXIÓN ---
+    def _contar_intento(self):
+        with self._lock:
+            self._avanzar(int(time.monotonic()))
+            self._en_segundo += 1
+
+    def _avanzar(self, segundo):
+        """Cierra los segundos ya terminados: los que superan el ritmo se suman a la ola en curso."""
+        if segundo == self._segundo:
+            return
+        if self._en_segundo > self.por_segundo:
+            self._ola += self._en_segundo
+            self._ola_segundos += 1
+        if self._ola and (self._en_segundo <= self.por_segundo or segundo > self._segundo + 1):
+            self.ultima_ola = (self._ola, self._ola_segundos)
+            self.ola_maxima = max(self.ola_maxima, self._ola)
+            self.contadores['olas'] += 1
+            self.app.logger.warning(f'Ola de reconexiones: {self._ola} conexiones nuevas en {self._ola_segundos} s',
+                                    extra={'conexiones': self._ola})
+            self._ola = self._ola_segundos = 0
+        self._segundo, self._en_segundo = segundo, 0
+
+    # --- DRENAJE AL APAGAR ---
+    def _instalar_senal(self):
+        # Solo en el worker eventlet (wsgi.py), no en 'flask db upgrade' ni en la CLI
+        try:
+            from eventlet import patcher
+        except ImportError:
+            return
+        if not patcher.is_monkey_patched('thread'):
+            return
+        # Gunicorn ya instaló su manejador de SIGTERM (apagado ordenado): lo llamamos después del drenaje
+        anterior = signal.getsignal(signal.SIGTERM)
+
+        def al_terminar(signum, frame):
+            if self.drenando:
+                self._seguir_apagado(anterior, signum, frame)
+            else:
+                self.socketio.start_background_task(self._apagar, anterior, signum, frame)
+
+        try:
+            signal.signal(signal.SIGTERM, al_terminar)
+        except ValueError:
+            pass  # Fuera del hilo principal no se pueden instalar manejadores de señales
+
+    def _apagar(self, anterior, signum, frame):
+        self.drenar()
+        self.socketio.sleep(self.drenaje)
+        self._seguir_apagado(anterior, signum, frame)
+
+    @staticmethod
+    def _seguir_apagado(anterior, signum, frame):
+        if callable(anterior):
+            anterior(signum, frame)
+        elif anterior == signal.SIG_DFL:
+            signal.signal(signum, signal.SIG_DFL)
+            os.kill(os.getpid(), signum)
+
+    def drenar(self):
+        """Pide a todos los clientes que se reconecten, cada uno en un momento al azar de la ventana."""
+        if self.drenando:
+            return
+        self.drenando = True
+        self.app.logger.warning(f'Drenando {self.conectados} sockets: reconexión repartida en {self.ventana} s')
+        self.socketio.emit('reconectar', {'ventana_ms': int(self.ventana * 1000)})
+        if self._al_drenar:
+            self._al_drenar()
+
+    def lineas_prometheus(self):
+        with self._lock:
+            self._avanzar(int(time.monotonic()))
+            lineas = encabezado('turnos_socket_conectados', 'gauge', 'Sockets conectados a este proceso.')
+            lineas.append(linea('turnos_socket_conectados', self.conectados))
+            lineas += encabezado('turnos_socket_conexiones_total', 'counter',
+                                 'Conexiones nuevas: aceptadas, diferidas (esperaron su turno) o rechazadas.')
+            for resultado in ('aceptada', 'diferida', 'rechazada'):
+                lineas.append(linea('turnos_socket_conexiones_total', self.contadores[resultado], resultado=resultado))
+            lineas += encabezado('turnos_socket_olas_total', 'counter',
+                                 'Olas de reconexión: segundos seguidos sobre SOCKET_CONEXIONES_POR_S.')
+            lineas.append(linea('turnos_socket_olas_total', self.contadores['olas']))
+            lineas += encabezado('turnos_socket_ola_ultima', 'gauge', 'Conexiones nuevas de la última ola de reconexión.')
+            lineas.append(linea('turnos_socket_ola_ultima', self.ultima_ola[0]))
+            lineas += encabezado('turnos_socket_ola_maxima', 'gauge', 'Conexiones nuevas de la ola más grande.')
+            lineas.append(linea('turnos_socket_ola_maxima', self.ola_maxima))
+            lineas += encabezado('turnos_socket_drenando', 'gauge', '1 mientras el proceso pide a los clientes reconectarse.')
+            lineas.append(linea('turnos_socket_drenando', int(self.drenando)))
+        return lineas
@@ -0,0 +1,123 @@
+# recursos.py
+# Plantillas y archivos estáticos: que un worker nuevo arranque rápido y que los
+# navegadores (pantallas, paneles, teléfonos) no vuelvan a pedir lo que ya tienen.
+#
+#   * Las plantillas Jinja compiladas se guardan en disco (bytecode cache): un
+#     worker recién iniciado no vuelve a compilarlas.
+#   * {% call fragmento(...) %} guarda el HTML de trozos que casi no cambian
+#     (encabezado del funcionario, nombre de su servicio, leyenda de colores de
+#     los servicios en la pantalla) en la caché de vistas.
+#   * url_for('static', ...) agrega la huella (hash) del contenido del archivo; esas
+#     URL se sirven con Cache-Control "immutable" por un año. Si el archivo cambia,
+#     cambia la URL.
+#   * El cliente Socket.IO se sirve desde static/vendor si está descargado
+#     ('flask vendorizar-socketio'); si no, desde la CDN.
+
+import hashlib
+import os
+import urllib.request
+
+from flask import request, url_for
+from jinja2 import FileSystemBytecodeCache
+from markupsafe import Markup
+
+SOCKETIO_CLIENTE = 'vendor/socket.io.min.js'
+SOCKETIO_CDN = 'https://cdn.socket.io/{version}/socket.io.min.js'
+UN_ANO = 365 * 24 * 60 * 60
+
+
+class RecursosEstaticos:
+    """Caché de plantillas compiladas, fragmentos y huellas de los archivos estáticos.
+
+    Se inicializa como las demás extensiones (``init_app``). Configuración:
+
+    * ``PLANTILLAS_CACHE_DIR``: carpeta de las plantillas compiladas (vacío la desactiva).
+    * ``SOCKETIO_CLIENTE_VERSION``: versión del cliente Socket.IO (local o de la CDN).
+    """
+
+    def __init__(self, app=None, **kwargs):
+        self._huellas = {}  # filename -> (mtime, huella)
+        self._cache_vistas = None
+        self.socketio_version = '4.6.1'
+        if app is not None:
+            self.init_app(app, **kwargs)
+
+    def init_app(self, app, cache_vistas):
+        self._cache_vistas = cache_vistas
+        self.socketio_version = app.config.get('SOCKETIO_CLIENTE_VERSION', '4.6.1')
+        app.extensions['recursos'] = self
+
+        carpeta = app.config.get('PLANTILLAS_CACHE_DIR')
+        if carpeta:
+            os.makedirs(carpeta, exist_ok=True)
+            # Debe quedar listo antes de que se cree el entorno Jinja (primer render)
+            app.jinja_options = {**app.jinja_options, 'bytecode_cache': FileSystemBytecodeCache(carpeta)}
+
+        app.url_defaults(self._agregar_huella)
+        app.after_request(self._cache_inmutable)
+        app.add_template_global(self.fragmento)
+        app.add_template_global(self.script_socketio)
+        self._carpeta_estatica = app.static_folder
+
+    # --- HUELLAS DE LOS ARCHIVOS ESTÁTICOS ---
+    def huella(self, filename):
+        """Primeros 12 caracteres del SHA-256 del archivo (se recalcula solo si cambió)."""
+        ruta = os.path.join(self._carpeta_estatica, filename)
+        try:
+            mtime = os.stat(ruta).st_mtime_ns
+        except OSError:
+            return None
+        guardada = self._huellas.get(filename)
+        if guardada and guardada[0] == mtime:
+            return guardada[1]
+        with open(ruta, 'rb') as archivo:
+            huella = hashlib.sha256(archivo.read()).hexdigest()[:12]
+        self._huellas[filename] = (mtime, huella)
+        return huella
+
+    def _agregar_huella(self, endpoint, values):
+        if endpoint == 'static' and 'filename' in values and 'v' not in values:
+            huella = self.huella(values['filename'])
+            if huella:
+                values['v'] = huella
+
+    def _cache_inmutable(self, respuesta):
+        # Solo si la huella coincide: una URL con una huella vieja no debe quedar fija un año
+        if (request.endpoint == 'static' and respuesta.status_code == 200
+                and request.args.get('v') == self.huella(request.view_args['filename'])):
+            respuesta.headers['Cache-Control'] = f'public, max-age={UN_ANO}, immutable'
+        return respuesta
+
+    # --- FRAGMENTOS DE PLANTILLA ---
+    def fragmento(self, clave, *partes, caller):
+        """{% call fragmento('clave', dato1, dato2) %}...{% endcall %}
+
+        El HTML se reutiliza mientras no cambien los datos ni los servicios.
+        """
+        version = '|'.join([self._cache_vistas.version_servicios(), *map(str, partes)])
+        return Markup(self._cache_vistas.fragmento(clave, version, caller))
+
+    # --- CLIENTE SOCKET.IO ---
+    def script_socketio(self):
+        if self.huella(SOCKETIO_CLIENTE):
+            src = url_for('static', filename=SOCKETIO_CLIENTE)
+        else:
+            src = SOCKETIO_CDN.format(version=self.socketio_version)
+        return Markup(f'<script src="{src}"></script>')
+
+    def vendorizar_socketio(self):
+        """Descarga el cliente Socket.IO a static/vendor. Devuelve la ruta y los bytes escritos.
+
+        Lanza una excepción si la descarga falla o no es el cliente de esa versión
+        (así falla el build); el archivo anterior, si lo hay, queda intacto.
+        """
+        ruta = os.path.join(self._carpeta_estatica, SOCKETIO_CLIENTE)
+        with urllib.request.urlopen(SOCKETIO_CDN.format(version=self.socketio_version), timeout=30) as respuesta:
+            contenido = respuesta.read()
+        if f'Socket.IO v{self.socketio_version}'.encode() not in contenido[:500]:
+            raise RuntimeError(f"La descarga no es el cliente Socket.IO {self.socketio_version} ({len(contenido)} bytes).")
+        os.makedirs(os.path.dirname(ruta), exist_ok=True)
+        with open(ruta + '.tmp', 'wb') as archivo:
+            archivo.write(contenido)
+        os.replace(ruta + '.tmp', ruta)
+        return ruta, len(contenido)
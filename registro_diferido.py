@@ -0,0 +1,319 @@
+# registro_diferido.py
+# Registro de tickets con escritura diferida ("write-behind"), para las olas de
+# registros en los kioscos (p. ej. cuando termina una clase).
+#
+# En el camino normal cada POST a /registro lee y actualiza el contador del
+# servicio y hace su propio commit antes de responder. Con REGISTRO_DIFERIDO=1:
+#   * el número (M-A05) y el id del ticket se asignan en memoria, bajo un lock,
+#     y el kiosco recibe su ticket de inmediato;
+#   * un green thread escribe los pendientes cada REGISTRO_DIFERIDO_INTERVALO_MS
+#     con un INSERT de varias filas, sus eventos de registro y el contador final
+#     de cada servicio, todo en UNA transacción; recién entonces se avisa a los
+#     paneles.
+#
+# Durabilidad (ver también el README):
+#   * Un ticket confirmado al kiosco todavía no está en la base. Si el proceso
+#     muere de golpe se pierde lo registrado en el último intervalo y el lote que
+#     se estaba escribiendo; esos números se volverán a entregar. Al terminar de
+#     forma ordenada (atexit) se escribe lo pendiente.
+#   * Si la base de datos falla, los pendientes se quedan en memoria y se
+#     reintentan con espera creciente. Sobre REGISTRO_DIFERIDO_MAX_PENDIENTES se
+#     rechazan los registros nuevos (el kiosco pide intentar de nuevo).
+#   * Tickets y contador se escriben juntos: la base nunca queda con el contador
+#     detrás de tickets ya escritos.
+#   * Al arrancar, el contador de cada servicio se reconcilia con la tabla
+#     'ticket' la primera vez que se usa: si el número que toca ya lo tiene un
+#     ticket de hoy, se sigue desde el último ticket de hoy de ese servicio.
+#   * Los ids se reservan por bloques de la secuencia en PostgreSQL; en SQLite se
+#     cuentan en memoria desde el máximo actual, así que entonces solo este
+#     proceso debe registrar tickets.
+
+import atexit
+import threading
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime
+
+from sqlalchemy import func, insert, select, text, update
+from sqlalchemy.exc import IntegrityError
+
+from metricas import encabezado, linea
+
+
+def siguiente_numero(letra, numero):
+    """Número que sigue a letra+numero en el ciclo A00..A99, B00..E99, A00..."""
+    numero += 1
+    if numero > 99:
+        numero = 0
+        letra = chr(ord(letra) + 1)
+        if letra > 'E':
+            letra = 'A'
+    return letra, numero
+
+
+class RegistroDiferido:
+    """Asigna los números en memoria y escribe los tickets por lotes en segundo plano.
+
+    Se inicializa como las demás extensiones (``init_app``) y solo se activa en
+    el worker eventlet. Configuración:
+
+    * ``REGISTRO_DIFERIDO``: activa el modo (apagado por defecto).
+    * ``REGISTRO_DIFERIDO_INTERVALO_MS``: cuánto se juntan registros antes de escribirlos.
+    * ``REGISTRO_DIFERIDO_LOTE_MAX``: tickets por INSERT (y por transacción).
+    * ``REGISTRO_DIFERIDO_MAX_PENDIENTES``: sobre esta cantidad sin escribir, se rechazan registros.
+    * ``REGISTRO_DIFERIDO_BLOQUE_IDS``: ids que se reservan de la secuencia en cada consulta (PostgreSQL).
+    """
+
+    def __init__(self, app=None, **kwargs):
+        self.activo = False
+        self.intervalo = 0.005
+        self.lote_maximo = 200
+        self.max_pendientes = 2000
+        self.bloque_ids = 100
+        self.iniciado = False
+        # Contadores, ids y cola; reentrante para que 'pausa' pueda escribir lo pendiente
+        self._lock = threading.RLock()
+        self._escritura = threading.Lock()  # Un solo lote escribiéndose a la vez
+        self._contadores = {}
+        self._reconciliados = set()
+        self._ids = deque()
+        self._ultimo_id = None
+        self._pendientes = deque()
+        self._hay_pendientes = None
+        self.estadisticas = {'lotes': 0, 'tickets': 0, 'errores': 0, 'perdidos': 0, 'rechazados': 0}
+        if app is not None:
+            self.init_app(app, **kwargs)
+
+    def init_app(self, app, socketio, db, servicio, ticket, archivo, en_transaccion=None, al_escribir=None,
+                 reloj=None):
+        """'servicio', 'ticket' y 'archivo' son los modelos Servicio, Ticket y TicketArchive.
+
+        'en_transaccion(filas)' agrega lo que deba escribirse junto con los tickets
+        (sus eventos); 'al_escribir(filas, colores)' avisa después del commit.
+        'reloj()' entrega la hora de Chile, para saber qué tickets son de hoy.
+        """
+        self.app = app
+        self.socketio = socketio
+        self.db = db
+        self.Servicio = servicio
+        self.Ticket = ticket
+        self.Archivo = archivo
+        self._en_transaccion = en_transaccion
+        self._al_escribir = al_escribir
+        self._reloj = reloj or datetime.now
+        self.intervalo = app.config.get('REGISTRO_DIFERIDO_INTERVALO_MS', 5) / 1000
+        self.lote_maximo = app.config.get('REGISTRO_DIFERIDO_LOTE_MAX', 200)
+        self.max_pendientes = app.config.get('REGISTRO_DIFERIDO_MAX_PENDIENTES', 2000)
+        self.bloque_ids = app.config.get('REGISTRO_DIFERIDO_BLOQUE_IDS', 100)
+        app.extensions['registro_diferido'] = self
+        if app.config.get('REGISTRO_DIFERIDO', False):
+            self._iniciar()
+
+    # --- ASIGNACIÓN EN MEMORIA ---
+    def registrar(self, servicio_id, **columnas):
+        """Asigna número e id al ticket y lo deja pendiente de escritura.
+
+        'columnas' son las del ticket que pone la solicitud (rut_cliente,
+        es_preferencial, registrado_por_id, hora_registro). Devuelve el Ticket,
+        todavía sin guardar, o None si hay demasiados pendientes.
+        """
+        with self._lock:
+            if len(self._pendientes) >= self.max_pendientes:
+                self.estadisticas['rechazados'] += 1
+                return None
+            contador = self._contadores.get(servicio_id)
+            if contador is None:
+                contador = self._contadores[servicio_id] = self._cargar_contador(servicio_id)
+            letra, numero = contador['letra'], contador['numero']
+            contador['letra'], contador['numero'] = siguiente_numero(letra, numero)
+            fila = dict(
+                columnas,
+                id=self._siguiente_id(),
+                numero_ticket=f"{contador['prefijo']}-{letra}{numero:02d}",
+                modulo_solicitado=contador['nombre'],
+                servicio_id=servicio_id,
+                sede_id=contador['sede_id'],
+                estado='en_espera',
+            )
+            self._pendientes.append((fila, (contador['letra'], contador['numero']), contador['color_hex']))
+        self._hay_pendientes.set()
+        return self.Ticket(**fila)
+
+    def _cargar_contador(self, servicio_id):
+        servicio = self.db.session.get(self.Servicio, servicio_id)
+        contador = {
+            'letra': servicio.letra_actual, 'numero': servicio.numero_actual,
+            'prefijo': servicio.prefijo_ticket, 'nombre': servicio.nombre_modulo,
+            'color_hex': servicio.color_hex, 'sede_id': servicio.sede_id,
+        }
+        if servicio_id not in self._reconciliados:
+            self._reconciliar(servicio_id, contador)
+            self._reconciliados.add(servicio_id)
+        return contador
+
+    def _reconciliar(self, servicio_id, contador):
+        """Tras un arranque: si el número que toca ya lo tiene un ticket de hoy, sigue desde el último."""
+        hoy = datetime.combine(self._reloj().date(), datetime.min.time())
+        de_hoy = (self.Ticket.servicio_id == servicio_id, self.Ticket.hora_registro >= hoy)
+        numero = f"{contador['prefijo']}-{contador['letra']}{contador['numero']:02d}"
+        usado = self.db.session.execute(
+            select(self.Ticket.id).where(*de_hoy, self.Ticket.numero_ticket == numero).limit(1)
+        ).first()
+        if usado is None:
+            return
+        ultimo = self.db.session.execute(
+            select(self.Ticket.numero_ticket).where(*de_hoy).order_by(self.Ticket.id.desc()).limit(1)
+        ).scalar()
+        contador['letra'], contador['numero'] = siguiente_numero(ultimo[-3], int(ultimo[-2:]))
+        self.app.logger.warning(f"Contador del servicio {servicio_id} reconciliado: {numero} ya estaba "
+                                f"entregado hoy, se sigue desde {ultimo}")
+
+    def _siguiente_id(self):
+        if not self._ids:
+            if self.db.engine.dialect.name == 'postgresql':
+                # Bloque de la secuencia: los ids ya no se repiten aunque haya otros procesos
+                self._ids.extend(self.db.session.execute(
+                    text("SELECT nextval(pg_get_serial_sequence(:tabla, 'id')) FROM generate_series(1, :n)"),
+                    {'tabla': self.Ticket.__tablename__, 'n': self.bloque_ids}
+                ).scalars())
+            else:
+                if self._ultimo_id is None:
+                    # Los tickets archivados conservan su id: tampoco se deben repetir
+                    self._ultimo_id = max(
+                        self.db.session.execute(select(func.max(self.Ticket.id))).scalar() or 0,
+                        self.db.session.execute(select(func.max(self.Archivo.id))).scalar() or 0,
+                    )
+                self._ultimo_id += 1
+                return self._ultimo_id
+        return self._ids.popleft()
+
+    @contextmanager
+    def pausa(self, servicio_id=None):
+        """Detiene los registros (de todos los servicios) mientras se cambia un contador o sus datos.
+
+        Escribe lo pendiente antes de entrar y, al salir, olvida el contador del
+        servicio (o todos, sin 'servicio_id') para volver a leerlo de la base.
+        """
+        if not self.activo:
+            yield
+            return
+        with self._escritura, self._lock:
+            self._escribir_pendientes()
+            try:
+                yield
+            finally:
+                if servicio_id is None:
+                    self._contadores.clear()
+                else:
+                    self._contadores.pop(servicio_id, None)
+
+    # --- ESCRITURA POR LOTES ---
+    def _iniciar(self):
+        # Solo en el worker eventlet (wsgi.py), no en 'flask db upgrade' ni en la CLI
+        try:
+            from eventlet import patcher
+        except ImportError:
+            return
+        if self.iniciado or not patcher.is_monkey_patched('thread'):
+            return
+        self.iniciado = self.activo = True
+        self._hay_pendientes = self.socketio.server.eio.create_event()
+        self.socketio.start_background_task(self._bucle)
+        atexit.register(self._al_salir)
+
+    def _bucle(self):
+        espera_error = self.intervalo
+        while True:
+            self._hay_pendientes.wait()
+            self._hay_pendientes.clear()
+            if len(self._pendientes) < self.lote_maximo:
+                self.socketio.sleep(self.intervalo)  # Juntamos los registros de la ráfaga
+            with self.app.app_context():
+                try:
+                    self.vaciar()
+                    espera_error = self.intervalo
+                except Exception:
+                    self.db.session.rollback()
+                    self.estadisticas['errores'] += 1
+                    self.app.logger.exception(f'Error al escribir {len(self._pendientes)} tickets pendientes; '
+                                              f'se reintenta en {espera_error:.2f} s')
+                    self.socketio.sleep(espera_error)
+                    espera_error = min(espera_error * 2, 5)
+                    self._hay_pendientes.set()
+
+    def _al_salir(self):
+        if self._pendientes:
+            with self.app.app_context():
+                self.vaciar()
+
+    def vaciar(self):
+        """Escribe todo lo pendiente. Si la base falla, lo no escrito vuelve a la cola y se propaga el error."""
+        with self._escritura:
+            self._escribir_pendientes()
+
+    def _escribir_pendientes(self):
+        while True:
+            with self._lock:
+                lote = [self._pendientes.popleft() for _ in range(min(self.lote_maximo, len(self._pendientes)))]
+            if not lote:
+                return
+            try:
+                self._escribir(lote)
+            except Exception:
+                with self._lock:
+                    self._pendientes.extendleft(reversed(lote))
+                raise
+
+    def _escribir(self, lote):
+        """Escribe el lote en una transacción. 'lote' se vacía a medida que queda escrito."""
+        try:
+            self._insertar(lote)
+        except IntegrityError:
+            # Algún ticket choca (p. ej. un id ya usado por otro proceso): de a uno, para salvar el resto
+            self.db.session.rollback()
+            self.app.logger.exception('Lote de registros rechazado; se escribe de a un ticket')
+            while lote:
+                try:
+                    self._insertar(lote[:1])
+                except IntegrityError:
+                    self.db.session.rollback()
+                    self.estadisticas['perdidos'] += 1
+                    self.app.logger.error(f"Ticket {lote[0][0]['numero_ticket']} no se pudo guardar y se perdió",
+                                          extra={'ticket_id': lote[0][0]['id']})
+                del lote[0]
+            return
+        lote.clear()
+
+    def _insertar(self, lote):
+        filas = [fila for fila, _, _ in lote]
+        # El contador queda en el valor que sigue al último ticket del lote de cada servicio
+        contadores = {fila['servicio_id']: siguiente for fila, siguiente, _ in lote}
+        self.db.session.execute(insert(self.Ticket), filas)
+        if self._en_transaccion:
+            self._en_transaccion(filas)
+        for servicio_id, (letra, numero) in contadores.items():
+            self.db.session.execute(update(self.Servicio).where(self.Servicio.id == servicio_id)
+                                    .values(letra_actual=letra, numero_actual=numero))
+        self.db.session.commit()
+        self.estadisticas['lotes'] += 1
+        self.estadisticas['tickets'] += len(filas)
+        colores = {fila['servicio_id']: color for fila, _, color in lote}
+        if self._al_escribir:
+            try:
+                self._al_escribir(filas, colores)
+            except Exception:
+                # Los tickets ya están guardados: un aviso fallido no debe reintentar la escritura
+                self.app.logger.exception('Error al avisar los tickets registrados')
+
+    def lineas_prometheus(self):
+        lineas = encabezado('turnos_registro_diferido_pendientes', 'gauge',
+                            'Tickets confirmados al kiosco que todavía no están en la base de datos.')
+        lineas.append(linea('turnos_registro_diferido_pendientes', len(self._pendientes)))
+        for nombre, ayuda in (('lotes', 'Lotes de tickets escritos.'),
+                              ('tickets', 'Tickets escritos por lotes.'),
+                              ('errores', 'Escrituras fallidas que se reintentaron.'),
+                              ('perdidos', 'Tickets confirmados que no se pudieron guardar.'),
+                              ('rechazados', 'Registros rechazados por exceso de pendientes.')):
+            lineas += encabezado(f'turnos_registro_diferido_{nombre}_total', 'counter', ayuda)
+            lineas.append(linea(f'turnos_registro_diferido_{nombre}_total', self.estadisticas[nombre]))
+        return lineas
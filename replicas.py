@@ -0,0 +1,98 @@
+# replicas.py
+# Enrutamiento opcional de las lecturas pesadas a una réplica de la base de datos.
+#
+# Si se configura REPLICA_DATABASE_URL, las vistas marcadas con @lectura_en_replica
+# (reportes, dashboard, pantalla pública, seguimiento móvil) leen de la réplica y
+# dejan la base principal libre para 'registro' y 'llamar_siguiente'.
+# Todo lo demás, y cualquier escritura, sigue yendo a la base principal.
+#
+# Protecciones contra datos atrasados:
+#   * si la réplica (PostgreSQL) va más de REPLICA_MAX_RETRASO_S segundos atrasada,
+#     se lee de la principal;
+#   * con 'en_primaria()' una vista puede volver a consultar la principal, por
+#     ejemplo cuando un ticket recién registrado todavía no llega a la réplica.
+
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+from flask import current_app, g, has_app_context
+from flask_sqlalchemy.session import Session
+from sqlalchemy import text
+
+CLAVE_REPLICA = 'replica'
+
+
+class SesionConReplica(Session):
+    """Sesión que entrega la réplica como 'bind' mientras la vista lo permita."""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and _leer_de_replica(self):
+            return self._db.engines[CLAVE_REPLICA]
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+def _leer_de_replica(sesion):
+    if not has_app_context() or not g.get('_usar_replica'):
+        return False
+    # Con cambios pendientes se usa la principal: la réplica no acepta escrituras
+    if sesion._flushing or sesion.new or sesion.dirty or sesion.deleted:
+        return False
+    return CLAVE_REPLICA in sesion._db.engines and replica_al_dia()
+
+
+_estado_replica = {'revisado': 0.0, 'al_dia': True}
+
+
+def replica_al_dia():
+    """Revisa (como máximo cada 5 s) que la réplica no esté demasiado atrasada."""
+    ahora = time.monotonic()
+    if ahora - _estado_replica['revisado'] < 5:
+        return _estado_replica['al_dia']
+    _estado_replica['revisado'] = ahora
+
+    motor = current_app.extensions['sqlalchemy'].engines[CLAVE_REPLICA]
+    if motor.dialect.name != 'postgresql':
+        return True  # Réplicas de prueba (otro archivo SQLite): no hay retraso que medir
+    try:
+        with motor.connect() as conexion:
+            retraso = conexion.execute(text(
+                "SELECT EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())"
+            )).scalar()
+    except Exception:
+        current_app.logger.exception("No se pudo consultar el retraso de la réplica")
+        _estado_replica['al_dia'] = False
+        return False
+
+    # NULL: no es una réplica en recuperación (o aún no replica nada); se usa igual
+    _estado_replica['al_dia'] = retraso is None or retraso <= current_app.config['REPLICA_MAX_RETRASO_S']
+    if not _estado_replica['al_dia']:
+        current_app.logger.warning(f"Réplica atrasada {retraso:.1f} s: se lee de la base principal")
+    return _estado_replica['al_dia']
+
+
+def lectura_en_replica(f):
+    """Las consultas de la vista van a la réplica, si hay una configurada.
+
+    Debe ir debajo de @login_required / @role_required para que el usuario
+    se cargue desde la base principal.
+    """
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        g._usar_replica = True
+        try:
+            return f(*args, **kwargs)
+        finally:
+            g._usar_replica = False
+    return decorated_function
+
+
+@contextmanager
+def en_primaria():
+    """Dentro del bloque, las consultas vuelven a la base principal."""
+    anterior = g.get('_usar_replica', False)
+    g._usar_replica = False
+    try:
+        yield
+    finally:
+        g._usar_replica = anterior
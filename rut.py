@@ -0,0 +1,42 @@
+# rut.py
+# RUT chileno: validación y forma normalizada.
+#
+# Los tickets guardan el RUT como 'NNNNNNNN-D' (sin puntos, sin ceros a la
+# izquierda y con 'K' mayúscula). Así, un mismo estudiante siempre queda con el
+# mismo texto y su historial se busca por igualdad en un índice, sin importar si
+# se digitó '12.345.678-5', '12345678-5' o '123456785'.
+
+
+def digito_verificador(numero):
+    """Dígito verificador (módulo 11) del número de un RUT."""
+    suma, factor = 0, 2
+    for digito in reversed(str(numero)):
+        suma += int(digito) * factor
+        factor = 2 if factor == 7 else factor + 1
+    resto = 11 - suma % 11
+    return {11: '0', 10: 'K'}.get(resto, str(resto))
+
+
+def limpiar_rut(texto):
+    """Quita puntos, guiones, espacios y ceros a la izquierda; no valida."""
+    limpio = ''.join(c for c in (texto or '') if c not in '.- ').upper().lstrip('0')
+    return f'{limpio[:-1]}-{limpio[-1]}' if len(limpio) > 1 else limpio
+
+
+def normalizar_rut(texto):
+    """Devuelve el RUT como 'NNNNNNNN-D'. ValueError si el formato o el dígito no son válidos."""
+    rut = limpiar_rut(texto)
+    numero, _, dv = rut.partition('-')
+    if not numero.isdigit() or len(numero) > 8 or len(dv) != 1:
+        raise ValueError(f"'{texto}' no tiene el formato de un RUT.")
+    if digito_verificador(numero) != dv:
+        raise ValueError(f"El dígito verificador de '{texto}' no es válido.")
+    return rut
+
+
+def formatear_rut(rut):
+    """'12345678-5' -> '12.345.678-5' (para mostrar)."""
+    numero, guion, dv = (rut or '').partition('-')
+    if not numero.isdigit():
+        return rut
+    return f'{int(numero):,}'.replace(',', '.') + guion + dv
@@ -0,0 +1,177 @@
+# sqlite_produccion.py
+# Modo SQLite para sedes pequeñas de un solo servidor.
+#
+# Con la configuración por omisión de SQLite (diario 'rollback'), mientras otra
+# conexión lee nadie puede confirmar una escritura, y dos escrituras a la vez
+# terminan en "database is locked". Bajo eventlet es peor: la espera de SQLite
+# por un bloqueo es un sleep en C que detiene el hub completo, y el green thread
+# que tiene el bloqueo no puede avanzar para soltarlo.
+#
+# Con SQLITE_MODO_PRODUCCION (activo por defecto si la base es un archivo SQLite):
+#   * Cada conexión nueva usa journal_mode=WAL (lectores y escritor no se
+#     bloquean entre sí), busy_timeout=SQLITE_BUSY_TIMEOUT_MS, synchronous=NORMAL
+#     y mmap_size=SQLITE_MMAP_MB. Con synchronous=NORMAL en WAL la base nunca
+#     queda corrupta, pero un corte de luz puede deshacer las últimas
+#     transacciones confirmadas (no una caída del proceso).
+#   * Las escrituras del proceso pasan de a una: antes del primer INSERT, UPDATE
+#     o DELETE de una transacción se pide turno en una fila (un candado green, en
+#     orden de llegada) y el turno se suelta al confirmar o deshacer. Registros,
+#     llamados y finalizaciones esperan así cediendo el hub, no dentro de SQLite.
+#
+# Requisitos: un solo proceso escribe en el archivo (un worker, como en
+# producción), el archivo está en un disco local (WAL usa memoria compartida) y
+# la tabla 'ticket' tiene AUTOINCREMENT (migración f3c9a1d8e274): sin él, al
+# archivarse los tickets se volverían a entregar sus ids. Si falta, se avisa
+# en la bitácora al iniciar.
+
+import re
+import threading
+import time
+
+from sqlalchemy import event, text
+from sqlalchemy.engine import make_url
+
+from conexiones import LIMITES_ESPERA
+from metricas import Histograma, encabezado, lineas_histograma, linea
+
+_ESCRITURA = re.compile(r'\s*(INSERT|UPDATE|DELETE|REPLACE)\b', re.IGNORECASE)
+_CLAVE = '_sqlite_escritor'
+
+
+def es_sqlite_en_archivo(uri):
+    url = make_url(uri)
+    return url.get_backend_name() == 'sqlite' and url.database not in (None, '', ':memory:')
+
+
+def ids_de_ticket_reutilizables(conexion):
+    """True si la base puede volver a entregar ids de tickets ya archivados.
+
+    Pasa en SQLite mientras 'ticket' no tenga AUTOINCREMENT (falta 'flask db upgrade'):
+    al vaciarse la tabla, los ids nuevos chocarían con los de 'ticket_archive'.
+    """
+    if conexion.dialect.name != 'sqlite':
+        return False
+    sql = conexion.execute(text("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'ticket'")).scalar()
+    return bool(sql) and 'AUTOINCREMENT' not in sql.upper()
+
+
+class ModoSQLite:
+    """PRAGMAs de producción y fila única de escritores para una base SQLite en archivo.
+
+    Se inicializa después de ``db.init_app`` (necesita el motor). Configuración:
+
+    * ``SQLITE_MODO_PRODUCCION``: activa el modo (solo tiene efecto con SQLite en archivo).
+    * ``SQLITE_BUSY_TIMEOUT_MS``: cuánto espera SQLite un bloqueo de otro proceso antes de fallar.
+    * ``SQLITE_MMAP_MB``: megabytes del archivo que se leen con memoria mapeada (0 la desactiva).
+    """
+
+    def __init__(self, app=None, **kwargs):
+        self.activo = False
+        self.busy_timeout_ms = 5000
+        self.mmap_mb = 64
+        self._candado = threading.Lock()
+        self._dueno = None
+        self._profundidad = 0
+        self._estadisticas_lock = threading.Lock()
+        self.esperas = Histograma(LIMITES_ESPERA)
+        self.esperando = 0
+        self.escrituras = 0
+        self.bloqueos = 0
+        if app is not None:
+            self.init_app(app, **kwargs)
+
+    def init_app(self, app, db):
+        self.busy_timeout_ms = app.config.get('SQLITE_BUSY_TIMEOUT_MS', 5000)
+        self.mmap_mb = app.config.get('SQLITE_MMAP_MB', 64)
+        app.extensions['modo_sqlite'] = self
+        self.activo = (app.config.get('SQLITE_MODO_PRODUCCION', True)
+                       and es_sqlite_en_archivo(app.config['SQLALCHEMY_DATABASE_URI']))
+        if not self.activo:
+            return
+        with app.app_context():
+            motor = db.engine
+        event.listen(motor, 'connect', self._configurar_conexion)
+        event.listen(motor, 'before_cursor_execute', self._antes_de_consulta)
+        event.listen(motor, 'commit', self._fin_de_transaccion)
+        event.listen(motor, 'rollback', self._fin_de_transaccion)
+        event.listen(motor, 'checkin', self._al_devolver)
+        event.listen(motor, 'handle_error', self._al_fallar)
+
+        with motor.connect() as conexion:
+            reutilizables = ids_de_ticket_reutilizables(conexion)
+        if reutilizables:
+            app.logger.warning("La tabla 'ticket' de SQLite no tiene AUTOINCREMENT: los ids de los tickets "
+                               "archivados se volverían a entregar. Ejecute 'flask db upgrade'.")
+
+    # --- PRAGMAS ---
+    def _configurar_conexion(self, conexion_dbapi, registro):
+        cursor = conexion_dbapi.cursor()
+        try:
+            cursor.execute('PRAGMA journal_mode=WAL')
+            cursor.execute(f'PRAGMA busy_timeout={int(self.busy_timeout_ms)}')
+            cursor.execute('PRAGMA synchronous=NORMAL')
+            cursor.execute(f'PRAGMA mmap_size={int(self.mmap_mb) * 1024 * 1024}')
+        finally:
+            cursor.close()
+
+    # --- FILA DE ESCRITORES ---
+    def _antes_de_consulta(self, conn, cursor, statement, parameters, context, executemany):
+        if not conn.info.get(_CLAVE) and _ESCRITURA.match(statement):
+            self._tomar_turno()
+            conn.info[_CLAVE] = True
+
+    def _tomar_turno(self):
+        yo = threading.get_ident()
+        # El mismo green thread con otra conexión (p. ej. un engine.connect() dentro
+        # de la solicitud) ya tiene el turno: esperarlo sería esperarse a sí mismo
+        if self._dueno == yo:
+            self._profundidad += 1
+            return
+        inicio = time.perf_counter()
+        with self._estadisticas_lock:
+            self.esperando += 1
+        try:
+            self._candado.acquire()
+        finally:
+            with self._estadisticas_lock:
+                self.esperando -= 1
+                self.esperas.observar(time.perf_counter() - inicio)
+                self.escrituras += 1
+        self._dueno, self._profundidad = yo, 1
+
+    def _soltar_turno(self, info):
+        if not info.pop(_CLAVE, False):
+            return
+        self._profundidad -= 1
+        if self._profundidad <= 0:
+            self._dueno, self._profundidad = None, 0
+            # Se suelta justo antes del COMMIT/ROLLBACK en C: el siguiente en la fila
+            # recién corre cuando este green thread ceda el hub, ya confirmado
+            self._candado.release()
+
+    def _fin_de_transaccion(self, conn):
+        self._soltar_turno(conn.info)
+
+    def _al_devolver(self, conexion_dbapi, registro):
+        # Conexión devuelta al pool sin commit ni rollback explícitos (el pool la deshace)
+        self._soltar_turno(registro.info)
+
+    def _al_fallar(self, contexto):
+        if 'database is locked' in str(contexto.original_exception):
+            with self._estadisticas_lock:
+                self.bloqueos += 1
+
+    def lineas_prometheus(self):
+        if not self.activo:
+            return []
+        with self._estadisticas_lock:
+            lineas = encabezado('turnos_sqlite_escritura_espera_segundos', 'histogram',
+                                'Tiempo esperando el turno de escritura en la base SQLite.')
+            lineas += lineas_histograma('turnos_sqlite_escritura_espera_segundos', self.esperas)
+            lineas += encabezado('turnos_sqlite_escrituras_total', 'counter', 'Transacciones que escribieron en la base SQLite.')
+            lineas.append(linea('turnos_sqlite_escrituras_total', self.escrituras))
+            lineas += encabezado('turnos_sqlite_escritura_esperando', 'gauge', 'Transacciones esperando su turno de escritura.')
+            lineas.append(linea('turnos_sqlite_escritura_esperando', self.esperando))
+            lineas += encabezado('turnos_sqlite_bloqueada_total', 'counter', 'Consultas que fallaron con "database is locked".')
+            lineas.append(linea('turnos_sqlite_bloqueada_total', self.bloqueos))
+        return lineas
@@ -0,0 +1,36 @@
+// static/js/reconexion.js
+// Conexión Socket.IO de pantallas y paneles, con reconexión escalonada (ver reconexiones.py).
+
+function conectarSocket() {
+    var socket = io({
+        // Si la conexión se corta sin aviso, el primer reintento ya lleva azar y los
+        // siguientes se espacian, para no llegar todos juntos al worker nuevo
+        reconnectionDelay: 2000,
+        reconnectionDelayMax: 30000,
+        randomizationFactor: 0.9
+    });
+
+    function volverEn(ms) {
+        socket.io.reconnection(false);
+        socket.disconnect();
+        setTimeout(function() {
+            socket.io.reconnection(true);
+            socket.connect();
+        }, ms);
+    }
+
+    // El servidor se va a reiniciar: volvemos en un momento al azar de su ventana
+    socket.on('reconectar', function(datos) {
+        console.log('El servidor se reinicia: reconexión en un momento al azar.');
+        volverEn(Math.random() * datos.ventana_ms);
+    });
+
+    // Conexión rechazada por exceso de conexiones nuevas: reintentamos cuando indica el servidor (con azar)
+    socket.on('connect_error', function(err) {
+        if (err.data && err.data.reintentar_ms) {
+            volverEn(err.data.reintentar_ms * (0.5 + Math.random()));
+        }
+    });
+
+    return socket;
+}
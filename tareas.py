@@ -0,0 +1,343 @@
+# tareas.py
+# Tareas programadas dentro de la app (reinicio nocturno, archivo, resúmenes...).
+#
+# Cada tarea tiene un horario tipo cron ("minuto hora día mes día_semana", en hora
+# de Chile). Un green thread revisa cada PROGRAMADOR_INTERVALO_S segundos si a
+# alguna le toca y la ejecuta en su propio green thread, así una tarea larga no
+# detiene al programador ni a las solicitudes (las tareas ceden el turno entre lotes).
+#
+# Si hay más de un proceso (p. ej. durante un despliegue), solo uno ejecuta las
+# tareas: el líder, el que tiene la fila 'programador' de 'bloqueo_programador'.
+# El líder renueva su plazo en cada vuelta; si muere, otro toma la fila cuando el
+# plazo vence. Además, cada ejecución se registra en 'ejecucion_tarea' con una
+# restricción única (tarea, hora programada): aunque dos procesos se creyeran
+# líderes a la vez, una misma ejecución no se repite. Ese registro es también el
+# historial que muestra el dashboard. Las ejecuciones a mano ('flask ejecutar-tarea')
+# quedan en el historial con la instancia 'manual:...', pero no mueven el horario.
+
+import os
+import secrets
+import socket
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import or_, update
+from sqlalchemy.exc import IntegrityError
+
+NOMBRE_BLOQUEO = 'programador'
+# Prefijo de la instancia de las ejecuciones a mano: no cuentan para el horario
+MANUAL = 'manual'
+
+# (mínimo, máximo) de cada campo: minuto, hora, día del mes, mes, día de la semana (0 = domingo)
+_CAMPOS = ((0, 59), (0, 23), (1, 31), (1, 12), (0, 6))
+
+
+class Cron:
+    """Horario con la sintaxis de cron: '*', listas (1,15), rangos (1-5) y pasos (*/10, 8-18/2).
+
+    Como en cron, si se restringen tanto el día del mes como el de la semana,
+    basta con que se cumpla uno de los dos. El 7 también es domingo.
+    """
+
+    def __init__(self, expresion):
+        self.expresion = expresion
+        partes = expresion.split()
+        if len(partes) != 5:
+            raise ValueError(f"Horario '{expresion}': se esperan 5 campos (minuto hora día mes día_semana)")
+        (self.minutos, self.horas, self.dias, self.meses, self.dias_semana) = [
+            self._campo(parte, minimo, maximo + (1 if i == 4 else 0))
+            for i, (parte, (minimo, maximo)) in enumerate(zip(partes, _CAMPOS))
+        ]
+        self.dias_semana = {d % 7 for d in self.dias_semana}
+        self._todo_dia = partes[2] == '*'
+        self._toda_semana = partes[4] == '*'
+
+    def _campo(self, texto, minimo, maximo):
+        valores = set()
+        for elemento in texto.split(','):
+            rango, _, paso = elemento.partition('/')
+            try:
+                paso = int(paso) if paso else 1
+                if rango == '*':
+                    inicio, fin = minimo, maximo
+                elif '-' in rango:
+                    inicio, fin = (int(v) for v in rango.split('-', 1))
+                else:
+                    inicio = int(rango)
+                    fin = maximo if paso != 1 or '/' in elemento else inicio
+            except ValueError:
+                raise ValueError(f"Horario '{self.expresion}': campo '{texto}' no válido") from None
+            if paso < 1 or not minimo <= inicio <= fin <= maximo:
+                raise ValueError(f"Horario '{self.expresion}': '{elemento}' fuera de rango ({minimo}-{maximo})")
+            valores.update(range(inicio, fin + 1, paso))
+        return valores
+
+    def _dia_coincide(self, momento):
+        en_mes = momento.day in self.dias
+        en_semana = (momento.isoweekday() % 7) in self.dias_semana
+        if self._todo_dia or self._toda_semana:
+            return en_mes and en_semana
+        return en_mes or en_semana
+
+    def coincide(self, momento):
+        return (momento.minute in self.minutos and momento.hour in self.horas
+                and momento.month in self.meses and self._dia_coincide(momento))
+
+    def siguiente(self, despues_de):
+        """Primer minuto estrictamente posterior a 'despues_de' que cumple el horario."""
+        momento = despues_de.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        limite = momento + timedelta(days=366 * 5)
+        while momento < limite:
+            if momento.month not in self.meses:
+                # Primer día del mes siguiente
+                momento = (momento.replace(day=1, hour=0, minute=0) + timedelta(days=32)).replace(day=1)
+            elif not self._dia_coincide(momento):
+                momento = momento.replace(hour=0, minute=0) + timedelta(days=1)
+            elif momento.hour not in self.horas:
+                momento = momento.replace(minute=0) + timedelta(hours=1)
+            elif momento.minute not in self.minutos:
+                momento += timedelta(minutes=1)
+            else:
+                return momento
+        raise ValueError(f"Horario '{self.expresion}': no ocurre nunca")
+
+
+class Tarea:
+    def __init__(self, nombre, funcion, cron, descripcion):
+        self.nombre = nombre
+        self.funcion = funcion
+        self.cron = cron  # None: desactivada (solo se ejecuta a mano)
+        self.descripcion = descripcion
+
+
+class ProgramadorTareas:
+    """Ejecuta las tareas registradas según su horario, en un solo proceso (el líder).
+
+    Se inicializa como las demás extensiones (``init_app``); las tareas se
+    registran con el decorador ``tarea``. Configuración:
+
+    * ``PROGRAMADOR_ACTIVO``: permite desactivar el programador.
+    * ``TAREAS_CRON``: horario de cada tarea, por nombre ('' la desactiva).
+    * ``PROGRAMADOR_INTERVALO_S``: cada cuántos segundos se revisan los horarios.
+    * ``PROGRAMADOR_LIDERAZGO_S``: plazo del líder; si no lo renueva, otro proceso toma su lugar.
+    * ``PROGRAMADOR_RECUPERAR_MIN``: una ejecución perdida (proceso caído) se recupera
+      si no han pasado más de estos minutos; si no, se espera a la siguiente.
+    """
+
+    def __init__(self, app=None, **kwargs):
+        self.activo = False
+        self.intervalo = 30
+        self.liderazgo = timedelta(seconds=90)
+        self.recuperar = timedelta(minutes=120)
+        self.instancia = f'{socket.gethostname()}:{os.getpid()}:{secrets.token_hex(3)}'
+        self.es_lider = False
+        self.iniciado = False
+        self._tareas = {}
+        self._en_curso = set()
+        if app is not None:
+            self.init_app(app, **kwargs)
+
+    def init_app(self, app, socketio, db, bloqueo, ejecucion, reloj=None):
+        """'bloqueo' y 'ejecucion' son los modelos de 'bloqueo_programador' y 'ejecucion_tarea'.
+        'reloj()' entrega la hora actual con la misma zona horaria que los horarios.
+        """
+        self.app = app
+        self.socketio = socketio
+        self.db = db
+        self.Bloqueo = bloqueo
+        self.Ejecucion = ejecucion
+        self._reloj = reloj or datetime.now
+        self.activo = app.config.get('PROGRAMADOR_ACTIVO', True)
+        self.intervalo = app.config.get('PROGRAMADOR_INTERVALO_S', 30)
+        self.liderazgo = timedelta(seconds=app.config.get('PROGRAMADOR_LIDERAZGO_S', 90))
+        self.recuperar = timedelta(minutes=app.config.get('PROGRAMADOR_RECUPERAR_MIN', 120))
+        self._tareas = {}
+        app.extensions['programador_tareas'] = self
+        if self.activo:
+            self._iniciar()
+
+    def tarea(self, nombre, descripcion=''):
+        """Decorador: registra una tarea con el horario de TAREAS_CRON[nombre].
+
+        La función se ejecuta dentro de un contexto de la app y puede devolver un
+        texto breve con el resultado, que queda en el historial.
+        """
+        def decorador(funcion):
+            expresion = (self.app.config.get('TAREAS_CRON') or {}).get(nombre) or ''
+            cron = Cron(expresion) if expresion.strip() else None
+            self._tareas[nombre] = Tarea(nombre, funcion, cron, descripcion)
+            return funcion
+        return decorador
+
+    @property
+    def tareas(self):
+        return dict(self._tareas)
+
+    # --- BUCLE DEL PROGRAMADOR ---
+    def _iniciar(self):
+        # Solo en el worker eventlet (wsgi.py), no en 'flask db upgrade' ni en la CLI
+        try:
+            from eventlet import patcher
+        except ImportError:
+            return
+        if self.iniciado or not patcher.is_monkey_patched('thread'):
+            return
+        self.iniciado = True
+        self.socketio.start_background_task(self._bucle)
+
+    def _bucle(self):
+        while True:
+            self.socketio.sleep(self.intervalo)
+            with self.app.app_context():
+                try:
+                    self.revisar()
+                except Exception:
+                    self.db.session.rollback()
+                    self.app.logger.exception('Error en el programador de tareas')
+
+    def revisar(self):
+        """Una vuelta del programador: renueva el liderazgo y lanza las tareas pendientes."""
+        if not self._renovar_liderazgo():
+            return
+        ahora = self._reloj()
+        for tarea in list(self._tareas.values()):
+            if tarea.cron is None or tarea.nombre in self._en_curso:
+                continue
+            programada = self.proxima(tarea, ahora)
+            if programada <= ahora:
+                ejecucion_id = self._reservar(tarea, programada)
+                if ejecucion_id is not None:
+                    self._en_curso.add(tarea.nombre)
+                    self.socketio.start_background_task(self._ejecutar_en_fondo, tarea, ejecucion_id)
+
+    def _ejecutar_en_fondo(self, tarea, ejecucion_id):
+        with self.app.app_context():
+            try:
+                self._ejecutar(tarea, ejecucion_id)
+            finally:
+                self._en_curso.discard(tarea.nombre)
+
+    # --- LIDERAZGO ---
+    def _renovar_liderazgo(self):
+        # El plazo va en UTC: en hora de Chile el cambio de horario lo alargaría una hora
+        ahora = datetime.now(timezone.utc).replace(tzinfo=None)
+        Bloqueo = self.Bloqueo
+        renovado = self.db.session.execute(
+            update(Bloqueo)
+            .where(Bloqueo.nombre == NOMBRE_BLOQUEO,
+                   or_(Bloqueo.instancia == self.instancia, Bloqueo.vence < ahora))
+            .values(instancia=self.instancia, vence=ahora + self.liderazgo)
+        ).rowcount == 1
+        if not renovado and self.db.session.get(Bloqueo, NOMBRE_BLOQUEO) is None:
+            self.db.session.add(Bloqueo(nombre=NOMBRE_BLOQUEO, instancia=self.instancia, vence=ahora + self.liderazgo))
+            renovado = True
+        try:
+            self.db.session.commit()
+        except IntegrityError:
+            # Otro proceso creó la fila al mismo tiempo: él es el líder
+            self.db.session.rollback()
+            renovado = False
+
+        if renovado and not self.es_lider:
+            self.app.logger.info(f'Programador de tareas: {self.instancia} es ahora el líder')
+            self._marcar_interrumpidas()
+        self.es_lider = renovado
+        return renovado
+
+    def _marcar_interrumpidas(self):
+        # Las ejecuciones que dejó a medias un líder anterior (proceso caído). Las
+        # ejecuciones a mano corren en otro proceso (la CLI), que puede seguir vivo
+        Ejecucion = self.Ejecucion
+        self.db.session.execute(
+            update(Ejecucion)
+            .where(Ejecucion.estado == 'en_curso', Ejecucion.instancia != self.instancia,
+                   Ejecucion.instancia.notlike(f'{MANUAL}%'))
+            .values(estado='interrumpida', fin=self._reloj())
+        )
+        self.db.session.commit()
+
+    # --- EJECUCIONES ---
+    def ultima(self, nombre, programada=False):
+        """Última ejecución registrada de una tarea (o None); con 'programada', sin las hechas a mano."""
+        consulta = self.Ejecucion.query.filter_by(tarea=nombre)
+        if programada:
+            consulta = consulta.filter(self.Ejecucion.instancia.notlike(f'{MANUAL}%'))
+        return consulta.order_by(self.Ejecucion.programada.desc()).first()
+
+    def proxima(self, tarea, ahora):
+        """Próxima hora programada de la tarea, a partir de su última ejecución según el horario.
+
+        Puede estar en el pasado: es una ejecución perdida que aún se puede recuperar.
+        """
+        ultima = self.ultima(tarea.nombre, programada=True)
+        desde = max(ultima.programada, ahora - self.recuperar) if ultima else ahora
+        programada = tarea.cron.siguiente(desde)
+        # Si se perdieron varias, solo se recupera la más reciente
+        while programada <= ahora:
+            siguiente = tarea.cron.siguiente(programada)
+            if siguiente > ahora:
+                break
+            programada = siguiente
+        return programada
+
+    def _reservar(self, tarea, programada, instancia=None):
+        """Registra la ejecución 'en_curso'; None si otro proceso ya la registró."""
+        ejecucion = self.Ejecucion(tarea=tarea.nombre, programada=programada, inicio=self._reloj(),
+                                   estado='en_curso', instancia=instancia or self.instancia)
+        self.db.session.add(ejecucion)
+        try:
+            self.db.session.commit()
+        except IntegrityError:
+            self.db.session.rollback()
+            return None
+        return ejecucion.id
+
+    def _ejecutar(self, tarea, ejecucion_id):
+        self.app.logger.info(f"Tarea '{tarea.nombre}' iniciada")
+        try:
+            detalle = tarea.funcion()
+            estado = 'ok'
+        except Exception as error:
+            self.db.session.rollback()
+            self.app.logger.exception(f"Error en la tarea '{tarea.nombre}'")
+            detalle, estado = f'{type(error).__name__}: {error}', 'error'
+
+        ejecucion = self.db.session.get(self.Ejecucion, ejecucion_id)
+        ejecucion.estado = estado
+        ejecucion.fin = self._reloj()
+        ejecucion.detalle = str(detalle)[:500] if detalle is not None else None
+        self.db.session.commit()
+        self.app.logger.info(f"Tarea '{tarea.nombre}' terminada ({estado}): {ejecucion.detalle or ''}")
+        return ejecucion
+
+    def ejecutar_ahora(self, nombre, origen='cli'):
+        """Ejecuta una tarea de inmediato en este contexto (p. ej. desde la CLI) y devuelve su ejecución.
+
+        Queda registrada con la instancia 'manual:<origen>' y no cambia el horario de la tarea.
+        """
+        tarea = self._tareas[nombre]
+        ejecucion_id = self._reservar(tarea, self._reloj().replace(microsecond=0), f'{MANUAL}:{origen}')
+        if ejecucion_id is None:
+            return None
+        return self._ejecutar(tarea, ejecucion_id)
+
+    # --- CONSULTAS (dashboard) ---
+    def resumen(self, historial=15):
+        """Horario, próxima y última ejecución de cada tarea, y las ejecuciones más recientes."""
+        ahora = self._reloj()
+        tareas = []
+        for tarea in self._tareas.values():
+            ultima = self.ultima(tarea.nombre)
+            tareas.append({
+                'nombre': tarea.nombre,
+                'descripcion': tarea.descripcion,
+                'horario': tarea.cron.expresion if tarea.cron else None,
+                'proxima': self.proxima(tarea, ahora) if tarea.cron else None,
+                'ultima': ultima,
+            })
+        return {
+            'activo': self.iniciado,
+            'es_lider': self.es_lider,
+            'instancia': self.instancia,
+            'tareas': tareas,
+            'historial': self.Ejecucion.query.order_by(self.Ejecucion.id.desc()).limit(historial).all(),
+        }
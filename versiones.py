@@ -0,0 +1,157 @@
+# versiones.py
+# Versiones de la cola y caché de las vistas públicas (pantalla y seguimiento móvil).
+#
+# Cada cambio de estado de los tickets incrementa un contador en memoria: uno global,
+# otro por sede (lo que muestra la pantalla pública de esa sede) y otro por servicio
+# (lo que ve un teléfono en su página de seguimiento). Con esos contadores:
+#   * se arma un ETag barato: si el navegador ya tiene esa versión, responde 304
+#     sin consultar la base de datos ni renderizar;
+#   * se guarda por unos segundos el HTML ya renderizado para esa versión, así una
+#     ola de reconexiones de pantallas o teléfonos cuesta casi nada;
+#   * las consultas de seguimiento "long-poll" esperan a que cambie la versión de
+#     su servicio en vez de preguntar una y otra vez.
+#
+# Los contadores viven en el proceso (la app corre en un solo worker). El 'nonce'
+# de arranque hace que un ETag de antes de un reinicio nunca coincida con uno nuevo.
+
+import secrets
+import threading
+import time
+from collections import OrderedDict, defaultdict
+
+from flask import request, make_response
+
+from metricas import encabezado, linea
+
+
+class CacheVistas:
+    """Versiones de la cola, ETags y caché de HTML renderizado por versión.
+
+    Se inicializa como las demás extensiones (``init_app``). Configuración:
+
+    * ``CACHE_VISTAS_TTL_S``: segundos que se reutiliza un HTML renderizado.
+    * ``CACHE_VISTAS_MAX``: cantidad máxima de páginas guardadas.
+    """
+
+    def __init__(self, app=None):
+        self.nonce = secrets.token_hex(4)
+        self.ttl = 30
+        self.maximo = 2000
+        self._lock = threading.Lock()
+        self._global = 0
+        self._epoca = 0  # Cambios que afectan a todos los servicios
+        self._por_servicio = defaultdict(int)
+        self._por_sede = defaultdict(int)
+        self._fragmentos = OrderedDict()  # (clave, versión) -> (expira, html)
+        self._esperando = defaultdict(set)  # servicio_id -> eventos de quienes esperan un cambio
+        self.aciertos = {'304': 0, 'html': 0, 'render': 0}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.ttl = app.config.get('CACHE_VISTAS_TTL_S', 30)
+        self.maximo = app.config.get('CACHE_VISTAS_MAX', 2000)
+        app.extensions['cache_vistas'] = self
+
+    def cambio(self, servicio_id=None, sede_id=None):
+        """Registra un cambio de estado; sin servicio ni sede, afecta a todos."""
+        with self._lock:
+            self._global += 1
+            if sede_id is not None:
+                self._por_sede[sede_id] += 1
+            if servicio_id is None and sede_id is not None:
+                eventos = []
+            elif servicio_id is None:
+                self._epoca += 1
+                eventos = [e for esperando in self._esperando.values() for e in esperando]
+            else:
+                self._por_servicio[servicio_id] += 1
+                eventos = list(self._esperando.get(servicio_id, ()))
+        for evento in eventos:
+            evento.set()
+
+    def version(self, servicio_id=None, sede_id=None):
+        """Versión global, o la de un servicio o una sede (que también cambian con los cambios globales)."""
+        with self._lock:
+            if sede_id is not None:
+                return f'{self.nonce}.{self._epoca}.s{self._por_sede[sede_id]}'
+            if servicio_id is None:
+                return f'{self.nonce}.{self._global}'
+            return self._version_servicio(servicio_id)
+
+    def version_servicios(self):
+        """Solo cambia con los cambios globales (servicios creados, editados o eliminados; cierre de jornada)."""
+        with self._lock:
+            return f'{self.nonce}.{self._epoca}'
+
+    def _version_servicio(self, servicio_id):
+        return f'{self.nonce}.{self._epoca}.{self._por_servicio[servicio_id]}'
+
+    def esperar_cambio(self, servicio_id, version, segundos, crear_evento):
+        """Espera (sin bloquear el hub) hasta que la versión del servicio deje de ser 'version'.
+
+        'crear_evento' debe entregar un Event acorde al modo asíncrono (el de Socket.IO).
+        Devuelve False si se cumplió el plazo sin cambios.
+        """
+        evento = crear_evento()
+        with self._lock:
+            if self._version_servicio(servicio_id) != version:
+                return True
+            self._esperando[servicio_id].add(evento)
+        try:
+            return evento.wait(segundos)
+        finally:
+            with self._lock:
+                self._esperando[servicio_id].discard(evento)
+
+    def responder(self, clave, version, generar):
+        """Responde 304 si el navegador tiene la versión; si no, HTML de la caché o de 'generar()'."""
+        etag = f'{clave}-{version}'
+        if request.if_none_match.contains_weak(etag):
+            respuesta = make_response('', 304)
+            self._contar('304')
+        else:
+            respuesta = make_response(self._html(clave, version, generar, contar=True))
+        respuesta.set_etag(etag, weak=True)
+        respuesta.headers['Cache-Control'] = 'no-cache'  # El navegador guarda, pero siempre revalida
+        return respuesta
+
+    def fragmento(self, clave, version, generar):
+        """HTML de un trozo de plantilla, reutilizado mientras no cambie 'version'."""
+        return self._html(clave, version, generar, contar=False)
+
+    def _html(self, clave, version, generar, contar):
+        ahora = time.monotonic()
+        with self._lock:
+            guardado = self._fragmentos.get((clave, version))
+            if guardado and guardado[0] > ahora:
+                self._fragmentos.move_to_end((clave, version))
+                if contar:
+                    self.aciertos['html'] += 1
+                return guardado[1]
+
+        html = generar()
+        with self._lock:
+            if contar:
+                self.aciertos['render'] += 1
+            self._fragmentos[(clave, version)] = (ahora + self.ttl, html)
+            self._fragmentos.move_to_end((clave, version))
+            while len(self._fragmentos) > self.maximo:
+                self._fragmentos.popitem(last=False)
+        return html
+
+    def _contar(self, tipo):
+        with self._lock:
+            self.aciertos[tipo] += 1
+
+    def lineas_prometheus(self):
+        with self._lock:
+            lineas = encabezado('turnos_cache_vistas_total', 'counter',
+                                'Respuestas de las vistas públicas: 304, HTML de la caché o renderizado.')
+            for tipo, cantidad in sorted(self.aciertos.items()):
+                lineas.append(linea('turnos_cache_vistas_total', cantidad, resultado=tipo))
+            lineas += encabezado('turnos_cache_vistas_paginas', 'gauge', 'Páginas renderizadas guardadas en memoria.')
+            lineas.append(linea('turnos_cache_vistas_paginas', len(self._fragmentos)))
+            lineas += encabezado('turnos_seguimiento_esperando', 'gauge', 'Consultas de seguimiento esperando un cambio (long-poll).')
+            lineas.append(linea('turnos_seguimiento_esperando', sum(len(e) for e in self._esperando.values())))
+        return lineas